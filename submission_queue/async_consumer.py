@@ -0,0 +1,236 @@
+"""
+Single-process consumer that serves every push queue from one asyncio event loop.
+
+The process-per-queue `Worker` model costs a Django stack and a database
+connection per queue even when the queue is idle. `AsyncConsumer` instead runs
+`concurrency` coroutines per queue in one loop. The blocking work is handed to
+two bounded thread pools: one for database access, so the number of connections
+is capped at ASYNC_CONSUMER_DB_THREADS, and one for grader and LMS HTTP calls,
+which caps the gradings in flight across all queues at ASYNC_CONSUMER_HTTP_THREADS.
+A single coroutine watches the arrival counters of all queues and wakes the
+coroutines of a queue when `submit` signals new work.
+
+On SIGTERM the consumer stops claiming submissions and gives the gradings in
+flight up to CONSUMER_SHUTDOWN_TIMEOUT seconds to finish, as `Worker` does.
+Submissions still unfinished at the deadline are released, and the process
+exits without waiting for the requests still blocking threads of the HTTP pool.
+"""
+import asyncio
+import functools
+import logging
+import os
+import signal
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.utils import timezone
+
+from submission_queue import notify
+from submission_queue.consumer import claim_push_submission, push_submission, save_push_outcome
+from submission_queue.models import Submission
+
+try:
+    import newrelic.agent
+except ImportError:  # pragma: no cover
+    newrelic = None  # pylint: disable=invalid-name
+
+log = logging.getLogger(__name__)
+
+
+class AsyncConsumer:
+    """
+    Deliver submissions for many push queues from a single event loop.
+
+    Arguments:
+        queues: dict of queue name to push configuration, as returned by
+            `consumer.push_queue_config`
+        coordinator: optional `cluster.QueueCoordinator`; when given, only the
+            queues it assigns to this node are served
+    """
+    def __init__(self, queues, db_threads=None, http_threads=None, coordinator=None):
+        self.queues = queues
+        self.coordinator = coordinator
+        self._db_pool = ThreadPoolExecutor(db_threads or settings.ASYNC_CONSUMER_DB_THREADS,
+                                           thread_name_prefix='consumer-db')
+        self._http_pool = ThreadPoolExecutor(http_threads or settings.ASYNC_CONSUMER_HTTP_THREADS,
+                                             thread_name_prefix='consumer-http')
+        self.stopping = False
+        self.abandoned = False
+        self._stopped = None
+        self._in_flight = set()
+        self._arrivals = {}
+        self._arrived = {}
+        if newrelic:
+            self._push = newrelic.agent.BackgroundTaskWrapper(push_submission)
+        else:
+            self._push = push_submission
+
+    def run(self):
+        """
+        Run the consumer until it is interrupted
+        """
+        log.info(f"Starting asyncio consumer for queues {', '.join(self.queues)}")
+        try:
+            asyncio.run(self.serve())
+        finally:
+            if self.coordinator:
+                self.coordinator.leave()
+            self._db_pool.shutdown(wait=False)
+            self._http_pool.shutdown(wait=False)
+        log.info("Asyncio consumer stopped")
+        if self.abandoned:
+            # The interpreter would otherwise join the HTTP pool on exit,
+            # waiting for the very requests we gave up on.
+            logging.shutdown()
+            os._exit(0)  # pylint: disable=protected-access
+
+    async def serve(self):
+        """
+        Drain every configured queue concurrently until stopped, giving the
+        gradings in flight CONSUMER_SHUTDOWN_TIMEOUT seconds to finish
+        """
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, self.stop)
+        self._stopped = asyncio.Event()
+        self._arrivals = await self._in_db(self._arrival_counts)
+        self._arrived = {queue_name: asyncio.Event() for queue_name in self.queues}
+
+        stopped = asyncio.create_task(self._stopped.wait())
+        background = [stopped, asyncio.create_task(self.watch_arrivals())]
+        if self.coordinator:
+            background.append(asyncio.create_task(self.coordinate()))
+        drains = asyncio.gather(*[
+            self.drain(queue_name, config['endpoints'], config['deadline'])
+            for queue_name, config in self.queues.items()
+            for _ in range(config['concurrency'])
+        ])
+        try:
+            await asyncio.wait([drains, stopped], return_when=asyncio.FIRST_COMPLETED)
+            if not drains.done():
+                log.info(f"Asyncio consumer finishing {len(self._in_flight)} gradings")
+                await asyncio.wait([drains], timeout=settings.CONSUMER_SHUTDOWN_TIMEOUT)
+            if drains.done():
+                drains.result()
+            else:
+                unfinished = list(self._in_flight)
+                drains.cancel()
+                self.abandoned = True
+                await self._in_db(self._release_unfinished, unfinished)
+        finally:
+            for task in background:
+                task.cancel()
+
+    def stop(self):
+        """
+        Stop claiming submissions; gradings in flight are allowed to finish
+        """
+        log.info("Stopping asyncio consumer")
+        self.stopping = True
+        if self._stopped:
+            self._stopped.set()
+        for arrived in self._arrived.values():
+            arrived.set()
+
+    def _release_unfinished(self, unfinished):
+        """
+        Make submissions whose grading did not finish before the shutdown
+        deadline available again, as `Worker._release_unfinished` does
+        """
+        if unfinished:
+            log.warning(f"Releasing unfinished submissions {unfinished}")
+            Submission.objects.filter(id__in=unfinished, retired=False).update(lease_expires_at=timezone.now())
+
+    async def watch_arrivals(self):
+        """
+        Poll the arrival counters at the notifier's poll interval and wake the
+        coroutines waiting on any queue whose counter moved
+        """
+        interval = notify.poll_interval()
+        while True:
+            await asyncio.sleep(interval)
+            counts = await self._in_db(self._arrival_counts)
+            for queue_name, count in counts.items():
+                if count != self._arrivals.get(queue_name):
+                    self._arrivals[queue_name] = count
+                    self._arrived[queue_name].set()
+                    self._arrived[queue_name] = asyncio.Event()
+
+    async def coordinate(self):
+        """
+        Renew this node's share of the queues every CONSUMER_HEARTBEAT_INTERVAL seconds
+        """
+        while True:
+            try:
+                await self._in_db(self.coordinator.sync)
+            except Exception:  # pylint: disable=broad-except
+                log.exception("Could not sync queue ownership")
+            await asyncio.sleep(settings.CONSUMER_HEARTBEAT_INTERVAL)
+
+    def _serves(self, queue_name):
+        return self.coordinator is None or queue_name in self.coordinator.owned
+
+    def _arrival_counts(self):
+        return notify.get_arrival_counts(list(self.queues))
+
+    async def drain(self, queue_name, endpoints, deadline=None):
+        """
+        Deliver submissions from one queue while there are any, then wait for an
+        arrival signal. As in `Worker._drain`, the fallback interval between
+        database checks doubles from CONSUMER_DELAY up to CONSUMER_MAX_DELAY,
+        if arrival signals reach this process.
+        """
+        interval = settings.CONSUMER_DELAY
+        max_interval = settings.CONSUMER_MAX_DELAY if notify.notifications_are_shared() else settings.CONSUMER_DELAY
+        while not self.stopping:
+            # Take the event before looking in the database so that an arrival
+            # in between wakes the wait below straight away.
+            arrived = self._arrived[queue_name]
+            if not self._serves(queue_name):
+                await asyncio.sleep(settings.CONSUMER_HEARTBEAT_INTERVAL)
+                continue
+
+            try:
+                delivered = await self.deliver_submission(queue_name, endpoints, deadline)
+            except Exception:  # pylint: disable=broad-except
+                # A process-per-queue Worker would be restarted by run_consumer;
+                # here one queue's failure must not stop the others.
+                log.exception(f"Delivery for queue {queue_name} failed")
+                delivered = False
+
+            if delivered:
+                interval = settings.CONSUMER_DELAY
+                continue
+
+            try:
+                await asyncio.wait_for(arrived.wait(), interval)
+            except asyncio.TimeoutError:
+                interval = min(interval * 2, max_interval)
+
+    async def deliver_submission(self, queue_name, endpoints, deadline=None):
+        """
+        Claim a submission for one of `endpoints`, a list of (url, weight)
+        pairs, push it to that grader, within `deadline` seconds, and save the
+        outcome
+
+        Returns:
+            delivered: Flag indicating whether there was a submission to deliver (Boolean)
+        """
+        if self.stopping:
+            return False
+
+        submission = await self._in_db(claim_push_submission, queue_name, endpoints, deadline)
+        if not submission:
+            return False
+
+        self._in_flight.add(submission.id)
+        try:
+            await self._in_http(self._push, submission, submission.grader_id, deadline)
+            await self._in_db(save_push_outcome, submission)
+        finally:
+            self._in_flight.discard(submission.id)
+        return True
+
+    async def _in_db(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._db_pool, functools.partial(func, *args))
+
+    async def _in_http(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._http_pool, functools.partial(func, *args))
@@ -0,0 +1,81 @@
+"""
+Sharing the push queues between run_consumer nodes on several hosts.
+
+Every node sends a heartbeat to the ConsumerNode table and, from the set of live
+nodes, works out which node should serve each queue by rendezvous hashing. All
+nodes see the same live set, so they agree on the split without talking to each
+other, and only the queues of a node that joins or dies move. A node serves a
+queue only while it holds the queue's QueueLease, which it renews on every
+heartbeat; when a node dies its leases expire and the new owners take over,
+and its ConsumerNode row is eventually deleted by the nodes still alive.
+"""
+import hashlib
+import logging
+import os
+import socket
+from datetime import timedelta
+
+from django.conf import settings
+
+from submission_queue.models import ConsumerNode, QueueLease
+
+log = logging.getLogger(__name__)
+
+# Nodes that have missed this many CONSUMER_NODE_TIMEOUTs are deleted; until
+# then they are only left out of the live set.
+DEAD_NODE_TIMEOUTS = 10
+
+
+def default_node_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def rendezvous_owner(queue_name, node_ids):
+    '''
+    The node that should serve `queue_name`: the one with the highest hash of
+    (queue, node). Removing a node only moves the queues it owned.
+    '''
+    def weight(node_id):
+        return hashlib.sha1(f'{queue_name}:{node_id}'.encode('utf-8')).hexdigest()
+    return max(node_ids, key=weight)
+
+
+class QueueCoordinator:
+    """
+    Keeps this node's share of the push queues up to date.
+
+    Call `sync` every CONSUMER_HEARTBEAT_INTERVAL seconds; it returns the set of
+    queues this node owns until the next call. Call `leave` on shutdown so that
+    other nodes take over straight away instead of waiting for leases to expire.
+    """
+    def __init__(self, queue_names, node_id=None):
+        self.queue_names = list(queue_names)
+        self.node_id = node_id or default_node_id()
+        self.owned = set()
+
+    def sync(self):
+        node_timeout = timedelta(seconds=settings.CONSUMER_NODE_TIMEOUT)
+        ConsumerNode.objects.heartbeat(self.node_id)
+        ConsumerNode.objects.prune(node_timeout * DEAD_NODE_TIMEOUTS)
+        live_nodes = set(ConsumerNode.objects.live_node_ids(node_timeout))
+        live_nodes.add(self.node_id)
+        lease = timedelta(seconds=settings.CONSUMER_QUEUE_LEASE_SECONDS)
+
+        owned = set()
+        for queue_name in self.queue_names:
+            if rendezvous_owner(queue_name, live_nodes) == self.node_id:
+                if QueueLease.objects.acquire(queue_name, self.node_id, lease):
+                    owned.add(queue_name)
+            elif queue_name in self.owned:
+                QueueLease.objects.release(queue_name, self.node_id)
+
+        if owned != self.owned:
+            log.info(f"Consumer node {self.node_id} now serves queues: {', '.join(sorted(owned)) or 'none'}")
+        self.owned = owned
+        return owned
+
+    def leave(self):
+        for queue_name in self.owned:
+            QueueLease.objects.release(queue_name, self.node_id)
+        ConsumerNode.objects.filter(node_id=self.node_id).delete()
+        self.owned = set()
@@ -2,13 +2,22 @@
 import json
 import logging
 import multiprocessing
+import os
+import random
+import signal
+import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import urlparse
+from submission_queue import http_client, notify
 from submission_queue.models import Submission
 
-import requests
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 from django.utils import timezone
-from requests.exceptions import ConnectionError, Timeout
+from requests.exceptions import ConnectionError, RequestException, Timeout
 
 try:
     import newrelic.agent
@@ -19,9 +28,9 @@ except ImportError:  # pragma: no cover
 log = logging.getLogger(__name__)
 
 
-def post_failure_to_lms(header):
+def failure_reply():
     '''
-    Send notification to the LMS (and the student) that the submission has failed,
+    Grader reply telling the LMS (and the student) that the submission has failed,
         and that the problem should be resubmitted
     '''
 
@@ -36,7 +45,15 @@ def post_failure_to_lms(header):
     failure_msg = {'correct': None,
                    'score': 0,
                    'msg': msg}
-    return post_grade_to_lms(header, json.dumps(failure_msg))
+    return json.dumps(failure_msg)
+
+
+def post_failure_to_lms(header):
+    '''
+    Send notification to the LMS (and the student) that the submission has failed,
+        and that the problem should be resubmitted
+    '''
+    return post_grade_to_lms(header, failure_reply())
 
 
 def post_grade_to_lms(header, body):
@@ -48,44 +65,137 @@ def post_grade_to_lms(header, body):
     Returns:
         success: Flag indicating successful exchange (Boolean)
     '''
-    header_dict = json.loads(header)
-    lms_callback_url = header_dict['lms_callback_url']
+    return get_delivery_engine().deliver(header, body)
 
-    payload = {'xqueue_header': header, 'xqueue_body': body}
 
-    # Quick kludge retries to fix prod problem with 6.00x push graders. We're
-    # seeing abrupt disconnects when servers are taken out of the ELB, causing
-    # in flight lms_ack requests to fail. This just tries five times before
-    # giving up.
-    attempts = 0
-    success = False
-    while (not success) and attempts < 5:
-        (success, lms_reply) = _http_post(lms_callback_url,
-                                          payload,
-                                          settings.REQUESTS_TIMEOUT)
-        attempts += 1
+class DeliveryEngine:
+    """
+    Delivers grades to LMS callback URLs.
 
-    if not success:
-        log.error(f"Unable to return to LMS: lms_callback_url: {lms_callback_url}, payload: {payload}, lms_reply: {lms_reply}")
+    Failed posts are retried up to LMS_DELIVERY_ATTEMPTS times with exponential
+    backoff and full jitter, so that retries from many deliveries spread out
+    instead of hammering an LMS that is already struggling. At most
+    LMS_DELIVERY_MAX_PER_HOST posts are in flight to any one LMS host, and
+    `map` runs batches of deliveries on a pool of LMS_DELIVERY_WORKERS threads.
+    """
+    def __init__(self, max_workers, max_per_host, attempts, backoff_base, backoff_max):
+        self.max_per_host = max_per_host
+        self.attempts = attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.pid = os.getpid()
+
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='lms-delivery')
+        self._host_slots = {}
+        self._host_slots_lock = threading.Lock()
+
+    def deliver(self, header, body):
+        """
+        Post a grade to the LMS callback URL in `header`, retrying with backoff
+
+        Returns:
+            success: Flag indicating successful exchange (Boolean)
+        """
+        header_dict = json.loads(header)
+        lms_callback_url = header_dict['lms_callback_url']
+
+        payload = {'xqueue_header': header, 'xqueue_body': body}
 
-    return success
+        success = False
+        for attempt in range(self.attempts):
+            if attempt:
+                time.sleep(self.backoff_delay(attempt))
+            with self._host_slot(lms_callback_url):
+                (success, lms_reply) = _http_post(lms_callback_url,
+                                                  payload,
+                                                  settings.REQUESTS_TIMEOUT)
+            if success:
+                break
 
+        if not success:
+            log.error(f"Unable to return to LMS: lms_callback_url: {lms_callback_url}, payload: {payload}, lms_reply: {lms_reply}")
 
-def _http_post(url, data, timeout):
+        return success
+
+    def map(self, func, items):
+        """
+        Run func(item) for every item on the delivery pool
+
+        Returns a list of results in the order of `items`
+        """
+        return list(self._pool.map(func, items))
+
+    def backoff_delay(self, attempt):
+        """
+        Seconds to wait before retry number `attempt` (1-based): a random delay
+        of up to backoff_base * 2**(attempt - 1), capped at backoff_max
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+    def _host_slot(self, url):
+        """
+        Semaphore limiting concurrent posts to the host of `url`
+        """
+        host = urlparse(url).netloc
+        with self._host_slots_lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._host_slots[host]
+
+
+_delivery_engine = None
+
+
+def get_delivery_engine():
+    '''
+    The DeliveryEngine for this process, built from settings on first use.
+    Worker processes are forked, so an engine inherited from a parent is rebuilt.
+    '''
+    global _delivery_engine  # pylint: disable=global-statement
+    if _delivery_engine is None or _delivery_engine.pid != os.getpid():
+        _delivery_engine = DeliveryEngine(
+            max_workers=settings.LMS_DELIVERY_WORKERS,
+            max_per_host=settings.LMS_DELIVERY_MAX_PER_HOST,
+            attempts=settings.LMS_DELIVERY_ATTEMPTS,
+            backoff_base=settings.LMS_DELIVERY_BACKOFF_BASE,
+            backoff_max=settings.LMS_DELIVERY_BACKOFF_MAX,
+        )
+    return _delivery_engine
+
+
+def _http_post(url, data, timeout, deadline=None):
     '''
     Contact external grader server, but fail gently.
 
+    `timeout` bounds connecting and each wait for data from the server. An
+    optional `deadline`, in seconds, bounds the whole exchange by the clock:
+    the connection is shut down once it has passed, so a server that trickles
+    its headers or reply cannot hold the caller indefinitely.
+
     Returns (success, msg), where:
         success: Flag indicating successful exchange (Boolean)
         msg: Accompanying message; Grader reply when successful (string)
     '''
-    if settings.REQUESTS_BASIC_AUTH is not None:
-        auth = requests.auth.HTTPBasicAuth(*settings.REQUESTS_BASIC_AUTH)
-    else:
-        auth = None
+    if deadline is None:
+        return _post_to_grader(url, data, timeout)
 
+    with http_client.deadline(deadline) as watchdog:
+        try:
+            result = _post_to_grader(url, data, min(timeout, deadline))
+        except RequestException:
+            if not watchdog.expired:
+                raise
+            result = None
+
+    if watchdog.expired:
+        log.error(f'Server {url} did not reply within deadline={deadline:f}')
+        return (False, 'grading deadline exceeded')
+    return result
+
+
+def _post_to_grader(url, data, timeout):
     try:
-        r = requests.post(url, data=data, auth=auth, timeout=timeout, verify=False)
+        r = http_client.post(url, data=data, auth=http_client.basic_auth(), timeout=timeout, verify=False)
     except (ConnectionError, Timeout):
         log.error(f'Could not connect to server at {url} in timeout={timeout:f}')
         return (False, 'cannot connect to server')
@@ -97,69 +207,503 @@ def _http_post(url, data, timeout):
     return (True, r.text)
 
 
+def push_queue_config(value, queue_name=None):
+    '''
+    Normalize an XQUEUES entry. Pull queues (None) return None. A push queue is
+    given as a grader URL, as a list of endpoints, or as a dict like
+    {'url': URL, 'concurrency': 10} or {'urls': [...], 'concurrency': 10}. An
+    endpoint is a URL or a dict like {'url': URL, 'weight': 2}.
+
+    Returns a dict with 'endpoints' (list of (url, weight) pairs), 'url' (the
+    first endpoint's URL), 'concurrency' (how many gradings the consumer keeps
+    in flight) and 'deadline' (the most seconds a grading request may take,
+    GRADING_DEADLINE unless the dict gives one). Given the `queue_name`, the
+    deadline must also be shorter than the queue's lease.
+    '''
+    if value is None:
+        return None
+
+    if isinstance(value, str):
+        value = {'url': value}
+    elif isinstance(value, (list, tuple)):
+        value = {'urls': value}
+
+    config = {'concurrency': 1, 'deadline': settings.GRADING_DEADLINE}
+    config.update(value)
+
+    urls = config.pop('urls', None) or ([config['url']] if config.get('url') else [])
+    if not urls:
+        raise ImproperlyConfigured(f'Push queue configuration {value!r} has no url')
+
+    endpoints = []
+    for endpoint in urls:
+        if isinstance(endpoint, str):
+            endpoint = {'url': endpoint}
+        weight = endpoint.get('weight', 1)
+        if not endpoint.get('url'):
+            raise ImproperlyConfigured(f'Grader endpoint {endpoint!r} has no url')
+        if not isinstance(weight, (int, float)) or weight <= 0:
+            raise ImproperlyConfigured(f'Grader endpoint weight must be a positive number, not {weight!r}')
+        endpoints.append((endpoint['url'], weight))
+
+    if not isinstance(config['concurrency'], int) or config['concurrency'] < 1:
+        raise ImproperlyConfigured(f'Push queue concurrency must be a positive integer, not {config["concurrency"]!r}')
+    if not isinstance(config['deadline'], (int, float)) or config['deadline'] <= 0:
+        raise ImproperlyConfigured(f'Push queue deadline must be a positive number, not {config["deadline"]!r}')
+    if queue_name is not None:
+        lease = Submission.objects.lease_duration(queue_name).total_seconds()
+        if config['deadline'] >= lease:
+            raise ImproperlyConfigured(f'Push queue {queue_name} deadline of {config["deadline"]}s does not fit in '
+                                       f'its {lease:g}s lease; lower the deadline or raise SUBMISSION_LEASE_SECONDS')
+
+    config['endpoints'] = endpoints
+    config['url'] = endpoints[0][0]
+    return config
+
+
+class CircuitBreaker:
+    """
+    Stops dispatching to a grader endpoint that keeps failing.
+
+    The breaker is closed while the grader works. After `failure_threshold`
+    consecutive failed gradings it opens, and workers leave submissions queued
+    instead of claiming them. Once `reset_timeout` seconds have passed it is
+    half-open: a single trial grading is let through, which closes the breaker
+    if it succeeds and opens it again if it fails.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self._opened_at < self.reset_timeout:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def allow_request(self):
+        """
+        Whether a grading may be dispatched now. In the half-open state only one
+        trial is allowed at a time; call `release` if the slot goes unused.
+        """
+        with self._lock:
+            state = self._state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def release(self):
+        """
+        Give back a request slot that was allowed but not used
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    @property
+    def is_open(self):
+        return self.state != self.CLOSED
+
+
+class GraderEndpoint:
+    """
+    Health and load of one grader URL: its circuit breaker, the number of
+    gradings in flight to it, and a moving average of its response time.
+    """
+    LATENCY_SMOOTHING = 0.2
+
+    def __init__(self, url):
+        self.url = url
+        self.breaker = CircuitBreaker(
+            failure_threshold=settings.CIRCUIT_BREAKER_FAILURES,
+            reset_timeout=settings.CIRCUIT_BREAKER_RESET_TIMEOUT,
+        )
+        self.in_flight = 0
+        self.latency = 0.0
+
+    def record_latency(self, seconds):
+        self.latency += self.LATENCY_SMOOTHING * (seconds - self.latency)
+
+
+_grader_endpoints = {}
+_grader_endpoints_lock = threading.Lock()
+
+
+def get_grader_endpoint(worker_url):
+    '''
+    The GraderEndpoint for a grader URL, shared by every worker in this process
+    '''
+    with _grader_endpoints_lock:
+        if worker_url not in _grader_endpoints:
+            _grader_endpoints[worker_url] = GraderEndpoint(worker_url)
+        return _grader_endpoints[worker_url]
+
+
+def choose_endpoint(endpoints):
+    '''
+    Pick the grader to send the next submission to, and count a grading in
+    flight to it.
+
+    An endpoint whose circuit breaker is half-open gets its trial grading first.
+    Otherwise the choice is among endpoints with a closed breaker: the one with
+    the fewest gradings in flight for its weight, then the fastest recently.
+
+    Arguments:
+        endpoints: list of (url, weight) pairs
+
+    Returns:
+        url: The chosen endpoint's URL, or None if every breaker is open
+    '''
+    candidates = [(get_grader_endpoint(url), weight) for url, weight in endpoints]
+    with _grader_endpoints_lock:
+        chosen = None
+        for endpoint, weight in candidates:
+            if endpoint.breaker.state == CircuitBreaker.HALF_OPEN and endpoint.breaker.allow_request():
+                chosen = endpoint
+                break
+        else:
+            healthy = [(endpoint, weight) for endpoint, weight in candidates
+                       if endpoint.breaker.state == CircuitBreaker.CLOSED]
+            if healthy:
+                chosen = min(healthy, key=lambda item: (item[0].in_flight / item[1], item[0].latency))[0]
+
+        if chosen is None:
+            return None
+        chosen.in_flight += 1
+        return chosen.url
+
+
+def _finish_grading(worker_url):
+    endpoint = get_grader_endpoint(worker_url)
+    with _grader_endpoints_lock:
+        endpoint.in_flight -= 1
+
+
+def claim_push_submission(queue_name, endpoints, deadline=None):
+    '''
+    Claim the next submission for the least loaded healthy grader among
+    `endpoints`, a list of (url, weight) pairs. The chosen URL is stored as the
+    submission's grader_id; pass the submission to `push_submission` next,
+    with the same grading `deadline`.
+
+    The submission is leased for long enough to be graded within the deadline
+    and then have its grade posted to the LMS, so no other consumer pushes it
+    again meanwhile (see `push_lease`).
+
+    Returns:
+        submission: The claimed Submission, or None
+    '''
+    worker_url = choose_endpoint(endpoints)
+    if worker_url is None:
+        return None
+
+    lease = push_lease(queue_name, deadline or settings.GRADING_DEADLINE)
+    submission = Submission.objects.claim_unpushed_submission(queue_name, worker_url, lease)
+    if not submission:
+        get_grader_endpoint(worker_url).breaker.release()
+        _finish_grading(worker_url)
+    return submission
+
+
+def push_lease(queue_name, deadline):
+    '''
+    How long to lease a submission pushed from the named queue: the queue's
+    lease, stretched if need be to cover a grading that takes the full
+    `deadline` (seconds) followed by the slowest possible LMS delivery
+    '''
+    return max(Submission.objects.lease_duration(queue_name),
+               timedelta(seconds=deadline + lms_delivery_time()))
+
+
+def lms_delivery_time():
+    '''
+    The longest, in seconds, that `post_grade_to_lms` can take: every attempt
+    timing out after REQUESTS_TIMEOUT, with the longest backoff between them
+    '''
+    attempts = settings.LMS_DELIVERY_ATTEMPTS
+    return attempts * settings.REQUESTS_TIMEOUT + (attempts - 1) * settings.LMS_DELIVERY_BACKOFF_MAX
+
+
+# Fields of a submission that `push_submission` sets, apart from `retired`
+PUSH_OUTCOME_FIELDS = ('return_time', 'grader_reply', 'lms_ack', 'num_failures', 'lease_expires_at')
+
+
+def push_submission(submission, worker_url, deadline=None):
+    '''
+    Send a claimed submission to the external grader at `worker_url` and report
+    the outcome to the LMS. Updates the submission's fields but does not save
+    them, so callers decide which thread or connection touches the database;
+    pass the submission to `save_push_outcome` next. A grading
+    request that takes longer than `deadline` seconds is aborted and counts as
+    a failure.
+
+    A failed grading is retried: the submission's lease is pushed out by
+    `push_retry_delay` so the claim query picks it up again later, until it has
+    failed MAX_NUMBER_OF_FAILURES times and the LMS is told it could not be
+    graded. If the failure opens the grader's circuit breaker, the grader is
+    considered down and the submission is put back in the queue straight away,
+    without counting the failure against it.
+    '''
+    try:
+        _push_submission(submission, worker_url, deadline)
+    finally:
+        _finish_grading(worker_url)
+
+
+def _push_submission(submission, worker_url, deadline):
+    endpoint = get_grader_endpoint(worker_url)
+    breaker = endpoint.breaker
+    payload = {'xqueue_body': submission.xqueue_body,
+               'xqueue_files': submission.urls}
+
+    start = time.time()
+    (grading_success, grader_reply) = _http_post(worker_url, json.dumps(payload), settings.GRADING_TIMEOUT,
+                                                 deadline=deadline)
+    grading_time = time.time() - start
+    endpoint.record_latency(grading_time)
+
+    if grading_time > settings.GRADING_TIMEOUT:
+        log.error("Grading time above {} for submission. grading_time: {}s body: {} files: {}".format(settings.GRADING_TIMEOUT,
+                  grading_time, submission.xqueue_body, submission.urls))
+
+    submission.return_time = timezone.now()
+
+    if grading_success:
+        breaker.record_success()
+        submission.grader_reply = grader_reply
+        submission.lms_ack = post_grade_to_lms(submission.xqueue_header, grader_reply)
+    else:
+        log.error(f"Submission {submission.id} to grader {worker_url} failure: Reply: {grader_reply}, ")
+        breaker.record_failure()
+        if breaker.is_open:
+            log.warning(f"Circuit breaker for grader {worker_url} is open; requeueing submission {submission.id}")
+            submission.lease_expires_at = timezone.now()
+            return
+
+        submission.num_failures += 1
+        if submission.num_failures < settings.MAX_NUMBER_OF_FAILURES:
+            delay = push_retry_delay(submission.num_failures)
+            log.info(f"Retrying submission {submission.id} in {delay}s")
+            submission.lease_expires_at = timezone.now() + timedelta(seconds=delay)
+            return
+
+        submission.lms_ack = post_failure_to_lms(submission.xqueue_header)
+
+    submission.retired = True
+
+
+def save_push_outcome(submission):
+    '''
+    Write the outcome of `push_submission` to the database. Only the fields a
+    push sets are written, so a submission retired or archived while it was
+    out with the grader stays that way.
+    '''
+    Submission.objects.record_outcome(submission, PUSH_OUTCOME_FIELDS)
+
+
+def push_retry_delay(num_failures):
+    '''
+    Seconds before a submission that has failed grading `num_failures` times is
+    pushed again: PUSH_RETRY_DELAY doubled for every earlier failure, capped at
+    PUSH_RETRY_MAX_DELAY
+    '''
+    return min(settings.PUSH_RETRY_MAX_DELAY, settings.PUSH_RETRY_DELAY * 2 ** (num_failures - 1))
+
+
 class Worker(multiprocessing.Process):
-    """Encapsulation of a single database montitor that listens on a queue
+    """Encapsulation of a single database montitor that listens on a queue.
+
+    The worker keeps up to `concurrency` gradings in flight, each on its own
+    thread, and drains the queue without pausing while there is work. Gradings
+    are spread over `endpoints`, a list of (url, weight) pairs, which defaults
+    to `worker_url` alone. Each grading request is aborted after `deadline`
+    seconds, GRADING_DEADLINE by default.
+
+    On SIGTERM the worker stops claiming submissions and gives the gradings in
+    flight up to CONSUMER_SHUTDOWN_TIMEOUT seconds to finish. Submissions still
+    unfinished at the deadline are released so another worker can push them
+    straight away rather than after their lease runs out.
     """
-    def __init__(self, queue_name, worker_url):
+    def __init__(self, queue_name, worker_url, concurrency=1, endpoints=None, deadline=None):
         super().__init__()
 
         self.queue_name = queue_name
         self.worker_url = worker_url
+        self.concurrency = concurrency
+        self.endpoints = endpoints or [(worker_url, 1)]
+        self.deadline = deadline or settings.GRADING_DEADLINE
 
-    def run(self):
-        log.info(f"Starting consumer for queue {self.queue_name}")
-
-        if newrelic:
-            deliver_submission_task = newrelic.agent.BackgroundTaskWrapper(self._deliver_submission)
+        # Set from the SIGTERM handler, so a plain flag rather than anything
+        # that takes a lock
+        self.stopping = False
+        self._in_flight = {}
 
-        while True:
-            if newrelic:
-                deliver_submission_task()
-            else:
-                self._deliver_submission()
-            # Wait the given seconds between checking the database
-            time.sleep(settings.CONSUMER_DELAY)
+    def run(self):
+        log.info(f"Starting consumer for queue {self.queue_name} with concurrency {self.concurrency}")
+        if not notify.notifications_are_shared():
+            log.warning(f"Arrival signals from {settings.ARRIVAL_NOTIFIER} don't reach other processes; "
+                        f"consumer for queue {self.queue_name} will poll every {settings.CONSUMER_DELAY}s")
+        signal.signal(signal.SIGTERM, self.stop)
+
+        threads = []
+        for slot in range(self.concurrency):
+            thread = threading.Thread(target=self._drain, name=f'{self.queue_name}-{slot}', daemon=True)
+            thread.start()
+            threads.append(thread)
+
+        while not self.stopping:
+            if not all(thread.is_alive() for thread in threads):
+                # Let run_consumer restart the worker
+                log.error(f"Consumer thread for queue {self.queue_name} died")
+                sys.exit(1)
+            time.sleep(1)
+
+        log.info(f"Consumer for queue {self.queue_name} stopping; finishing {len(self._in_flight)} gradings")
+        deadline = time.monotonic() + settings.CONSUMER_SHUTDOWN_TIMEOUT
+        for thread in threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        self._release_unfinished()
 
         log.info(f"Consumer for queue {self.queue_name} stopped")
 
-    def _deliver_submission(self):
+    def stop(self, signum=None, frame=None):
         """
-        Find and deliver a submission to the external grader.
-        Report results to the LMS
+        Stop claiming submissions; gradings in flight are allowed to finish
         """
-        submission = Submission.objects.get_single_unpushed_submission(self.queue_name)
-        if not submission:
-            return
-
-        payload = {'xqueue_body': submission.xqueue_body,
-                   'xqueue_files': submission.urls}
-
-        submission.grader_id = self.worker_url
-        submission.push_time = timezone.now()
-        start = time.time()
-        (grading_success, grader_reply) = _http_post(self.worker_url, json.dumps(payload), settings.GRADING_TIMEOUT)
-        grading_time = time.time() - start
-
-        if grading_time > settings.GRADING_TIMEOUT:
-            log.error("Grading time above {} for submission. grading_time: {}s body: {} files: {}".format(settings.GRADING_TIMEOUT,
-                      grading_time, submission.xqueue_body, submission.urls))
+        self.stopping = True
 
-        submission.return_time = timezone.now()
+    def _release_unfinished(self):
+        """
+        Make submissions whose grading did not finish before the shutdown
+        deadline available again
+        """
+        unfinished = list(self._in_flight.values())
+        if unfinished:
+            log.warning(f"Releasing unfinished submissions {unfinished} in queue {self.queue_name}")
+            Submission.objects.filter(id__in=unfinished, retired=False).update(lease_expires_at=timezone.now())
 
-        # TODO: For the time being, a submission in a push interface gets one chance at grading,
-        #       with no requeuing logic
-        if grading_success:
-            submission.grader_reply = grader_reply
-            submission.lms_ack = post_grade_to_lms(submission.xqueue_header, grader_reply)
+    def _drain(self):
+        """
+        Deliver submissions one after another while there are any. When the
+        queue is empty, wait for `submit` to signal an arrival before checking
+        again. The fallback interval between database checks starts at
+        CONSUMER_DELAY and doubles while the queue stays empty, up to
+        CONSUMER_MAX_DELAY; it resets as soon as work is found. If arrival
+        signals don't reach this process, it stays at CONSUMER_DELAY. While
+        idle, a drain thread's only query is that check: the arrival counters
+        are read by the process's arrival watcher on behalf of all threads.
+        """
+        if newrelic:
+            deliver_submission_task = newrelic.agent.BackgroundTaskWrapper(self._deliver_submission)
         else:
-            log.error(f"Submission {submission.id} to grader {self.worker_url} failure: Reply: {grader_reply}, ")
-            submission.num_failures += 1
-            submission.lms_ack = post_failure_to_lms(submission.xqueue_header)
+            deliver_submission_task = self._deliver_submission
+
+        interval = settings.CONSUMER_DELAY
+        max_interval = settings.CONSUMER_MAX_DELAY if notify.notifications_are_shared() else settings.CONSUMER_DELAY
+        self._report_poll_interval(interval)
+        with notify.watching(self.queue_name):
+            while not self.stopping:
+                # Take the event before looking in the database so that an
+                # arrival in between wakes the wait below straight away.
+                arrived = notify.arrival_event(self.queue_name)
+                if deliver_submission_task():
+                    if interval != settings.CONSUMER_DELAY:
+                        interval = settings.CONSUMER_DELAY
+                        self._report_poll_interval(interval)
+                    continue
+
+                if not self._wait_for_arrival(arrived, interval):
+                    backoff = min(interval * 2, max_interval)
+                    if backoff != interval:
+                        interval = backoff
+                        self._report_poll_interval(interval)
+
+    def _wait_for_arrival(self, arrived, timeout):
+        """
+        Wait for the `arrived` event, returning early if the worker is asked to stop
+        """
+        deadline = time.monotonic() + timeout
+        while not self.stopping:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if arrived.wait(min(remaining, 1)):
+                return True
+        return False
+
+    def _report_poll_interval(self, interval):
+        """
+        Record how often an idle worker queries the database, as custom metrics:
+        each drain thread claims every `interval` seconds, and the process's
+        arrival watcher reads the counters for all of them at its poll interval.
+        """
+        arrivals_interval = notify.poll_interval()
+        log.debug(f"Consumer for queue {self.queue_name} claiming every {interval}s, "
+                  f"reading arrivals every {arrivals_interval}s")
+        if newrelic:
+            application = newrelic.agent.application()
+            newrelic.agent.record_custom_metric(
+                f'Custom/XQueueConsumerPollInterval/{self.queue_name}[seconds]',
+                interval,
+                application=application)
+            newrelic.agent.record_custom_metric(
+                f'Custom/XQueueArrivalPollInterval/{self.queue_name}[seconds]',
+                arrivals_interval,
+                application=application)
 
-        # NOTE: retiring pushed submissions after one shot regardless of grading_success
-        submission.retired = True
+    def _deliver_submission(self):
+        """
+        Find and deliver a submission to the external grader.
+        Report results to the LMS
+
+        Returns:
+            delivered: Flag indicating whether there was a submission to deliver (Boolean)
+        """
+        if self.stopping:
+            return False
 
-        submission.save()
+        submission = claim_push_submission(self.queue_name, self.endpoints, self.deadline)
+        if not submission:
+            return False
+
+        slot = threading.get_ident()
+        self._in_flight[slot] = submission.id
+        try:
+            push_submission(submission, submission.grader_id, self.deadline)
+            save_push_outcome(submission)
+        finally:
+            del self._in_flight[slot]
+        return True
 
     def __repr__(self):
         return f"Worker ({self.worker_url!r}, {self.queue_name!r})"
@@ -0,0 +1,93 @@
+"""
+Delivery of grades to the LMS through the LMSDelivery outbox.
+
+When LMS_DELIVERY_OUTBOX is enabled, put_result stores the grade together with
+an outbox entry and returns straight away. The run_lms_delivery command drains
+the outbox, so a slow LMS no longer holds up graders or row locks.
+"""
+import logging
+import math
+from datetime import timedelta
+
+import submission_queue.consumer
+from submission_queue.models import ArchivedSubmission, LMSDelivery, Submission
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+log = logging.getLogger(__name__)
+
+
+def outbox_entry(submission, grader_reply):
+    '''
+    Build (but don't save) the outbox entry that delivers grader_reply for a submission
+    '''
+    return LMSDelivery(submission_id=submission.id,
+                       xqueue_header=submission.xqueue_header,
+                       xqueue_body=grader_reply)
+
+
+def deliver_due(limit=None):
+    '''
+    Deliver outbox entries whose next attempt is due
+
+    Returns:
+        count: Number of entries attempted (int)
+    '''
+    limit = limit or settings.LMS_DELIVERY_BATCH_SIZE
+    entries = LMSDelivery.objects.claim_due(limit, lease=batch_lease(limit))
+    results = submission_queue.consumer.get_delivery_engine().map(
+        lambda entry: submission_queue.consumer.post_grade_to_lms(entry.xqueue_header, entry.xqueue_body),
+        entries,
+    )
+    for entry, success in zip(entries, results):
+        _record_attempt(entry, success)
+    return len(entries)
+
+
+def batch_lease(batch_size):
+    '''
+    How long to hold claimed outbox entries: long enough for a batch of
+    `batch_size` deliveries to run out of attempts, so that no other delivery
+    worker claims and posts them again while the batch is still running.
+    Never shorter than LMS_DELIVERY_RETRY_DELAY.
+    '''
+    per_delivery = submission_queue.consumer.lms_delivery_time()
+    rounds = math.ceil(batch_size / min(settings.LMS_DELIVERY_WORKERS, settings.LMS_DELIVERY_MAX_PER_HOST))
+    return timedelta(seconds=max(settings.LMS_DELIVERY_RETRY_DELAY, rounds * per_delivery))
+
+
+def _record_attempt(entry, success):
+    '''
+    Update an outbox entry and its submission after a delivery attempt
+    '''
+    if success:
+        _update_submission(entry.submission_id, lms_ack=True)
+        entry.delete()
+        return
+
+    entry.attempts += 1
+    _update_submission(entry.submission_id, num_failures=F('num_failures') + 1)
+
+    # Give up on a grade that fails to make it back to the LMS enough times, as
+    # put_result does when it delivers synchronously.
+    if entry.attempts > settings.MAX_NUMBER_OF_FAILURES:
+        log.error(f"Giving up on LMS delivery for submission {entry.submission_id} after {entry.attempts} attempts")
+        entry.delete()
+    else:
+        # The entry may already be gone (e.g. delivered by another worker after
+        # our lease ran out), in which case there is nothing left to update.
+        LMSDelivery.objects.filter(id=entry.id).update(
+            attempts=entry.attempts,
+            next_attempt_at=timezone.now() + timedelta(seconds=settings.LMS_DELIVERY_RETRY_DELAY),
+        )
+
+
+def _update_submission(submission_id, **fields):
+    '''
+    Update a submission wherever it lives (active table or archive)
+    '''
+    for model in (Submission, ArchivedSubmission):
+        if model.objects.filter(id=submission_id).update(**fields):
+            return
@@ -1,11 +1,15 @@
 import json
 import logging
+import time
 import submission_queue.consumer
-from submission_queue.models import Submission
-from submission_queue.util import get_request_ip, make_hashkey
-from submission_queue.views import compose_reply
+import submission_queue.delivery
+from submission_queue import http_client, notify
+from submission_queue.models import (
+    ArchivedSubmission, LMSDelivery, Submission, SubmissionManifest, get_submission_by_id
+)
+from submission_queue.util import get_request_ip
+from submission_queue.views import compose_reply, reply_status
 
-import requests
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.db import transaction
@@ -20,7 +24,9 @@ log = logging.getLogger(__name__)
 # External pull interface
 #    1) get_queuelen
 #    2) get_submission
-#    3) put_result
+#    3) get_submissions
+#    4) put_result
+#    5) put_results
 # --------------------------------------------------
 @login_required
 def get_queuelen(request):
@@ -40,73 +46,185 @@ def get_queuelen(request):
         return HttpResponse(compose_reply(False, 'Valid queue names are: ' + ', '.join(list(settings.XQUEUES.keys()))))
 
 
+@transaction.non_atomic_requests
 @login_required
 def get_submission(request):
     '''
     Retrieve a single submission from queue named by GET['queue_name'].
+    If the queue is empty, wait up to GET['wait'] seconds for one to arrive.
     '''
     try:
         queue_name = request.GET['queue_name']
     except KeyError:
         return HttpResponse(compose_reply(False, "'get_submission' must provide parameter 'queue_name'"))
 
+    (wait_is_valid, wait) = _get_wait(request)
+    if not wait_is_valid:
+        return HttpResponse(compose_reply(False, "'wait' must be a number of seconds"))
+
     if queue_name not in settings.XQUEUES:
         return HttpResponse(compose_reply(False, "Queue '%s' not found" % queue_name))
     else:
-        # Try to pull a single item from named queue
-        (got_submission, submission) = Submission.objects.get_single_unretired_submission(queue_name)
+        # Claim a single item from named queue. The claim stamps grader_id, pull_time
+        # and pullkey atomically, so concurrent graders never get the same submission.
+        submissions = _claim_submissions(queue_name, get_request_ip(request), 1, wait)
 
-        if not got_submission:
+        if not submissions:
             return HttpResponse(compose_reply(False, "Queue '%s' is empty" % queue_name))
         else:
-            # Collect info on pull event
-            grader_id = get_request_ip(request)
-            pull_time = timezone.now()
+            submission = submissions[0]
+            (success, payload) = _compose_payload(submission)
+            if not success:
+                return HttpResponse(
+                    compose_reply(False, "Error fetching submission for %s. Please try again." % queue_name)
+                )
 
-            pullkey = make_hashkey(str(pull_time)+str(submission.id))
+            return HttpResponse(compose_reply(True, content=json.dumps(payload)))
 
-            submission.grader_id = grader_id
-            submission.pull_time = pull_time
-            submission.pullkey = pullkey
 
-            submission.save()
+@transaction.non_atomic_requests
+@login_required
+def get_submissions(request):
+    '''
+    Retrieve up to GET['max'] submissions from queue named by GET['queue_name'].
+    If the queue is empty, wait up to GET['wait'] seconds for work to arrive.
+    The content of the reply is a JSON list of payloads in the get_submission format.
+    '''
+    try:
+        queue_name = request.GET['queue_name']
+    except KeyError:
+        return HttpResponse(compose_reply(False, "'get_submissions' must provide parameter 'queue_name'"))
 
-            # Prepare payload to external grader
-            ext_header = {'submission_id': submission.id, 'submission_key': pullkey}
-            urls = json.loads(submission.urls) if submission.urls else {}
-
-            # Because this code assumes there is a URL to fetch (traditionally out of S3)
-            # it doesn't play well for ContentFile users in tests or local use.
-            # ContentFile handles uploads well, but hands along file paths in /tmp rather than
-            # URLs, see lms_interface.
-            if "URL_FOR_EXTERNAL_DICTS" in submission.urls:
-                url = urls["URL_FOR_EXTERNAL_DICTS"]
-                timeout = 2
-                try:
-                    r = requests.get(url, timeout=timeout)
-                    success = True
-                except (ConnectionError, Timeout):
-                    success = False
-                    log.error(f'Could not fetch uploaded files at {url} in timeout={timeout:f}')
-                    return HttpResponse(
-                        compose_reply(False, "Error fetching submission for %s. Please try again." % queue_name)
-                    )
-
-                if (r.status_code not in [200]) or (not success):
-                    log.error('Could not fetch uploaded files at %s. Status code: %d' % (url, r.status_code))
-                    return HttpResponse(
-                        compose_reply(False, "Error fetching submission for %s. Please try again." % queue_name)
-                    )
-
-                xqueue_files = json.dumps(json.loads(r.text)["files"])
-            else:
-                xqueue_files = submission.urls
-
-            payload = {'xqueue_header': json.dumps(ext_header),
-                       'xqueue_body': submission.xqueue_body,
-                       'xqueue_files': xqueue_files}
+    try:
+        max_submissions = int(request.GET.get('max', 1))
+    except ValueError:
+        return HttpResponse(compose_reply(False, "'max' must be an integer"))
 
-            return HttpResponse(compose_reply(True, content=json.dumps(payload)))
+    if max_submissions < 1:
+        return HttpResponse(compose_reply(False, "'max' must be positive"))
+
+    (wait_is_valid, wait) = _get_wait(request)
+    if not wait_is_valid:
+        return HttpResponse(compose_reply(False, "'wait' must be a number of seconds"))
+
+    if queue_name not in settings.XQUEUES:
+        return HttpResponse(compose_reply(False, "Queue '%s' not found" % queue_name))
+
+    submissions = _claim_submissions(
+        queue_name, get_request_ip(request), min(max_submissions, settings.MAX_SUBMISSIONS_PER_PULL), wait
+    )
+    if not submissions:
+        return HttpResponse(compose_reply(False, "Queue '%s' is empty" % queue_name))
+
+    # Submissions whose files could not be fetched are left claimed; like a
+    # failed single pull, they come back to the queue when their lease expires.
+    payloads = []
+    for submission in submissions:
+        (success, payload) = _compose_payload(submission)
+        if success:
+            payloads.append(payload)
+
+    if not payloads:
+        return HttpResponse(compose_reply(False, "Error fetching submission for %s. Please try again." % queue_name))
+
+    return HttpResponse(compose_reply(True, content=json.dumps(payloads)))
+
+
+def _get_wait(request):
+    '''
+    Parse the optional long-poll parameter GET['wait'], capped at MAX_PULL_WAIT
+
+    Returns (is_valid, wait), where wait is in seconds (float)
+    '''
+    try:
+        wait = float(request.GET.get('wait', 0))
+    except ValueError:
+        return (False, 0)
+
+    if not 0 <= wait < float('inf'):
+        return (False, 0)
+
+    return (True, min(wait, settings.MAX_PULL_WAIT))
+
+
+def _claim_submissions(queue_name, grader_id, limit, wait):
+    '''
+    Claim up to `limit` submissions from the named queue. If there are none, keep
+    the request open for up to `wait` seconds and try again whenever `submit`
+    signals an arrival on the queue, as seen by this process's arrival watcher,
+    and at least every PULL_RECHECK_INTERVAL seconds in case a signal was lost or
+    a pull timed out. A last claim is made when the wait expires.
+
+    Returns a list of claimed submissions, which is empty if the wait expired.
+    '''
+    if not wait:
+        return Submission.objects.claim_unretired_submissions(queue_name, grader_id, limit=limit)
+
+    deadline = time.monotonic() + wait
+    with notify.watching(queue_name):
+        while True:
+            # Take the event before claiming, so that an arrival between the
+            # claim and the wait still wakes us up.
+            arrived = notify.arrival_event(queue_name)
+            submissions = Submission.objects.claim_unretired_submissions(queue_name, grader_id, limit=limit)
+            remaining = deadline - time.monotonic()
+            if submissions or remaining <= 0:
+                return submissions
+            arrived.wait(min(remaining, settings.PULL_RECHECK_INTERVAL))
+
+
+def _compose_payload(submission):
+    '''
+    Build the payload handed to a pull grader for a claimed submission
+
+    Returns (success, payload), where:
+        success: Flag indicating whether the uploaded file list could be resolved (Boolean)
+        payload: Dict with 'xqueue_header', 'xqueue_body' and 'xqueue_files'
+    '''
+    ext_header = {'submission_id': submission.id, 'submission_key': submission.pullkey}
+    urls = json.loads(submission.urls) if submission.urls else {}
+
+    # Because this code assumes there is a URL to fetch (traditionally out of S3)
+    # it doesn't play well for ContentFile users in tests or local use.
+    # ContentFile handles uploads well, but hands along file paths in /tmp rather than
+    # URLs, see lms_interface.
+    if "URL_FOR_EXTERNAL_DICTS" in submission.urls:
+        xqueue_files = SubmissionManifest.objects.get_urls(submission.id)
+        if xqueue_files is None:
+            xqueue_files = _fetch_manifest(submission.id, urls["URL_FOR_EXTERNAL_DICTS"])
+            if xqueue_files is None:
+                return (False, None)
+    else:
+        xqueue_files = submission.urls
+
+    payload = {'xqueue_header': json.dumps(ext_header),
+               'xqueue_body': submission.xqueue_body,
+               'xqueue_files': xqueue_files}
+    return (True, payload)
+
+
+def _fetch_manifest(submission_id, url):
+    '''
+    Fetch the uploaded file lists of a submission made before the manifest
+    table existed, and store them there so later pulls don't fetch them again.
+
+    Returns the JSON-serialized filename to URL dict, or None if the fetch failed
+    '''
+    timeout = 2
+    try:
+        r = http_client.get(url, timeout=timeout)
+    except (ConnectionError, Timeout):
+        log.error(f'Could not fetch uploaded files at {url} in timeout={timeout:f}')
+        return None
+
+    if r.status_code not in [200]:
+        log.error('Could not fetch uploaded files at %s. Status code: %d' % (url, r.status_code))
+        return None
+
+    file_dicts = json.loads(r.text)
+    xqueue_files = json.dumps(file_dicts["files"])
+    SubmissionManifest.objects.record(submission_id, json.dumps(file_dicts.get("keys", {})), xqueue_files)
+    return xqueue_files
 
 
 @transaction.atomic
@@ -129,44 +247,141 @@ def put_result(request):
             return HttpResponse(compose_reply(False, 'Incorrect reply format'))
         else:
             try:
-                submission = Submission.objects.select_for_update().get(id=submission_id)
+                submission = get_submission_by_id(submission_id, for_update=True)
             except Submission.DoesNotExist:
-                log.error("Grader submission_id refers to nonexistent entry in Submission DB: grader: {}, submission_id: {}, submission_key: {}, grader_reply: {}".format(
-                    get_request_ip(request),
-                    submission_id,
-                    submission_key,
-                    grader_reply
-                ))
+                _log_missing_submission(request, submission_id, submission_key, grader_reply)
                 return HttpResponse(compose_reply(False, 'Submission does not exist'))
 
             if not submission.pullkey or submission_key != submission.pullkey:
                 return HttpResponse(compose_reply(False, 'Incorrect key for submission'))
 
-            submission.return_time = timezone.now()
-            submission.grader_reply = grader_reply
+            outbox_entry = _record_grade(submission, grader_reply)
+            submission.save()
+            if outbox_entry:
+                outbox_entry.save()
 
-            # Deliver grading results to LMS
-            success = submission_queue.consumer.post_grade_to_lms(submission.xqueue_header, grader_reply)
-            submission.lms_ack = success
+            return HttpResponse(compose_reply(success=True, content=''))
 
-            # Keep track of how many times we've failed to return a grade for this submission
-            # to the LMS.
-            if not success:
-                submission.num_failures += 1
-
-            # Auto-retire a submission if it fails to make it back to the LMS enough times.
-            # This can be because it's an old submission and the course changed structure (causing a 404)
-            # or because the LMS is throwing errors.  The combination of MAX_NUMBER_OF_FAILURES and
-            # SUBMISSION_PROCESSING_DELAY tells you how long a period of time a submission can be graded over
-            # before it's auto-retired.
-            if submission.num_failures > settings.MAX_NUMBER_OF_FAILURES:
-                submission.retired = True
-            else:
-                submission.retired = submission.lms_ack
 
-            submission.save()
+@transaction.atomic
+@csrf_exempt
+@login_required
+def put_results(request):
+    '''
+    Graders post a batch of results here, as a JSON-serialized list of
+    {'xqueue_header': ..., 'xqueue_body': ...} replies in POST['xqueue_replies'].
 
-            return HttpResponse(compose_reply(success=True, content=''))
+    The content of the reply is a list with one {'return_code', 'content'}
+    status per reply, in the order the replies were given.
+    '''
+    if request.method != 'POST':
+        return HttpResponse(compose_reply(False, "'put_results' must use HTTP POST"))
+
+    try:
+        replies = json.loads(request.POST['xqueue_replies'])
+    except (KeyError, TypeError, ValueError):
+        replies = None
+
+    if not isinstance(replies, list):
+        log.error("Invalid batch reply from pull-grader: grader_id: {} request.POST: {}".format(
+            get_request_ip(request),
+            request.POST,
+        ))
+        return HttpResponse(compose_reply(False, 'Incorrect reply format'))
+
+    if len(replies) > settings.MAX_RESULTS_PER_PUT:
+        return HttpResponse(compose_reply(False, 'At most %d replies per request' % settings.MAX_RESULTS_PER_PUT))
+
+    parsed_replies = [_is_valid_reply(reply) for reply in replies]
+    submission_ids = {submission_id for (reply_is_valid, submission_id, _, _) in parsed_replies if reply_is_valid}
+    submissions = Submission.objects.select_for_update().in_bulk(submission_ids)
+    submissions.update(ArchivedSubmission.objects.select_for_update().in_bulk(submission_ids - submissions.keys()))
+
+    statuses = []
+    accepted = {}  # submission_id -> grader replies for it, in order
+    for (reply_is_valid, submission_id, submission_key, grader_reply) in parsed_replies:
+        if not reply_is_valid:
+            statuses.append(reply_status(False, 'Incorrect reply format'))
+            continue
+
+        submission = submissions.get(submission_id)
+        if submission is None:
+            _log_missing_submission(request, submission_id, submission_key, grader_reply)
+            statuses.append(reply_status(False, 'Submission does not exist'))
+        elif not submission.pullkey or submission_key != submission.pullkey:
+            statuses.append(reply_status(False, 'Incorrect key for submission'))
+        else:
+            accepted.setdefault(submission.id, []).append(grader_reply)
+            statuses.append(reply_status(True, ''))
+
+    def record_grades(submission_id):
+        outbox_entry = None
+        for grader_reply in accepted[submission_id]:
+            outbox_entry = _record_grade(submissions[submission_id], grader_reply)
+        return outbox_entry
+
+    # Deliver to the LMS in parallel; each submission's replies stay in order on one thread.
+    outbox_entries = submission_queue.consumer.get_delivery_engine().map(record_grades, list(accepted))
+
+    graded = [submissions[submission_id] for submission_id in accepted]
+    for model in (Submission, ArchivedSubmission):
+        model.objects.bulk_update(
+            [submission for submission in graded if type(submission) is model],
+            ['return_time', 'grader_reply', 'lms_ack', 'num_failures', 'retired'],
+        )
+    LMSDelivery.objects.bulk_create([entry for entry in outbox_entries if entry])
+
+    return HttpResponse(compose_reply(success=True, content=statuses))
+
+
+def _record_grade(submission, grader_reply):
+    '''
+    Record a grader reply on a submission and deliver it to the LMS.
+
+    With LMS_DELIVERY_OUTBOX enabled, the grade is not delivered here. Instead the
+    submission is retired and an unsaved outbox entry is returned, which the caller
+    saves in the same transaction as the submission. Otherwise returns None.
+    The caller is responsible for saving the submission.
+    '''
+    submission.return_time = timezone.now()
+    submission.grader_reply = grader_reply
+
+    if settings.LMS_DELIVERY_OUTBOX:
+        # The grade is durable once this transaction commits, so the submission is
+        # finished as far as graders are concerned; run_lms_delivery takes it from here.
+        submission.retired = True
+        return submission_queue.delivery.outbox_entry(submission, grader_reply)
+
+    # Deliver grading results to LMS
+    success = submission_queue.consumer.post_grade_to_lms(submission.xqueue_header, grader_reply)
+    submission.lms_ack = success
+
+    # Keep track of how many times we've failed to return a grade for this submission
+    # to the LMS.
+    if not success:
+        submission.num_failures += 1
+
+    # Auto-retire a submission if it fails to make it back to the LMS enough times.
+    # This can be because it's an old submission and the course changed structure (causing a 404)
+    # or because the LMS is throwing errors.  The combination of MAX_NUMBER_OF_FAILURES and
+    # SUBMISSION_PROCESSING_DELAY tells you how long a period of time a submission can be graded over
+    # before it's auto-retired.
+    if submission.num_failures > settings.MAX_NUMBER_OF_FAILURES:
+        submission.retired = True
+    else:
+        submission.retired = submission.lms_ack
+
+    return None
+
+
+def _log_missing_submission(request, submission_id, submission_key, grader_reply):
+    log.error("Grader submission_id refers to nonexistent entry in Submission DB: "
+              "grader: {}, submission_id: {}, submission_key: {}, grader_reply: {}".format(
+                  get_request_ip(request),
+                  submission_id,
+                  submission_key,
+                  grader_reply
+              ))
 
 
 def _is_valid_reply(external_reply):
@@ -205,6 +420,9 @@ def _is_valid_reply(external_reply):
         if tag not in header_dict:
             return fail
 
-    submission_id = int(header_dict['submission_id'])
+    try:
+        submission_id = int(header_dict['submission_id'])
+    except (TypeError, ValueError):
+        return fail
     submission_key = header_dict['submission_key']
     return (True, submission_id, submission_key, score_msg)
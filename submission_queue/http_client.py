@@ -0,0 +1,202 @@
+"""
+Shared HTTP client for calls to graders, the LMS and file storage.
+
+A module-level `requests.post` opens a new connection (and TLS handshake) for
+every call. This module keeps one `requests.Session` per process instead, with
+per-host connection pools that keep connections alive between calls, and retries
+requests whose connection could not be established. Read errors are not retried:
+a grader or the LMS may already have acted on a POST.
+
+Timeouts in `requests` bound each wait for data, not a whole request. Calls made
+inside `deadline(seconds)` are cut off once that much time has passed, however
+slowly the server trickles its status line, headers or body.
+"""
+import contextlib
+import functools
+import os
+import socket
+import threading
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+_local = threading.local()
+
+
+def get_session():
+    '''
+    The pooled Session for this process, built from settings on first use.
+    Worker processes are forked, so a session inherited from a parent (and its
+    open sockets) is replaced.
+    '''
+    global _session, _session_pid  # pylint: disable=global-statement
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            _session = _build_session()
+            _session_pid = os.getpid()
+        return _session
+
+
+def _build_session():
+    retry = Retry(
+        total=settings.HTTP_CONNECT_RETRIES,
+        connect=settings.HTTP_CONNECT_RETRIES,
+        read=0,
+        status=0,
+        other=0,
+        backoff_factor=settings.HTTP_RETRY_BACKOFF,
+    )
+    adapter = _DeadlineAdapter(
+        pool_connections=settings.HTTP_POOL_CONNECTIONS,
+        pool_maxsize=settings.HTTP_POOL_MAXSIZE,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def basic_auth():
+    '''
+    HTTPBasicAuth for REQUESTS_BASIC_AUTH, or None when it isn't set
+    '''
+    if settings.REQUESTS_BASIC_AUTH is None:
+        return None
+    return _basic_auth(*settings.REQUESTS_BASIC_AUTH)
+
+
+@functools.lru_cache(maxsize=None)
+def _basic_auth(username, password):
+    return requests.auth.HTTPBasicAuth(username, password)
+
+
+def post(url, **kwargs):
+    '''
+    POST through the pooled session
+    '''
+    return get_session().post(url, **kwargs)
+
+
+def get(url, **kwargs):
+    '''
+    GET through the pooled session
+    '''
+    return get_session().get(url, **kwargs)
+
+
+@contextlib.contextmanager
+def deadline(seconds):
+    '''
+    Cut off the requests this thread makes in the block once `seconds` have
+    passed: the sockets they use are shut down, so the waiting call fails with a
+    `requests` exception. Yields a `Watchdog`, whose `expired` flag tells
+    whether that happened.
+    '''
+    watchdog = Watchdog(seconds)
+    _local.watchdog = watchdog
+    try:
+        yield watchdog
+    finally:
+        _local.watchdog = None
+        watchdog.cancel()
+
+
+class Watchdog:
+    """
+    Shuts down the sockets of the connections it watches when its timer runs out
+    """
+    def __init__(self, seconds):
+        self.expired = False
+        self._done = False
+        self._connections = []
+        self._lock = threading.Lock()
+        self._timer = threading.Timer(seconds, self._expire)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def watch(self, connection):
+        with self._lock:
+            self._connections.append(connection)
+            if self.expired:
+                _shut_down(connection)
+
+    def cancel(self):
+        '''
+        Stop the timer. Once this returns, no watched connection is shut down.
+        '''
+        with self._lock:
+            self._done = True
+        self._timer.cancel()
+
+    def _expire(self):
+        with self._lock:
+            if self._done:
+                return
+            self.expired = True
+            for connection in self._connections:
+                _shut_down(connection)
+
+
+def _shut_down(connection):
+    # shutdown() rather than close(): it wakes a thread blocked reading the
+    # socket, and the descriptor can't be reused while that thread still holds it.
+    sock = connection.sock
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class _DeadlineConnectionMixin:
+    """
+    Registers the connection with the `deadline` of the thread using it
+    """
+    def connect(self):
+        super().connect()
+        self._watch()
+
+    def request(self, *args, **kwargs):
+        self._watch()
+        return super().request(*args, **kwargs)
+
+    def _watch(self):
+        watchdog = getattr(_local, 'watchdog', None)
+        if watchdog is not None:
+            watchdog.watch(self)
+
+
+class _DeadlineHTTPConnection(_DeadlineConnectionMixin, HTTPConnection):
+    pass
+
+
+class _DeadlineHTTPSConnection(_DeadlineConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _DeadlineHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _DeadlineHTTPConnection
+
+
+class _DeadlineHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _DeadlineHTTPSConnection
+
+
+class _DeadlineAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose connections can be cut off by `deadline`
+    """
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _DeadlineHTTPConnectionPool,
+            'https': _DeadlineHTTPSConnectionPool,
+        }
@@ -1,20 +1,34 @@
+import hashlib
+import inspect
 import json
 import logging
+import os
 import os.path
-from submission_queue.models import CHARFIELD_LEN_LARGE, Submission
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from submission_queue.models import CHARFIELD_LEN_LARGE, QueueDepth, Submission, SubmissionManifest
+from submission_queue.notify import notify_arrival
 from submission_queue.util import get_request_ip, make_hashkey
-from submission_queue.views import compose_reply
+from submission_queue.views import compose_reply, reply_status
 
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.core.files.base import ContentFile
+from django.core import signing
+from django.core.files.base import ContentFile, File
 from django.core.files.storage import default_storage
 from django.db import transaction, models
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotAllowed
+from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
 
 log = logging.getLogger(__name__)
 
+UPLOAD_TOKEN_SALT = 'submission_queue.upload_file'
+
+_upload_pool = None
+_upload_pool_pid = None
+_upload_pool_lock = threading.Lock()
+
 
 @transaction.non_atomic_requests
 @csrf_exempt
@@ -42,23 +56,31 @@ def submit(request):
                 transaction.commit()
                 return HttpResponse(compose_reply(False, "Queue '%s' not found" % queue_name))
             else:
+                (files_are_valid, uploaded_keys) = _is_valid_uploaded_files(request.POST, xqueue_header)
+                if not files_are_valid:
+                    transaction.commit()
+                    return HttpResponse(compose_reply(False, 'Queue request has invalid format'))
+
                 # Limit DOS attacks by invalidating prior submissions from the
                 #   same (user, module-id) pair as encoded in the lms_callback_url
                 _invalidate_prior_submissions(lms_callback_url)
 
                 # Check for file uploads
-                keys = dict()  # For internal Xqueue use
-                urls = dict()  # For external grader use
-                for filename in request.FILES.keys():
-                    key = make_hashkey(xqueue_header + filename)
-                    url = _upload(request.FILES[filename], queue_name, key)
-                    keys.update({filename: key})
-                    urls.update({filename: url})
+                keys, urls = _upload_files(request.FILES, queue_name, xqueue_header)
+
+                # Files the LMS has already put in storage through get_upload_urls
+                for filename, key in uploaded_keys.items():
+                    keys[filename] = key
+                    urls[filename] = default_storage.url(os.path.join(queue_name, key))
 
                 urls_json = json.dumps(urls)
                 keys_json = json.dumps(keys)
+                manifest = None
 
                 if len(urls_json) > CHARFIELD_LEN_LARGE:
+                    # The full lists go in the manifest table, for pull graders. The
+                    # uploaded copy is kept for push graders, which are sent the URL.
+                    manifest = (keys_json, urls_json)
                     key = make_hashkey(xqueue_header + json.dumps(list(request.FILES.keys())))
                     url = _upload_file_dict(urls, keys, queue_name, key)
                     keys = {"KEY_FOR_EXTERNAL_DICTS": key}
@@ -75,7 +97,10 @@ def submit(request):
                                         s3_urls=urls_json,
                                         s3_keys=keys_json)
                 submission.save()
+                if manifest:
+                    SubmissionManifest.objects.record(submission.id, *manifest)
                 transaction.commit()  # Explicit commit to DB before inserting submission.id into queue
+                notify_arrival(queue_name)
 
                 qcount = Submission.objects.get_queue_length(queue_name)
 
@@ -83,6 +108,196 @@ def submit(request):
                 return HttpResponse(compose_reply(success=True, content="%d" % qcount))
 
 
+@transaction.non_atomic_requests
+@csrf_exempt
+@login_required
+def submit_batch(request):
+    '''
+    Handle many submissions from the LMS in one request (e.g. for rescoring), as
+    a JSON-serialized list of {'xqueue_header': ..., 'xqueue_body': ...} items
+    in POST['xqueue_submissions']. Items can't carry attached files, only the
+    keys of files uploaded through get_upload_urls, in 'xqueue_files'.
+
+    The content of the reply is a list with one {'return_code', 'content'}
+    status per item, in the order the items were given. Like for `submit`, the
+    content of a success is the length of the item's queue.
+    '''
+    if request.method != 'POST':
+        return HttpResponse(compose_reply(False, 'Queue requests should use HTTP POST'))
+
+    try:
+        items = json.loads(request.POST['xqueue_submissions'])
+    except (KeyError, TypeError, ValueError):
+        items = None
+
+    if not isinstance(items, list):
+        log.error("Invalid batch queue submission from LMS: lms ip: {}, request.POST: {}".format(
+            get_request_ip(request),
+            request.POST,
+        ))
+        return HttpResponse(compose_reply(False, 'Queue request has invalid format'))
+
+    if len(items) > settings.MAX_SUBMISSIONS_PER_SUBMIT:
+        return HttpResponse(compose_reply(
+            False, 'At most %d submissions per request' % settings.MAX_SUBMISSIONS_PER_SUBMIT
+        ))
+
+    requester_id = get_request_ip(request)
+    statuses = []
+    submissions = {}  # index in items -> Submission
+    for index, item in enumerate(items):
+        (request_is_valid, lms_callback_url, queue_name, xqueue_header, xqueue_body) = _is_valid_request(item)
+        (files_are_valid, keys) = _is_valid_uploaded_files(item, xqueue_header) if request_is_valid else (False, {})
+        if not request_is_valid or not files_are_valid:
+            statuses.append(reply_status(False, 'Queue request has invalid format'))
+            continue
+        if queue_name not in settings.XQUEUES:
+            statuses.append(reply_status(False, "Queue '%s' not found" % queue_name))
+            continue
+
+        urls = {filename: default_storage.url(os.path.join(queue_name, key)) for filename, key in keys.items()}
+        urls_json = json.dumps(urls)
+        if len(urls_json) > CHARFIELD_LEN_LARGE:
+            statuses.append(reply_status(False, 'Too many files for a batch submission'))
+            continue
+
+        submissions[index] = Submission(requester_id=requester_id,
+                                        lms_callback_url=lms_callback_url[:128],
+                                        queue_name=queue_name,
+                                        xqueue_header=xqueue_header,
+                                        xqueue_body=xqueue_body,
+                                        s3_urls=urls_json,
+                                        s3_keys=json.dumps(keys))
+        statuses.append(None)
+
+    # As with repeated calls to `submit`, only the last submission for each
+    # (user, module-id) stays in the queue.
+    latest = {}
+    for submission in submissions.values():
+        previous = latest.get(submission.lms_callback_url)
+        if previous is not None:
+            previous.retired = True
+        latest[submission.lms_callback_url] = submission
+
+    with transaction.atomic():
+        _invalidate_prior_submissions_in_bulk(list(latest))
+        Submission.objects.bulk_create(list(submissions.values()))
+
+    queue_names = {submission.queue_name for submission in submissions.values()}
+    qcounts = {}
+    for queue_name in queue_names:
+        notify_arrival(queue_name)
+        qcounts[queue_name] = Submission.objects.get_queue_length(queue_name)
+
+    for index, submission in submissions.items():
+        statuses[index] = reply_status(True, "%d" % qcounts[submission.queue_name])
+    return HttpResponse(compose_reply(success=True, content=statuses))
+
+
+@csrf_exempt
+@login_required
+def get_upload_urls(request):
+    '''
+    Hand the LMS upload targets for the files of a submission, so that it can
+    put them straight into storage and then call `submit` with their keys in
+    POST['xqueue_files'] instead of uploading the files through Xqueue.
+
+    Takes POST['xqueue_header'], as for `submit`, and POST['filenames'], a
+    JSON-serialized list. The content of the reply maps each filename to
+    {'key': ..., 'url': ..., 'method': 'PUT'}; the file is uploaded by sending
+    its bytes as the body of a PUT to the URL, which expires after
+    UPLOAD_PRESIGN_EXPIRE seconds.
+    '''
+    if request.method != 'POST':
+        return HttpResponse(compose_reply(False, "'get_upload_urls' must use HTTP POST"))
+
+    (request_is_valid, _, queue_name, xqueue_header, _) = _is_valid_request(
+        {'xqueue_header': request.POST.get('xqueue_header'), 'xqueue_body': ''}
+    )
+    try:
+        filenames = json.loads(request.POST['filenames'])
+    except (KeyError, TypeError, ValueError):
+        filenames = None
+
+    if not request_is_valid or not isinstance(filenames, list) or not all(isinstance(f, str) for f in filenames):
+        return HttpResponse(compose_reply(False, 'Upload request has invalid format'))
+
+    if queue_name not in settings.XQUEUES:
+        return HttpResponse(compose_reply(False, "Queue '%s' not found" % queue_name))
+
+    targets = {}
+    for filename in filenames:
+        key = make_hashkey(xqueue_header + filename)
+        targets[filename] = {
+            'key': key,
+            'url': _presigned_upload_url(request, os.path.join(queue_name, key)),
+            'method': 'PUT',
+        }
+    return HttpResponse(compose_reply(True, content=targets))
+
+
+@csrf_exempt
+def upload_file(request, token):
+    '''
+    Stand-in for a presigned storage URL, for storage backends that cannot
+    presign uploads (e.g. the local filesystem). The signed token names the
+    storage path; the body of the PUT is stored there.
+    '''
+    if request.method != 'PUT':
+        return HttpResponseNotAllowed(['PUT'])
+
+    try:
+        full_path = signing.loads(token, salt=UPLOAD_TOKEN_SALT, max_age=settings.UPLOAD_PRESIGN_EXPIRE)
+    except signing.BadSignature:
+        return HttpResponseForbidden('Invalid or expired upload URL')
+
+    # Like a PUT to object storage, a repeated upload replaces the file
+    default_storage.delete(full_path)
+    default_storage.save(full_path, File(request, name=full_path))
+    return HttpResponse(status=201)
+
+
+def _presigned_upload_url(request, full_path):
+    '''
+    URL to which the file for `full_path` can be PUT without other credentials:
+    presigned by the storage backend when it supports that (S3), and served by
+    `upload_file` otherwise.
+    '''
+    if 'http_method' in inspect.signature(default_storage.url).parameters:
+        return default_storage.url(full_path, expire=settings.UPLOAD_PRESIGN_EXPIRE, http_method='PUT')
+    token = signing.dumps(full_path, salt=UPLOAD_TOKEN_SALT)
+    return request.build_absolute_uri(reverse('upload_file', args=[token]))
+
+
+def _is_valid_uploaded_files(xrequest, xqueue_header):
+    '''
+    Check the optional POST['xqueue_files'] of a submission: a JSON-serialized
+    dict of filename to the key that get_upload_urls issued for it.
+
+    Returns:
+        is_valid: Flag indicating success (Boolean)
+        keys:     Filename to key of the files already in storage (dict)
+    '''
+    if 'xqueue_files' not in xrequest:
+        return (True, {})
+
+    try:
+        keys = json.loads(xrequest['xqueue_files'])
+    except (TypeError, ValueError):
+        return (False, {})
+
+    if not isinstance(keys, dict):
+        return (False, {})
+
+    # Only keys issued for this submission are accepted, so the LMS can't attach
+    # other files in storage to it.
+    for filename, key in keys.items():
+        if key != make_hashkey(xqueue_header + filename):
+            return (False, {})
+
+    return (True, keys)
+
+
 @transaction.atomic
 def _invalidate_prior_submissions(lms_callback_url):
     '''
@@ -90,10 +305,34 @@ def _invalidate_prior_submissions(lms_callback_url):
         (user, module-id). This function relies on the fact that lms_callback_url
         takes the form: /path/to/callback/<user>/<id>/...
     '''
-    prior_submissions = Submission.objects.filter(
+    prior_submissions = list(Submission.objects.select_for_update().filter(
         lms_callback_url=lms_callback_url[:128], retired=models.Value(0)
-    )
-    prior_submissions.update(retired=True)
+    ).only('id', 'queue_name', 'retired'))
+    for submission in prior_submissions:
+        submission.retired = True
+    Submission.objects.bulk_update(prior_submissions, ['retired'])
+
+
+def _invalidate_prior_submissions_in_bulk(lms_callback_urls):
+    '''
+    Like `_invalidate_prior_submissions`, for many (user, module-id) pairs at
+    once: one update retires all of their unretired submissions, and the queue
+    depth counters are moved by the number retired from each queue. Call it in
+    a transaction, so the submissions stay locked until the new ones are in.
+    '''
+    if not lms_callback_urls:
+        return
+    prior_submissions = list(Submission.objects.select_for_update().filter(
+        lms_callback_url__in=lms_callback_urls, retired=models.Value(0)
+    ).values_list('id', 'queue_name'))
+    if not prior_submissions:
+        return
+    Submission.objects.filter(id__in=[submission_id for submission_id, _ in prior_submissions]).update(retired=True)
+    retired_counts = {}
+    for _, queue_name in prior_submissions:
+        retired_counts[queue_name] = retired_counts.get(queue_name, 0) + 1
+    for queue_name, count in retired_counts.items():
+        QueueDepth.objects.adjust(queue_name, -count)
 
 
 def _is_valid_request(xrequest):
@@ -102,6 +341,8 @@ def _is_valid_request(xrequest):
         1) Presence of 'xqueue_header' and 'xqueue_body'
         2) Presence of specific metadata in 'xqueue_header'
             ['lms_callback_url', 'lms_key', 'queue_name']
+        3) 'xqueue_header', 'xqueue_body' and 'lms_callback_url' are strings,
+            which items of a submit_batch request need not be
 
     Returns:
         is_valid:         Flag indicating success (Boolean)
@@ -117,6 +358,9 @@ def _is_valid_request(xrequest):
     except (TypeError, KeyError):
         return fail
 
+    if not isinstance(header, str) or not isinstance(body, str):
+        return fail
+
     try:
         header_dict = json.loads(header)
     except (TypeError, ValueError):
@@ -131,6 +375,8 @@ def _is_valid_request(xrequest):
 
     queue_name = str(header_dict['queue_name'])  # Important: Queue name must be str!
     lms_callback_url = header_dict['lms_callback_url']
+    if not isinstance(lms_callback_url, str):
+        return fail
 
     return (True, lms_callback_url, queue_name, header, body)
 
@@ -165,3 +411,85 @@ def _upload(file_to_upload, path, name):
     full_path = os.path.join(path, name)
     default_storage.save(full_path, file_to_upload)
     return default_storage.url(full_path)
+
+
+def _get_upload_pool():
+    '''
+    The thread pool for this process that uploads submitted files, UPLOAD_THREADS wide.
+    A pool inherited from a parent process has no threads left, so it is replaced.
+    '''
+    global _upload_pool, _upload_pool_pid  # pylint: disable=global-statement
+    with _upload_pool_lock:
+        if _upload_pool is None or _upload_pool_pid != os.getpid():
+            _upload_pool = ThreadPoolExecutor(settings.UPLOAD_THREADS, thread_name_prefix='submit-upload')
+            _upload_pool_pid = os.getpid()
+        return _upload_pool
+
+
+def _upload_files(files, path, xqueue_header):
+    '''
+    Upload the submitted files concurrently. Each file is handed to the storage
+    backend as Django's upload handler left it (in memory when small, spooled to
+    a temporary file otherwise), so the backend streams it in chunks.
+
+    With UPLOAD_CONTENT_ADDRESSED, files are stored under the hash of their
+    contents instead of a key derived from the header and filename.
+
+    Returns:
+        keys: Filename to storage key, for internal Xqueue use (dict)
+        urls: Filename to URL, for external grader use (dict)
+    '''
+    if settings.UPLOAD_CONTENT_ADDRESSED:
+        def upload(filename):
+            return _upload_by_content(files[filename], path)
+    else:
+        def upload(filename):
+            key = make_hashkey(xqueue_header + filename)
+            return key, _upload(files[filename], path, key)
+
+    if len(files) == 1:
+        # Not worth a round trip through the pool
+        results = {filename: upload(filename) for filename in files.keys()}
+    else:
+        pool = _get_upload_pool()
+        futures = {filename: pool.submit(upload, filename) for filename in files.keys()}
+        # Wait for every upload, even when one fails, so that no upload is still
+        # reading a request file after the request has finished with it.
+        results = {}
+        error = None
+        for filename, future in futures.items():
+            try:
+                results[filename] = future.result()
+            except Exception as exc:  # pylint: disable=broad-except
+                error = error or exc
+        if error is not None:
+            raise error
+
+    keys = {filename: key for filename, (key, _) in results.items()}
+    urls = {filename: url for filename, (_, url) in results.items()}
+    return keys, urls
+
+
+def _upload_by_content(file_to_upload, path):
+    '''
+    Upload file under the SHA-256 hash of its contents. Objects are never
+    changed once written, so a file that is already stored (e.g. a resubmitted
+    notebook) is not uploaded again.
+
+    Returns:
+        key: Hash of the file contents (string)
+        url: URL to access uploaded file (string)
+    '''
+    key = _content_hash(file_to_upload)
+    full_path = os.path.join(path, key)
+    if not default_storage.exists(full_path):
+        default_storage.save(full_path, file_to_upload)
+    return key, default_storage.url(full_path)
+
+
+def _content_hash(file_to_upload):
+    h = hashlib.sha256()
+    for chunk in file_to_upload.chunks():
+        h.update(chunk if isinstance(chunk, bytes) else chunk.encode('utf-8'))
+    file_to_upload.seek(0)
+    return h.hexdigest()
@@ -0,0 +1,63 @@
+"""
+Move retired submissions out of the active submission table
+"""
+
+import logging
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from submission_queue.models import ArchivedSubmission
+
+log = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Archive retired submissions by chunks, so the active table only holds in-flight work
+    """
+
+    # Default maximum number of retired submissions to move in a single transaction.
+    DEFAULT_CHUNK_SIZE = 1000
+
+    # Default seconds to sleep between chunks.
+    DEFAULT_SLEEP_BETWEEN_CHUNKS = 0
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk_size',
+            default=self.DEFAULT_CHUNK_SIZE,
+            type=int,
+            help='Maximum number of retired submissions to archive in one transaction.'
+        )
+        parser.add_argument(
+            '--sleep_between',
+            default=self.DEFAULT_SLEEP_BETWEEN_CHUNKS,
+            type=float,
+            help='Seconds to sleep between chunks.'
+        )
+
+    def handle(self, *args, **options):
+        """
+        Archives retired submissions, chunking the moves to avoid long table/row locks.
+        """
+        chunk_size = options.get('chunk_size', self.DEFAULT_CHUNK_SIZE)
+        if chunk_size <= 0:
+            raise CommandError(f'Only positive chunk size is allowed ({chunk_size}).')
+        sleep_between = options.get('sleep_between', self.DEFAULT_SLEEP_BETWEEN_CHUNKS)
+        if sleep_between < 0:
+            raise CommandError(f'Only non-negative sleep between seconds is allowed ({sleep_between}).')
+
+        log.info("STARTED: Archiving retired submissions with chunk size of %s and %s seconds between chunk.",
+                 chunk_size, sleep_between)
+
+        total_archived = 0
+        while True:
+            archived_now = ArchivedSubmission.objects.archive_retired(chunk_size)
+            total_archived += archived_now
+            if archived_now < chunk_size:
+                break
+            log.info("Archived %s retired submissions, sleeping %s seconds...", archived_now, sleep_between)
+            time.sleep(sleep_between)
+
+        log.info("FINISHED: Archived %s retired submissions total.", total_archived)
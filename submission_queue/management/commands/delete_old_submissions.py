@@ -9,8 +9,9 @@ from zoneinfo import ZoneInfo
 
 from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
+from django.db.models import Count, Value
 
-from submission_queue.models import Submission
+from submission_queue.models import ArchivedSubmission, QueueDepth, Submission, SubmissionManifest
 
 log = logging.getLogger(__name__)
 
@@ -66,11 +67,21 @@ class Command(BaseCommand):
 
         delete_date = datetime.now(ZoneInfo("UTC")) - timedelta(days=days_old)
 
-        old_submissions = Submission.objects.filter(arrival_time__lte=delete_date)
+        total_deletions = 0
+        for model in (Submission, ArchivedSubmission):
+            total_deletions += self.delete_old(model, delete_date, chunk_size, sleep_between)
+
+        log.info("FINISHED: Deleted %s old submissions tokens total.", total_deletions)
+
+    def delete_old(self, model, delete_date, chunk_size, sleep_between):
+        """
+        Deletes rows of `model` (active or archived submissions) that arrived before delete_date.
+        """
+        old_submissions = model.objects.filter(arrival_time__lte=delete_date)
         total_old_submissions = old_submissions.count()
 
-        log.info("STARTED: Deleting %s submissions older than '%s' with chunk size of %s and %s seconds between chunk.",
-                 total_old_submissions, delete_date, chunk_size, sleep_between
+        log.info("STARTED: Deleting %s %s rows older than '%s' with chunk size of %s and %s seconds between chunk.",
+                 total_old_submissions, model._meta.db_table, delete_date, chunk_size, sleep_between
                  )
 
         total_deletions = 0
@@ -80,11 +91,19 @@ class Command(BaseCommand):
             deletions_now = batch_ids.count()
             log.info("Deleting %s expired submissions...", deletions_now)
             with transaction.atomic():
-                Submission.objects.filter(pk__in=list(batch_ids)).delete()
+                batch_ids = list(batch_ids)
+                batch = model.objects.filter(pk__in=batch_ids)
+                unretired_counts = list(
+                    batch.filter(retired=Value(0)).values_list('queue_name').annotate(Count('id')).order_by()
+                )
+                batch.delete()
+                SubmissionManifest.objects.filter(submission_id__in=batch_ids).delete()
+                for queue_name, count in unretired_counts:
+                    QueueDepth.objects.adjust(queue_name, -count)
                 total_deletions += deletions_now
 
             if old_submissions.exists():
                 log.info("Sleeping %s seconds...", sleep_between)
                 time.sleep(sleep_between)
 
-        log.info("FINISHED: Deleted %s old submissions tokens total.", total_deletions)
+        return total_deletions
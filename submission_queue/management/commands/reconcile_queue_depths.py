@@ -0,0 +1,26 @@
+"""
+Correct drift in the maintained per-queue depth counters
+"""
+import logging
+
+from django.core.management.base import BaseCommand
+
+from submission_queue.models import QueueDepth
+
+log = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = """
+           Recount unretired submissions per queue and correct the QueueDepth counters
+           used by submit and get_queuelen. Run this periodically (e.g. from cron).
+           """
+
+    def handle(self, *args, **options):
+        log.info(' [*] Reconciling queue depth counters...')
+
+        corrections = QueueDepth.objects.reconcile()
+        for queue_name, (old_depth, new_depth) in sorted(corrections.items()):
+            log.info(f" [ ] Queue '{queue_name}' depth corrected from {old_depth} to {new_depth}")
+
+        log.info(f' [*] Corrected {len(corrections)} queue depth counters')
@@ -4,7 +4,7 @@ from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.db import models
 
-from submission_queue.consumer import post_failure_to_lms
+from submission_queue.consumer import get_delivery_engine, post_failure_to_lms
 from submission_queue.models import Submission
 
 log = logging.getLogger(__name__)
@@ -46,15 +46,29 @@ class Command(BaseCommand):
                 self.retire_submissions(failed_submissions, force)
 
     def retire_submissions(self, failed_submissions, force):
+        failed_submissions = [
+            failed_submission for failed_submission in failed_submissions
+            if failed_submission.num_failures >= settings.MAX_NUMBER_OF_FAILURES
+        ]
         for failed_submission in failed_submissions:
-            if failed_submission.num_failures >= settings.MAX_NUMBER_OF_FAILURES:
-                log.info(" [ ] Retiring submission id=%d from queue '%s' with num_failures=%d" %
-                         (failed_submission.id, failed_submission.queue_name, failed_submission.num_failures))
-                if force:
-                    failed_submission.retired = True  # Mark as done without contacting LMS
-                else:
-                    failed_submission.lms_ack = post_failure_to_lms(failed_submission.xqueue_header)
-                    failed_submission.retired = failed_submission.lms_ack
-                    if not failed_submission.lms_ack:
-                        log.error(' [ ] Could not contact LMS to retire submission id=%d' % failed_submission.id)
-                failed_submission.save()
+            log.info(" [ ] Retiring submission id=%d from queue '%s' with num_failures=%d" %
+                     (failed_submission.id, failed_submission.queue_name, failed_submission.num_failures))
+
+        if force:
+            lms_acks = [False] * len(failed_submissions)
+        else:
+            # Notify the LMS of all the failures in parallel
+            lms_acks = get_delivery_engine().map(
+                lambda failed_submission: post_failure_to_lms(failed_submission.xqueue_header),
+                failed_submissions,
+            )
+
+        for failed_submission, lms_ack in zip(failed_submissions, lms_acks):
+            if force:
+                failed_submission.retired = True  # Mark as done without contacting LMS
+            else:
+                failed_submission.lms_ack = lms_ack
+                failed_submission.retired = failed_submission.lms_ack
+                if not failed_submission.lms_ack:
+                    log.error(' [ ] Could not contact LMS to retire submission id=%d' % failed_submission.id)
+            failed_submission.save()
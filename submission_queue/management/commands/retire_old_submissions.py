@@ -1,5 +1,5 @@
 import logging
-from submission_queue.consumer import post_failure_to_lms
+from submission_queue.consumer import get_delivery_engine, post_failure_to_lms
 from submission_queue.models import Submission
 
 from django.core.management.base import BaseCommand, CommandError
@@ -39,10 +39,19 @@ class Command(BaseCommand):
             else:
                 raise CommandError("unable to parse datetime {}".format(options['retire_before']))
 
+        submissions = list(submissions)
         for submission in submissions:
             log.info(f"Retiring submission id={submission.id} from queue '{submission.queue_name}' ")
+
+        # Notify the LMS of all the retirements in parallel
+        lms_acks = get_delivery_engine().map(
+            lambda submission: post_failure_to_lms(submission.xqueue_header),
+            submissions,
+        )
+
+        for submission, lms_ack in zip(submissions, lms_acks):
             submission.retired = True
-            submission.lms_ack = post_failure_to_lms(submission.xqueue_header)
+            submission.lms_ack = lms_ack
             if not submission.lms_ack:
                 log.error(f'Could not contact LMS to retire submission id={submission.id} - retired anyway')
             submission.save()
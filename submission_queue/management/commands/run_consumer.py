@@ -1,9 +1,13 @@
 import logging
+import signal
 import time
-from submission_queue.consumer import Worker
+from submission_queue.async_consumer import AsyncConsumer
+from submission_queue.cluster import QueueCoordinator
+from submission_queue.consumer import Worker, push_queue_config
 
 from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.db import connections
 
 log = logging.getLogger(__name__)
 
@@ -17,17 +21,47 @@ class Command(BaseCommand):
     configuration
     """
 
+    stopping = False
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--asyncio',
+            action='store_true',
+            help='Serve all push queues from a single asyncio process instead of one process per queue',
+        )
+        parser.add_argument(
+            '--cluster',
+            action='store_true',
+            help='Share the push queues with run_consumer processes on other hosts, taking over from dead ones',
+        )
+
     def handle(self, *args, **options):
+        signal.signal(signal.SIGTERM, self.stop)
+
+        push_queues = {}
+        for name, value in settings.XQUEUES.items():
+            config = push_queue_config(value, name)
+            if config is not None:
+                push_queues[name] = config
+
+        if options['asyncio']:
+            if push_queues:
+                coordinator = QueueCoordinator(push_queues) if options['cluster'] else None
+                AsyncConsumer(push_queues, coordinator=coordinator).run()
+            return
+
+        if options['cluster']:
+            if push_queues:
+                self.run_cluster(push_queues)
+            return
+
         log.info(' [*] Starting queue workers...')
 
         workers = []
-        queues = list(settings.XQUEUES.items())
 
         # Assigned one worker for queue
-        for name, url in queues:
-            if url is not None:
-                worker = Worker(queue_name=name, worker_url=url)
-                workers.append(worker)
+        for name, config in push_queues.items():
+            workers.append(self.make_worker(name, config))
 
         # Start workers
         for worker in workers:
@@ -35,12 +69,48 @@ class Command(BaseCommand):
             worker.start()
 
         # Monitor workers
-        while workers:
+        while workers and not self.stopping:
             self.monitor(workers)
-            time.sleep(MONITOR_SLEEPTIME)
+            self.pause(MONITOR_SLEEPTIME)
+
+        if self.stopping:
+            self.stop_workers(workers)
 
         log.info(' [*] All workers finished. Exiting')
 
+    def stop(self, signum=None, frame=None):
+        """
+        SIGTERM handler: stop the workers gracefully and exit
+        """
+        log.info(' [*] Stopping queue workers...')
+        self.stopping = True
+
+    def pause(self, seconds):
+        """
+        Sleep for `seconds`, waking up early if we are asked to stop
+        """
+        deadline = time.monotonic() + seconds
+        while not self.stopping and time.monotonic() < deadline:
+            time.sleep(min(1, deadline - time.monotonic()))
+
+    def stop_workers(self, workers):
+        """
+        Send SIGTERM to the workers, which finish their gradings in flight within
+        CONSUMER_SHUTDOWN_TIMEOUT, and kill any that outlive it
+        """
+        for worker in workers:
+            if worker.exitcode is None:
+                worker.terminate()
+
+        # Give workers a moment past their own deadline to release what they hold
+        deadline = time.monotonic() + settings.CONSUMER_SHUTDOWN_TIMEOUT + 5
+        for worker in workers:
+            worker.join(max(0, deadline - time.monotonic()))
+            if worker.exitcode is None:
+                log.error(f' [{worker.queue_name}] Worker did not stop in time; killing it')
+                worker.kill()
+                worker.join()
+
     def monitor(self, workers):
         finished_workers = []
         failed_workers = []
@@ -65,8 +135,60 @@ class Command(BaseCommand):
             log.info(f' [{worker.queue_name}] Worker failed')
             workers.remove(worker)
 
-            new_worker = Worker(queue_name=worker.queue_name, worker_url=worker.worker_url)
+            new_worker = Worker(queue_name=worker.queue_name, worker_url=worker.worker_url,
+                                concurrency=worker.concurrency, endpoints=worker.endpoints,
+                                deadline=worker.deadline)
             workers.append(new_worker)
 
             log.info(f' [{new_worker.queue_name}] Starting worker')
             new_worker.start()
+
+    def make_worker(self, name, config):
+        return Worker(queue_name=name, worker_url=config['url'], concurrency=config['concurrency'],
+                      endpoints=config['endpoints'], deadline=config['deadline'])
+
+    def run_cluster(self, push_queues):
+        """
+        Run workers for this node's share of the push queues, adjusting the
+        share on every heartbeat as nodes join and leave
+        """
+        coordinator = QueueCoordinator(push_queues)
+        log.info(f' [*] Joining consumers as node {coordinator.node_id}')
+
+        workers = {}
+        # Workers for queues that moved away, still finishing their gradings
+        retiring = []
+        try:
+            while not self.stopping:
+                try:
+                    owned = coordinator.sync()
+                except Exception:  # pylint: disable=broad-except
+                    log.exception("Could not sync queue ownership")
+                    # Keep serving the last known share, on a fresh connection next time
+                    connections.close_all()
+                    owned = coordinator.owned
+
+                for name in set(workers) - owned:
+                    log.info(f' [{name}] Queue moved to another node; stopping worker')
+                    worker = workers.pop(name)
+                    worker.terminate()
+                    retiring.append(worker)
+                retiring = [worker for worker in retiring if worker.exitcode is None]
+
+                for name in sorted(owned):
+                    worker = workers.get(name)
+                    if worker is not None and worker.exitcode is None:  # the process is running
+                        continue
+                    if worker is not None:
+                        log.info(f' [{name}] Worker stopped')
+
+                    # Don't let the worker inherit this process's database connection
+                    connections.close_all()
+                    workers[name] = self.make_worker(name, push_queues[name])
+                    log.info(f' [{name}] Starting worker')
+                    workers[name].start()
+
+                self.pause(settings.CONSUMER_HEARTBEAT_INTERVAL)
+        finally:
+            self.stop_workers(list(workers.values()) + retiring)
+            coordinator.leave()
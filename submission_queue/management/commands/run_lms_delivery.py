@@ -0,0 +1,35 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from submission_queue.delivery import deliver_due
+
+log = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = """
+    Deliver grades waiting in the LMS delivery outbox (see LMS_DELIVERY_OUTBOX)
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Deliver everything that is currently due, then exit',
+        )
+
+    def handle(self, *args, **options):
+        log.info(' [*] Starting LMS delivery worker...')
+
+        while True:
+            delivered = deliver_due()
+            if delivered:
+                continue
+            if options['once']:
+                break
+            time.sleep(settings.LMS_DELIVERY_POLL_INTERVAL)
+
+        log.info(' [*] LMS delivery worker finished')
@@ -0,0 +1,53 @@
+from submission_queue.management.commands.tests import bulk_create_submissions, create_submission
+from submission_queue.models import ArchivedSubmission, Submission, get_submission_by_id
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError
+from django.test import TransactionTestCase
+
+
+class ArchiveRetiredSubmissionsTest(TransactionTestCase):
+    def test_archives_retired_only(self):
+        bulk_create_submissions(3, retired=1)
+        unretired = create_submission()
+        retired = Submission.objects.filter(retired=True).order_by('id')
+        retired_values = list(retired.values())
+
+        call_command('archive_retired_submissions', chunk_size=2)
+
+        self.assertEqual(list(Submission.objects.all()), [unretired])
+        self.assertEqual(list(ArchivedSubmission.objects.order_by('id').values()), retired_values)
+        self.assertEqual(Submission.objects.get_queue_length('test'), 1)
+
+    def test_lookup_by_id_sees_archive(self):
+        submission = create_submission(retired=1)
+        call_command('archive_retired_submissions')
+
+        archived = get_submission_by_id(submission.id)
+        self.assertIsInstance(archived, ArchivedSubmission)
+        self.assertEqual(archived.arrival_time, submission.arrival_time)
+        with self.assertRaises(Submission.DoesNotExist):
+            get_submission_by_id(submission.id + 1)
+
+    def test_deleted_with_old_submissions(self):
+        bulk_create_submissions(5, retired=1)
+        call_command('archive_retired_submissions')
+        self.assertEqual(ArchivedSubmission.objects.count(), 5)
+        call_command('delete_old_submissions')
+        self.assertEqual(ArchivedSubmission.objects.count(), 0)
+
+    def test_id_collision_keeps_active_row(self):
+        "A submission whose id is already archived is not deleted from the active table"
+        submission = create_submission(retired=1)
+        ArchivedSubmission.objects.create(id=submission.id, arrival_time=submission.arrival_time)
+
+        with self.assertRaises(IntegrityError):
+            ArchivedSubmission.objects.archive_retired(10)
+        self.assertTrue(Submission.objects.filter(id=submission.id).exists())
+
+    def test_bad_arguments(self):
+        with self.assertRaisesRegex(CommandError, 'Only non-negative sleep between seconds is allowed.*'):
+            call_command('archive_retired_submissions', sleep_between=-2)
+        with self.assertRaisesRegex(CommandError, 'Only positive chunk size is allowed.*'):
+            call_command('archive_retired_submissions', chunk_size=0)
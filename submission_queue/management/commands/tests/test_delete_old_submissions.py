@@ -1,5 +1,5 @@
 from submission_queue.management.commands.tests import bulk_create_submissions
-from submission_queue.models import Submission
+from submission_queue.models import Submission, SubmissionManifest
 
 from django.core.management import call_command
 from django.core.management.base import CommandError
@@ -21,6 +21,18 @@ class DeleteOldSubmissionsTest(TransactionTestCase):
         call_command('delete_old_submissions')
         self.assertEqual(Submission.objects.count(), 15)
 
+    def test_deletes_manifests(self):
+        bulk_create_submissions(5, 10)
+        bulk_create_submissions(5, 1)
+        for submission in Submission.objects.all():
+            SubmissionManifest.objects.record(submission.id, '{}', '{}')
+        call_command('delete_old_submissions')
+        self.assertEqual(
+            set(SubmissionManifest.objects.values_list('submission_id', flat=True)),
+            set(Submission.objects.values_list('id', flat=True)),
+        )
+        self.assertEqual(SubmissionManifest.objects.count(), 5)
+
     def test_chunks(self):
         bulk_create_submissions(20)
         call_command('delete_old_submissions', chunk_size=5, sleep_between=1)
@@ -0,0 +1,20 @@
+"""
+Tests of the reconcile_queue_depths management command.
+"""
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from submission_queue.models import QueueDepth, Submission
+
+
+class TestReconcileQueueDepths(TestCase):
+    """
+    Tests of the reconcile_queue_depths management command.
+    """
+    def test_corrects_drift(self):
+        Submission.objects.create(queue_name='tmp', lms_callback_url='/', xqueue_header='{}')
+        QueueDepth.objects.filter(queue_name='tmp').update(depth=-4)
+
+        call_command('reconcile_queue_depths')
+        assert QueueDepth.objects.get(queue_name='tmp').depth == 1
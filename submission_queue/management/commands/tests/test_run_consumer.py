@@ -1,9 +1,12 @@
-from unittest.mock import patch
+from unittest.mock import PropertyMock, patch
 
+from submission_queue.cluster import QueueCoordinator
 from submission_queue.consumer import Worker
 from submission_queue.management.commands.run_consumer import Command
+from submission_queue.models import ConsumerNode, QueueLease
 
 from django.core.management import call_command
+from django.db import DatabaseError
 from django.test import TestCase, override_settings
 
 
@@ -35,3 +38,104 @@ class RunConsumer(TestCase):
         """
         mock_worker.exitcode = 77
         Command().monitor([mock_worker])
+
+    @override_settings(XQUEUES={'pull': None, 'push': {'url': 'http://grader', 'concurrency': 4, 'deadline': 20}})
+    @patch.object(Worker, 'exitcode', new_callable=PropertyMock, return_value=0)
+    @patch.object(Worker, 'start')
+    @patch('submission_queue.management.commands.run_consumer.MONITOR_SLEEPTIME', 0)
+    def test_queue_concurrency(self, mock_start, mock_exitcode):
+        """
+        A push queue configured as a dict starts one worker with that concurrency
+        """
+        with patch('submission_queue.management.commands.run_consumer.Worker', wraps=Worker) as mock_worker:
+            call_command('run_consumer')
+        mock_worker.assert_called_once_with(queue_name='push', worker_url='http://grader', concurrency=4,
+                                            endpoints=[('http://grader', 1)], deadline=20)
+        assert mock_start.call_count == 1
+
+    @override_settings(XQUEUES={'pull': None, 'push': 'http://grader'}, GRADING_DEADLINE=45)
+    @patch('submission_queue.management.commands.run_consumer.AsyncConsumer')
+    @patch.object(Worker, 'start')
+    def test_asyncio(self, mock_start, mock_consumer):
+        """
+        --asyncio serves the push queues from one AsyncConsumer instead of workers
+        """
+        call_command('run_consumer', '--asyncio')
+        mock_consumer.assert_called_once_with(
+            {'push': {'url': 'http://grader', 'endpoints': [('http://grader', 1)], 'concurrency': 1, 'deadline': 45}},
+            coordinator=None)
+        mock_consumer.return_value.run.assert_called_once_with()
+        assert not mock_start.called
+
+    @override_settings(XQUEUES={'pull': None, 'push-a': 'http://grader-a', 'push-b': 'http://grader-b'})
+    @patch('submission_queue.management.commands.run_consumer.connections')
+    @patch.object(Command, 'pause', autospec=True, side_effect=lambda command, seconds: command.stop())
+    @patch.object(Worker, 'exitcode', new_callable=PropertyMock, return_value=None)
+    @patch.object(Worker, 'kill')
+    @patch.object(Worker, 'join')
+    @patch.object(Worker, 'terminate')
+    @patch.object(Worker, 'start')
+    def test_cluster(self, mock_start, mock_terminate, mock_join, mock_kill, mock_exitcode, mock_pause,
+                     mock_connections):
+        """
+        --cluster starts workers for the queues this node owns, stops them when
+        asked to, and gives the queues up
+        """
+        call_command('run_consumer', '--cluster')
+        assert mock_start.call_count == 2
+        assert mock_terminate.call_count == 2
+        assert not QueueLease.objects.exists()
+        assert not ConsumerNode.objects.exists()
+
+    @override_settings(XQUEUES={'push-a': 'http://grader-a', 'push-b': 'http://grader-b'})
+    @patch('submission_queue.management.commands.run_consumer.connections')
+    @patch.object(QueueCoordinator, 'sync', autospec=True)
+    @patch.object(Worker, 'exitcode', new_callable=PropertyMock, return_value=None)
+    @patch.object(Worker, 'kill')
+    @patch.object(Worker, 'join')
+    @patch.object(Worker, 'terminate')
+    @patch.object(Worker, 'start')
+    def test_cluster_survives_failed_sync(self, mock_start, mock_terminate, mock_join, mock_kill, mock_exitcode,
+                                          mock_sync, mock_connections):
+        """
+        A heartbeat that can't reach the database is logged, and the node keeps
+        serving the queues it last owned
+        """
+        def sync(coordinator):
+            if mock_sync.call_count > 1:
+                raise DatabaseError('gone')
+            coordinator.owned = {'push-a', 'push-b'}
+            return coordinator.owned
+        mock_sync.side_effect = sync
+
+        pauses = []
+
+        def pause(command, seconds):
+            pauses.append(seconds)
+            if len(pauses) == 3:
+                command.stop()
+
+        with patch.object(Command, 'pause', autospec=True, side_effect=pause), \
+                self.assertLogs('submission_queue.management.commands.run_consumer', 'ERROR') as logs:
+            call_command('run_consumer', '--cluster')
+        assert [record.getMessage() for record in logs.records].count('Could not sync queue ownership') == 2
+        assert mock_sync.call_count == 3
+        assert mock_start.call_count == 2
+        assert mock_terminate.call_count == 2
+
+    @override_settings(XQUEUES={'push': 'http://grader'}, CONSUMER_SHUTDOWN_TIMEOUT=0)
+    @patch.object(Command, 'pause', autospec=True, side_effect=lambda command, seconds: command.stop())
+    @patch.object(Worker, 'exitcode', new_callable=PropertyMock, return_value=None)
+    @patch.object(Worker, 'kill')
+    @patch.object(Worker, 'join')
+    @patch.object(Worker, 'terminate')
+    @patch.object(Worker, 'start')
+    def test_sigterm_stops_workers(self, mock_start, mock_terminate, mock_join, mock_kill, mock_exitcode, mock_pause):
+        """
+        On SIGTERM the workers are asked to stop gracefully, and killed if they
+        are still running after CONSUMER_SHUTDOWN_TIMEOUT
+        """
+        call_command('run_consumer')
+        mock_terminate.assert_called_once_with()
+        mock_kill.assert_called_once_with()
+        assert mock_join.call_count == 2
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:59
+
+from django.db import migrations, models
+
+
+def seed_queue_depths(apps, schema_editor):
+    """
+    Start the counters from the current number of unretired submissions per queue
+    """
+    Submission = apps.get_model('submission_queue', 'Submission')
+    QueueDepth = apps.get_model('submission_queue', 'QueueDepth')
+    counts = Submission.objects.filter(retired=models.Value(0)).values_list('queue_name').annotate(
+        models.Count('id')
+    ).order_by()
+    QueueDepth.objects.bulk_create(
+        QueueDepth(queue_name=queue_name, depth=count) for queue_name, count in counts
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submission_queue', '0005_rename_submission_queue_name_retired_push_time_arrival_time_queue_submi_queue_n_4c6cd5_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueueDepth',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('queue_name', models.CharField(max_length=128, unique=True)),
+                ('depth', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'queue_depth',
+            },
+        ),
+        migrations.RunPython(seed_queue_depths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:01
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def carry_over_leases(apps, schema_editor):
+    """
+    Keep hiding submissions that were pulled or pushed within the last
+    SUBMISSION_PROCESSING_DELAY, as the old pull_time/push_time filter did.
+    Everything else keeps the already-expired lease the new column was filled with.
+    """
+    Submission = apps.get_model('submission_queue', 'Submission')
+    delay = timedelta(minutes=settings.SUBMISSION_PROCESSING_DELAY)
+    cutoff = django.utils.timezone.now() - delay
+    for time_field in ('pull_time', 'push_time'):
+        Submission.objects.filter(retired=models.Value(0), **{time_field + '__gt': cutoff}).update(
+            lease_expires_at=models.F(time_field) + delay
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submission_queue', '0006_queue_depth'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submission',
+            name='lease_expires_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='submission',
+            index=models.Index(fields=['queue_name', 'retired', 'arrival_time', 'lease_expires_at'], name='queue_submi_queue_n_47e48f_idx'),
+        ),
+        migrations.RunPython(carry_over_leases, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='submission',
+            name='queue_submi_queue_n_4c6cd5_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='submission',
+            name='queue_submi_queue_n_9fcfbd_idx',
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:03
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submission_queue', '0007_lease_expires_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedSubmission',
+            fields=[
+                ('requester_id', models.CharField(max_length=128)),
+                ('queue_name', models.CharField(max_length=128)),
+                ('xqueue_header', models.CharField(max_length=1024)),
+                ('xqueue_body', models.TextField()),
+                ('s3_keys', models.CharField(max_length=1024)),
+                ('s3_urls', models.CharField(max_length=1024)),
+                ('pull_time', models.DateTimeField(blank=True, null=True)),
+                ('push_time', models.DateTimeField(blank=True, null=True)),
+                ('return_time', models.DateTimeField(blank=True, null=True)),
+                ('lease_expires_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('grader_id', models.CharField(max_length=128)),
+                ('pullkey', models.CharField(max_length=128)),
+                ('grader_reply', models.TextField()),
+                ('num_failures', models.IntegerField(default=0)),
+                ('lms_ack', models.BooleanField(default=False)),
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('arrival_time', models.DateTimeField()),
+                ('lms_callback_url', models.CharField(max_length=128)),
+                ('retired', models.BooleanField(default=False)),
+            ],
+            options={
+                'db_table': 'queue_submission_archive',
+                'indexes': [models.Index(fields=['arrival_time'], name='queue_submi_arrival_2be019_idx')],
+            },
+        ),
+    ]
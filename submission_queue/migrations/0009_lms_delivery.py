@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:05
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submission_queue', '0008_archived_submission'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LMSDelivery',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('submission_id', models.IntegerField(db_index=True)),
+                ('xqueue_header', models.CharField(max_length=1024)),
+                ('xqueue_body', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('attempts', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'queue_lms_delivery',
+                'indexes': [models.Index(fields=['next_attempt_at'], name='queue_lms_d_next_at_15c9df_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submission_queue', '0009_lms_delivery'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConsumerNode',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('node_id', models.CharField(max_length=128, unique=True)),
+                ('heartbeat', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'db_table': 'queue_consumer_node',
+            },
+        ),
+        migrations.CreateModel(
+            name='QueueLease',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('queue_name', models.CharField(max_length=128, unique=True)),
+                ('node_id', models.CharField(max_length=128)),
+                ('expires_at', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'queue_lease',
+            },
+        ),
+    ]
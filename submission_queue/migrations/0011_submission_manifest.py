@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submission_queue', '0010_consumer_node_queue_lease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubmissionManifest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('submission_id', models.IntegerField(unique=True)),
+                ('keys', models.TextField()),
+                ('urls', models.TextField()),
+            ],
+            options={
+                'db_table': 'queue_submission_manifest',
+            },
+        ),
+    ]
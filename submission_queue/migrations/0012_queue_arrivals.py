@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submission_queue', '0011_submission_manifest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueueArrivals',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('queue_name', models.CharField(max_length=128, unique=True)),
+                ('count', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'queue_arrivals',
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submission_queue', '0012_queue_arrivals'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='submission',
+            index=models.Index(fields=['queue_name', 'retired', 'lease_expires_at'], name='queue_submi_queue_n_d84c16_idx'),
+        ),
+    ]
@@ -5,12 +5,14 @@ django-admin.py schemamigration submission_queue [migration_name] --auto --setti
 
 """
 import json
-from datetime import datetime, timedelta
-from zoneinfo import ZoneInfo
+from datetime import timedelta
 
 from django.conf import settings
-from django.db import models
-from django.db.models import Q
+from django.db import connections, models, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from submission_queue.util import make_hashkey
 
 CHARFIELD_LEN_SMALL = 128
 CHARFIELD_LEN_LARGE = 1024
@@ -23,75 +25,189 @@ class SubmissionManager(models.Manager):
 
     def get_queue_length(self, queue_name):
         """
-        How many unretired submissions are available for a queue
+        How many unretired submissions are available for a queue. This reads the
+        maintained QueueDepth counter and subtracts the submissions currently leased
+        to a grader, so only in-flight rows are counted.
         """
-        return self.time_filter('pull_time').filter(queue_name=queue_name, retired=models.Value(0)).count()
+        # We use models.Value(0) to make use of the indexing on the field. MySQL does not
+        # support boolean types natively, and checking for False will cause a table scan.
+        leased = self.filter(
+            queue_name=queue_name, retired=models.Value(0), lease_expires_at__gt=timezone.now()
+        ).count()
+        return max(QueueDepth.objects.get_depth(queue_name) - leased, 0)
 
-    def get_single_unretired_submission(self, queue_name):
+    def claim_unretired_submissions(self, queue_name, grader_id, limit=1):
         '''
-        Retrieve a single unretired queued item, if one exists, for the named queue
+        Atomically claim up to `limit` of the oldest unretired items in the named queue
+        for a pull grader. Claimed items are stamped with grader_id, pull_time and a fresh
+        pullkey before this returns, so concurrent graders never receive the same item.
 
-        Returns (success, submission):
-            success:    Flag whether retrieval is successful (Boolean)
-                        If no unretired item in the queue, return False
-            submission: A single submission from the queue, guaranteed to be unretired
+        Returns a list of claimed submissions, oldest first. The list is empty if the
+        queue has nothing available.
         '''
+        def stamp(submission, now):
+            submission.grader_id = grader_id
+            submission.pull_time = now
+            submission.pullkey = make_hashkey(str(now) + str(submission.id))
+            return ['grader_id', 'pull_time', 'pullkey']
 
-        # We use models.Value(0) to make use of the indexing on the field. MySQL does not
-        # support boolean types natively, and checking for False will cause a table scan.
-        submission = self.time_filter('pull_time').filter(
-                            queue_name=queue_name, retired=models.Value(0)
-                        ).order_by(
-                            'arrival_time'
-                        ).first()
-
-        if submission:
-            return (True, submission)
+        return self._claim_submissions(queue_name, limit, stamp)
+
+    def claim_unretired_submission(self, queue_name, grader_id):
+        '''
+        Claim a single unretired item from the named queue for a pull grader.
+
+        Returns (success, submission):
+            success:    Flag whether a submission was claimed (Boolean)
+            submission: The claimed submission, or '' if the queue has nothing available
+        '''
+        claimed = self.claim_unretired_submissions(queue_name, grader_id, limit=1)
+        if claimed:
+            return (True, claimed[0])
         else:
             return (False, '')
 
-    def get_single_unpushed_submission(self, queue_name):
+    def claim_unpushed_submission(self, queue_name, grader_id, lease=None):
         """
-        Finds a single submission that hasn't been pushed for SUBMISSION_PROCESSING_DELAY
+        Atomically claim the oldest available item in the named queue for pushing
+        to a passive grader, stamping grader_id and push_time. The submission is
+        leased for `lease` (timedelta) if given, else for the queue's lease duration.
+
+        Returns the claimed submission, or None if the queue has nothing available.
         """
-        # We use models.Value(0) to make use of the indexing on the field. MySQL does not
-        # support boolean types natively, and checking for False will cause a table scan.
-        return self.time_filter('push_time').filter(
+        def stamp(submission, now):
+            submission.grader_id = grader_id
+            submission.push_time = now
+            return ['grader_id', 'push_time']
+
+        claimed = self._claim_submissions(queue_name, 1, stamp, lease)
+        return claimed[0] if claimed else None
+
+    def _claim_submissions(self, queue_name, limit, stamp, lease=None):
+        '''
+        Select and lease up to `limit` available submissions in one step.
+
+        On backends that support it we lock the candidate rows with
+        SELECT ... FOR UPDATE SKIP LOCKED, so concurrent claimers skip past each other's
+        rows instead of queuing on the same lock. Elsewhere (SQLite) we fall back to a
+        compare-and-swap UPDATE guarded on the previous lease_expires_at, and only
+        keep the rows whose update actually matched.
+
+        `stamp(submission, now)` sets the claim fields on a submission and returns their names.
+        Every claimed submission is also leased for `lease` (timedelta), by default
+        the queue's lease duration.
+        '''
+        lease = lease or self.lease_duration(queue_name)
+
+        def stamp_and_lease(submission, now):
+            submission.lease_expires_at = now + lease
+            return stamp(submission, now) + ['lease_expires_at']
+
+        now = timezone.now()
+        available = self.available(now).filter(
             queue_name=queue_name, retired=models.Value(0)
-        ).order_by(
-            'arrival_time'
-        ).first()
+        ).order_by('arrival_time')
+
+        if connections[self.db].features.has_select_for_update_skip_locked:
+            with transaction.atomic(using=self.db):
+                claimed = list(available.select_for_update(skip_locked=True)[:limit])
+                for submission in claimed:
+                    submission.save(update_fields=stamp_and_lease(submission, now))
+            return claimed
+
+        claimed = []
+        for submission in available[:limit]:
+            previous = submission.lease_expires_at
+            fields = stamp_and_lease(submission, now)
+            updated = super().get_queryset().filter(
+                id=submission.id, retired=models.Value(0), lease_expires_at=previous
+            ).update(**{field: getattr(submission, field) for field in fields})
+            if updated:
+                claimed.append(submission)
+        return claimed
 
-    def time_filter(self, time_field=None):
+    def record_outcome(self, submission, fields):
         """
-        filters on push_time or pull_time to limit to submissions that haven't been pushed/pulled
-        or were pushed/pulled SUBMISSION_PROCESSING_DELAY ago
+        Write `fields` of a claimed submission back after grading, and retire it
+        if `submission.retired` is set.
 
-        return a queryset that has been filtered on the specified time column
+        The row may have changed while the submission was out with a grader: it
+        may have been retired because the LMS resubmitted, or moved to the
+        archive. So only the given fields are written, a retired row is never
+        made unretired again, and a row that is no longer in the active table is
+        updated in the archive rather than inserted again.
+        """
+        values = {name: getattr(submission, name) for name in fields}
+        with transaction.atomic(using=self.db):
+            active = super().get_queryset().filter(id=submission.id)
+            if not submission.retired:
+                active.filter(retired=models.Value(0)).update(**values)
+            elif active.filter(retired=models.Value(0)).update(retired=True, **values):
+                QueueDepth.objects.adjust(submission.queue_name, -1)
+            elif not active.update(**values):
+                ArchivedSubmission.objects.filter(id=submission.id).update(**values)
+        submission._loaded_retired = submission.retired
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """
+        Insert submissions in bulk, keeping the queue depth counters in step
         """
+        objs = super().bulk_create(objs, *args, **kwargs)
+        arrivals = {}
+        for submission in objs:
+            if not submission.retired:
+                arrivals[submission.queue_name] = arrivals.get(submission.queue_name, 0) + 1
+            submission._loaded_retired = submission.retired
+        for queue_name, count in arrivals.items():
+            QueueDepth.objects.adjust(queue_name, count)
+        return objs
 
-        if time_field not in ['push_time', 'pull_time']:
-            raise ValueError(f'time_field must be pull_time or push_time not ({time_field})')
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        """
+        Update submissions in bulk, keeping the queue depth counters in step
+        with any change to `retired`
+        """
+        objs = list(objs)
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        if 'retired' in fields:
+            changes = {}
+            for submission in objs:
+                change = submission._retired_change()
+                if change:
+                    changes[submission.queue_name] = changes.get(submission.queue_name, 0) + change
+                submission._loaded_retired = submission.retired
+            for queue_name, change in changes.items():
+                QueueDepth.objects.adjust(queue_name, change)
+        return rows
 
-        previous_update = datetime.now(ZoneInfo("UTC")) - timedelta(minutes=settings.SUBMISSION_PROCESSING_DELAY)
-        if time_field == "push_time":
-            time_filter = Q(push_time__lte=(previous_update)) | Q(push_time__isnull=True)
-        elif time_field == "pull_time":
-            time_filter = Q(pull_time__lte=(previous_update)) | Q(pull_time__isnull=True)
+    def available(self, now=None):
+        """
+        Limit to submissions whose lease has expired, i.e. that aren't currently
+        pulled by or pushed to a grader. New submissions are created with an
+        already-expired lease, so this is a single predicate that the queue index
+        can check as it walks submissions in arrival order.
+        """
+        return super().get_queryset().filter(lease_expires_at__lte=now or timezone.now())
 
-        return super().get_queryset().filter(time_filter)
+    def lease_duration(self, queue_name):
+        """
+        How long a claimed submission from the named queue stays hidden from other
+        graders: SUBMISSION_LEASE_SECONDS[queue_name] if configured, otherwise
+        SUBMISSION_PROCESSING_DELAY minutes.
+        """
+        seconds = settings.SUBMISSION_LEASE_SECONDS.get(queue_name)
+        if seconds is None:
+            return timedelta(minutes=settings.SUBMISSION_PROCESSING_DELAY)
+        return timedelta(seconds=seconds)
 
 
-class Submission(models.Model):
+class BaseSubmission(models.Model):
     '''
-    Representation of submission request, including metadata information
+    Fields shared by active submissions and their archived copies
     '''
 
     class Meta:
-        # Once we get to Django 1.11 use indexes, it would have allowed a better index name
-        # https://docs.djangoproject.com/en/1.11/ref/models/options/#django.db.models.Options.indexes
-        indexes = [models.Index(fields=("queue_name", "retired", "push_time", "arrival_time")), models.Index(fields=("queue_name", "retired", "pull_time", "arrival_time")), models.Index(fields=("lms_callback_url", "retired"))]
-        db_table = 'queue_submission'
+        abstract = True
 
     # Submission
     requester_id     = models.CharField(max_length=CHARFIELD_LEN_SMALL)  # ID of LMS
@@ -111,6 +227,9 @@ class Submission(models.Model):
     push_time    = models.DateTimeField(null=True, blank=True)  # Time of push, if xqueue pushed to external grader
     return_time  = models.DateTimeField(null=True, blank=True)  # Time of return from external grader
 
+    # Time until which the submission is claimed by a grader. Expired (or new) leases are available.
+    lease_expires_at = models.DateTimeField(default=timezone.now)
+
     # External pull interface
     grader_id = models.CharField(max_length=CHARFIELD_LEN_SMALL)  # ID of external grader
     pullkey   = models.CharField(max_length=CHARFIELD_LEN_SMALL)  # Secret key for external pulling interface
@@ -121,8 +240,6 @@ class Submission(models.Model):
     lms_ack = models.BooleanField(default=False)  # True/False on whether LMS acknowledged receipt
     retired = models.BooleanField(default=False, db_index=True)  # True/False on whether Submission is "finished"
 
-    objects = SubmissionManager()
-
     def __str__(self):
         submission_info  = f"Submission from {self.requester_id} for queue '{self.queue_name}':\n"
         submission_info += "    Callback URL: %s\n" % self.lms_callback_url
@@ -130,6 +247,7 @@ class Submission(models.Model):
         submission_info += "    Pull time:    %s\n" % self.pull_time
         submission_info += "    Push time:    %s\n" % self.push_time
         submission_info += "    Return time:  %s\n" % self.return_time
+        submission_info += "    Lease until:  %s\n" % self.lease_expires_at
         submission_info += "    Grader_id:    %s\n" % self.grader_id
         submission_info += "    Pullkey:      %s\n" % self.pullkey
         submission_info += "    num_failures: %d\n" % self.num_failures
@@ -152,3 +270,430 @@ class Submission(models.Model):
         Alias for `s3_urls` field.
         '''
         return self.s3_urls
+
+
+class Submission(BaseSubmission):
+    '''
+    Representation of submission request, including metadata information
+    '''
+
+    class Meta:
+        # Once we get to Django 1.11 use indexes, it would have allowed a better index name
+        # https://docs.djangoproject.com/en/1.11/ref/models/options/#django.db.models.Options.indexes
+        # Claims walk (queue_name, retired) in arrival_time order and stop at their LIMIT;
+        # lease_expires_at is filtered from the index without touching skipped rows.
+        # Queue lengths range-scan the leased (in-flight) rows of a queue.
+        indexes = [
+            models.Index(fields=("queue_name", "retired", "arrival_time", "lease_expires_at")),
+            models.Index(fields=("queue_name", "retired", "lease_expires_at")),
+            models.Index(fields=("lms_callback_url", "retired")),
+        ]
+        db_table = 'queue_submission'
+
+    objects = SubmissionManager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember whether the row was retired when loaded, so save() knows
+        # whether to move the queue depth counter.
+        instance._loaded_retired = instance.__dict__.get('retired')
+        return instance
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+            change = (0 if self.retired else 1) if adding else self._retired_change()
+            if change:
+                QueueDepth.objects.adjust(self.queue_name, change)
+        self._loaded_retired = self.retired
+
+    def _retired_change(self):
+        """
+        How the queue depth moves if this submission is saved: -1 when it becomes
+        retired, +1 when it comes back, 0 otherwise (or if we can't tell)
+        """
+        loaded_retired = getattr(self, '_loaded_retired', None)
+        if loaded_retired is None or bool(loaded_retired) == bool(self.retired):
+            return 0
+        return -1 if self.retired else 1
+
+
+class ArchivedSubmissionManager(models.Manager):
+    """
+    Moving retired submissions out of the active table
+    """
+
+    def archive_retired(self, limit):
+        """
+        Move up to `limit` retired submissions from the active Submission table into
+        the archive, in one transaction. Archived rows keep their ids.
+
+        Returns the number of submissions archived.
+        """
+        with transaction.atomic(using=self.db):
+            retired = Submission.objects.filter(retired=models.Value(1)).order_by('id')
+            if connections[self.db].features.has_select_for_update_skip_locked:
+                retired = retired.select_for_update(skip_locked=True)
+            batch = list(retired[:limit])
+            if not batch:
+                return 0
+
+            fields = [field.attname for field in Submission._meta.concrete_fields]
+            self.bulk_create(
+                [self.model(**{name: getattr(submission, name) for name in fields}) for submission in batch],
+            )
+            Submission.objects.filter(id__in=[submission.id for submission in batch]).delete()
+        return len(batch)
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        """
+        Update archived submissions in bulk; like save(), this keeps them retired
+        """
+        objs = list(objs)
+        for submission in objs:
+            submission.retired = True
+        return super().bulk_update(objs, fields, *args, **kwargs)
+
+
+class ArchivedSubmission(BaseSubmission):
+    '''
+    A retired submission moved out of the active queue_submission table by the
+    archive_retired_submissions command, so that the active table only holds
+    in-flight work. Same schema as Submission, keeping the original id.
+    '''
+
+    class Meta:
+        indexes = [models.Index(fields=("arrival_time",))]
+        db_table = 'queue_submission_archive'
+
+    id = models.IntegerField(primary_key=True)
+    arrival_time = models.DateTimeField()  # Copied from the active submission
+
+    # Redeclared without db_index: the archive is only looked up by id, so the
+    # lookup indexes of the active table would just slow down archiving.
+    lms_callback_url = models.CharField(max_length=CHARFIELD_LEN_SMALL)
+    retired = models.BooleanField(default=False)
+
+    objects = ArchivedSubmissionManager()
+
+    def save(self, *args, **kwargs):
+        # Archived submissions are finished by definition; a late grader reply
+        # must not make one look like queued work.
+        self.retired = True
+        super().save(*args, **kwargs)
+
+
+def get_submission_by_id(submission_id, for_update=False):
+    '''
+    Look up a submission by id in the active table, falling back to the archive.
+
+    Returns a Submission or ArchivedSubmission, or raises Submission.DoesNotExist.
+    '''
+    for model in (Submission, ArchivedSubmission):
+        queryset = model.objects.select_for_update() if for_update else model.objects.all()
+        try:
+            return queryset.get(id=submission_id)
+        except model.DoesNotExist:
+            pass
+    raise Submission.DoesNotExist(f'Submission {submission_id} does not exist')
+
+
+class QueueDepthManager(models.Manager):
+    """
+    Maintenance of the per-queue depth counters
+    """
+
+    def get_depth(self, queue_name):
+        """
+        The number of unretired submissions in a queue, as last counted
+        """
+        depth = self.filter(queue_name=queue_name).values_list('depth', flat=True).first()
+        return max(depth or 0, 0)
+
+    def adjust(self, queue_name, delta):
+        """
+        Move the counter for a queue by `delta`, creating it if needed
+        """
+        if not self.filter(queue_name=queue_name).update(depth=F('depth') + delta):
+            _, created = self.get_or_create(queue_name=queue_name, defaults={'depth': delta})
+            if not created:
+                self.filter(queue_name=queue_name).update(depth=F('depth') + delta)
+
+    def reconcile(self):
+        """
+        Recount unretired submissions per queue and correct any counters that
+        have drifted.
+
+        Returns a dict of {queue_name: (old_depth, new_depth)} for corrected queues.
+        """
+        with transaction.atomic(using=self.db):
+            counters = {depth.queue_name: depth for depth in self.select_for_update()}
+            counts = dict(
+                Submission.objects.filter(retired=models.Value(0)).values_list('queue_name').annotate(
+                    models.Count('id')
+                ).order_by()
+            )
+
+            corrections = {}
+            for queue_name in set(counters) | set(counts):
+                counted = counts.get(queue_name, 0)
+                counter = counters.get(queue_name)
+                if counter is None:
+                    self.create(queue_name=queue_name, depth=counted)
+                    corrections[queue_name] = (None, counted)
+                elif counter.depth != counted:
+                    self.filter(pk=counter.pk).update(depth=counted)
+                    corrections[queue_name] = (counter.depth, counted)
+        return corrections
+
+
+class QueueDepth(models.Model):
+    '''
+    Number of unretired submissions in a queue, maintained as submissions arrive
+    and are retired so that queue length doesn't count the whole queue. Periodically corrected by
+    the reconcile_queue_depths command.
+    '''
+
+    class Meta:
+        db_table = 'queue_depth'
+
+    queue_name = models.CharField(max_length=CHARFIELD_LEN_SMALL, unique=True)
+    depth = models.IntegerField(default=0)
+
+    objects = QueueDepthManager()
+
+    def __str__(self):
+        return f"{self.queue_name}: {self.depth}"
+
+
+class LMSDeliveryManager(models.Manager):
+    """
+    Claiming outbox entries for delivery
+    """
+
+    def claim_due(self, limit, lease):
+        """
+        Atomically claim up to `limit` entries whose next attempt is due, pushing
+        their next_attempt_at out by `lease` (timedelta) so that other delivery
+        workers skip them while we deliver.
+
+        Returns a list of claimed entries, oldest first.
+        """
+        now = timezone.now()
+        due = self.filter(next_attempt_at__lte=now).order_by('next_attempt_at', 'id')
+
+        if connections[self.db].features.has_select_for_update_skip_locked:
+            with transaction.atomic(using=self.db):
+                claimed = list(due.select_for_update(skip_locked=True)[:limit])
+                self.filter(id__in=[entry.id for entry in claimed]).update(next_attempt_at=now + lease)
+            return claimed
+
+        claimed = []
+        for entry in due[:limit]:
+            if self.filter(id=entry.id, next_attempt_at=entry.next_attempt_at).update(next_attempt_at=now + lease):
+                claimed.append(entry)
+        return claimed
+
+
+class LMSDelivery(models.Model):
+    '''
+    Outbox entry for a grade that still has to be delivered to the LMS. Written in
+    the same transaction as the grade itself by put_result when LMS_DELIVERY_OUTBOX
+    is enabled, and drained by the run_lms_delivery command.
+    '''
+
+    class Meta:
+        indexes = [models.Index(fields=("next_attempt_at",))]
+        db_table = 'queue_lms_delivery'
+
+    submission_id = models.IntegerField(db_index=True)  # Not a foreign key: the submission may be archived
+    xqueue_header = models.CharField(max_length=CHARFIELD_LEN_LARGE)
+    xqueue_body = models.TextField()
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    attempts = models.IntegerField(default=0)
+
+    objects = LMSDeliveryManager()
+
+    def __str__(self):
+        return f"LMS delivery for submission {self.submission_id} ({self.attempts} attempts)"
+
+
+class SubmissionManifestManager(models.Manager):
+    """
+    Reading and writing the file lists of submissions with many files
+    """
+
+    def get_urls(self, submission_id):
+        """
+        The JSON-serialized filename to URL dict of a submission, or None if it
+        has no manifest
+        """
+        return self.filter(submission_id=submission_id).values_list('urls', flat=True).first()
+
+    def record(self, submission_id, keys, urls):
+        """
+        Store the JSON-serialized file lists of a submission. A manifest that is
+        already stored is left as it is.
+        """
+        self.bulk_create([self.model(submission_id=submission_id, keys=keys, urls=urls)], ignore_conflicts=True)
+
+
+class SubmissionManifest(models.Model):
+    '''
+    File lists of a submission that are too long for its s3_keys and s3_urls
+    columns, which then hold KEY_FOR_EXTERNAL_DICTS and URL_FOR_EXTERNAL_DICTS
+    instead. Submissions made before this table existed only have the uploaded
+    copy of the lists; their manifest is stored the first time they are pulled.
+    '''
+
+    class Meta:
+        db_table = 'queue_submission_manifest'
+
+    submission_id = models.IntegerField(unique=True)  # Not a foreign key: the submission may be archived
+    keys = models.TextField()  # JSON filename to key dict
+    urls = models.TextField()  # JSON filename to URL dict
+
+    objects = SubmissionManifestManager()
+
+    def __str__(self):
+        return f"File manifest for submission {self.submission_id}"
+
+
+class ConsumerNodeManager(models.Manager):
+    """
+    Registration of run_consumer nodes that share the push queues
+    """
+
+    def heartbeat(self, node_id):
+        """
+        Record that a node is alive
+        """
+        if not self.filter(node_id=node_id).update(heartbeat=timezone.now()):
+            self.get_or_create(node_id=node_id, defaults={'heartbeat': timezone.now()})
+
+    def live_node_ids(self, timeout):
+        """
+        Ids of the nodes that have sent a heartbeat in the last `timeout` (timedelta)
+        """
+        return list(self.filter(heartbeat__gte=timezone.now() - timeout).values_list('node_id', flat=True))
+
+    def prune(self, timeout):
+        """
+        Forget nodes that have sent no heartbeat in the last `timeout` (timedelta),
+        e.g. ones that crashed without leaving
+        """
+        return self.filter(heartbeat__lt=timezone.now() - timeout).delete()[0]
+
+
+class ConsumerNode(models.Model):
+    '''
+    A run_consumer process taking part in sharing the push queues with others.
+    Nodes that stop sending heartbeats are considered dead.
+    '''
+
+    class Meta:
+        db_table = 'queue_consumer_node'
+
+    node_id = models.CharField(max_length=CHARFIELD_LEN_SMALL, unique=True)
+    heartbeat = models.DateTimeField(db_index=True)
+
+    objects = ConsumerNodeManager()
+
+    def __str__(self):
+        return f"{self.node_id}: {self.heartbeat}"
+
+
+class QueueLeaseManager(models.Manager):
+    """
+    Acquiring and releasing ownership of push queues
+    """
+
+    def acquire(self, queue_name, node_id, duration):
+        """
+        Take or renew ownership of a queue for `duration` (timedelta). Succeeds if
+        the queue is unowned, already owned by `node_id`, or its lease has expired.
+
+        Returns:
+            acquired: Flag indicating whether `node_id` now owns the queue (Boolean)
+        """
+        now = timezone.now()
+        owned = models.Q(node_id=node_id) | models.Q(expires_at__lte=now)
+        if self.filter(owned, queue_name=queue_name).update(node_id=node_id, expires_at=now + duration):
+            return True
+
+        _, created = self.get_or_create(queue_name=queue_name,
+                                        defaults={'node_id': node_id, 'expires_at': now + duration})
+        return created
+
+    def release(self, queue_name, node_id):
+        """
+        Give up ownership of a queue, if `node_id` holds it
+        """
+        self.filter(queue_name=queue_name, node_id=node_id).delete()
+
+
+class QueueLease(models.Model):
+    '''
+    Ownership of a push queue by one run_consumer node, so that a queue is only
+    served by one node at a time. Renewed by the owner on every heartbeat and
+    taken over by another node once it expires.
+    '''
+
+    class Meta:
+        db_table = 'queue_lease'
+
+    queue_name = models.CharField(max_length=CHARFIELD_LEN_SMALL, unique=True)
+    node_id = models.CharField(max_length=CHARFIELD_LEN_SMALL)
+    expires_at = models.DateTimeField()
+
+    objects = QueueLeaseManager()
+
+    def __str__(self):
+        return f"{self.queue_name}: {self.node_id} until {self.expires_at}"
+
+
+class QueueArrivalsManager(models.Manager):
+    """
+    Maintenance of the per-queue arrival counters
+    """
+
+    def get_counts(self, queue_names):
+        """
+        How many arrivals have been signalled for each of the named queues, in one query
+
+        Returns a dict of queue name to count
+        """
+        counts = dict(self.filter(queue_name__in=queue_names).values_list('queue_name', 'count'))
+        return {queue_name: counts.get(queue_name, 0) for queue_name in queue_names}
+
+    def increment(self, queue_name):
+        """
+        Signal an arrival in a queue, creating its counter if needed
+        """
+        if not self.filter(queue_name=queue_name).update(count=F('count') + 1):
+            _, created = self.get_or_create(queue_name=queue_name, defaults={'count': 1})
+            if not created:
+                self.filter(queue_name=queue_name).update(count=F('count') + 1)
+
+
+class QueueArrivals(models.Model):
+    '''
+    Counter of submissions signalled as arrived in a queue, watched by waiting
+    graders and consumers through `notify.DatabaseNotifier`. Only changes in
+    the count matter; it is not the number of submissions in the queue.
+    '''
+
+    class Meta:
+        db_table = 'queue_arrivals'
+
+    queue_name = models.CharField(max_length=CHARFIELD_LEN_SMALL, unique=True)
+    count = models.BigIntegerField(default=0)
+
+    objects = QueueArrivalsManager()
+
+    def __str__(self):
+        return f"{self.queue_name}: {self.count}"
@@ -0,0 +1,251 @@
+"""
+Notifications of new submissions, so that waiting consumers don't have to
+poll the database to find out whether a queue has work.
+
+`submit` bumps a per-queue arrival counter, which is watched for changes on
+behalf of waiters (long-polling pull graders and idle push workers). The
+counter is only a hint: if a signal is lost, waiters fall back to their
+timeout and check the database anyway.
+
+Threads of a process watch the counters through one `ArrivalWatcher`, which
+reads the counters of every watched queue in a single query per poll interval,
+however many threads are waiting, and wakes the waiters of a queue through a
+`threading.Event` when its counter moves.
+
+The backend is chosen with the ARRIVAL_NOTIFIER setting. The default,
+DatabaseNotifier, keeps the counters in a table, so they reach every web server
+and consumer process. CacheNotifier keeps them in the Django cache, which is
+cheaper to poll but only reaches other processes and hosts when the cache is
+shared (e.g. memcached); with a process-local cache its signals are lost, and
+consumers fall back to checking the database every CONSUMER_DELAY seconds.
+"""
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import close_old_connections
+from django.utils.module_loading import import_string
+
+from submission_queue.models import QueueArrivals
+
+log = logging.getLogger(__name__)
+
+
+class PollingNotifier:
+    """
+    Base for notifiers whose counters are read every `poll_interval` seconds.
+    `shared` tells whether signals reach other processes.
+    """
+    shared = True
+
+    @property
+    def poll_interval(self):
+        raise NotImplementedError
+
+    def counts(self, queue_names):
+        raise NotImplementedError
+
+    def count(self, queue_name):
+        return self.counts([queue_name])[queue_name]
+
+
+class DatabaseNotifier(PollingNotifier):
+    """
+    Arrival counters stored in the QueueArrivals table, read every
+    ARRIVAL_DB_POLL_INTERVAL seconds with one indexed lookup for all the
+    watched queues.
+    """
+
+    @property
+    def poll_interval(self):
+        return settings.ARRIVAL_DB_POLL_INTERVAL
+
+    def notify(self, queue_name):
+        QueueArrivals.objects.increment(queue_name)
+
+    def counts(self, queue_names):
+        return QueueArrivals.objects.get_counts(queue_names)
+
+
+class CacheNotifier(PollingNotifier):
+    """
+    Arrival counters stored in the Django cache, read every ARRIVAL_POLL_INTERVAL
+    seconds, which is a cheap cache read rather than a query.
+    """
+
+    @property
+    def poll_interval(self):
+        return settings.ARRIVAL_POLL_INTERVAL
+
+    @property
+    def shared(self):
+        return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+    @staticmethod
+    def _key(queue_name):
+        return f'xqueue.arrivals.{queue_name}'
+
+    def notify(self, queue_name):
+        key = self._key(queue_name)
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+    def counts(self, queue_names):
+        values = cache.get_many([self._key(queue_name) for queue_name in queue_names])
+        return {queue_name: values.get(self._key(queue_name), 0) for queue_name in queue_names}
+
+
+class ArrivalWatcher:
+    """
+    Watches the arrival counters on behalf of every thread of a process.
+
+    While any thread is inside `watching(queue_name)`, a background thread reads
+    the counters of all watched queues with a single `counts` call every poll
+    interval, and sets the `arrived(queue_name)` event of each queue whose
+    counter moved. Each event is replaced once set, so a waiter takes the
+    current event before checking the database and then waits on it.
+    """
+    def __init__(self):
+        self.pid = os.getpid()
+        self._lock = threading.Condition()
+        self._watchers = Counter()
+        self._counts = {}
+        self._events = {}
+        self._thread = None
+
+    @contextmanager
+    def watching(self, queue_name):
+        with self._lock:
+            if not self._watchers[queue_name]:
+                self._counts[queue_name] = get_arrival_counts([queue_name]).get(queue_name)
+                self._events[queue_name] = threading.Event()
+            self._watchers[queue_name] += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='arrival-watcher', daemon=True)
+                self._thread.start()
+            self._lock.notify()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._watchers[queue_name] -= 1
+                if not self._watchers[queue_name]:
+                    del self._watchers[queue_name]
+                    del self._counts[queue_name]
+                    del self._events[queue_name]
+
+    def arrived(self, queue_name):
+        with self._lock:
+            return self._events[queue_name]
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._watchers:
+                    self._lock.wait()
+            time.sleep(poll_interval())
+
+            with self._lock:
+                queue_names = list(self._watchers)
+            close_old_connections()
+            counts = get_arrival_counts(queue_names)
+
+            with self._lock:
+                for queue_name, count in counts.items():
+                    if queue_name in self._counts and count != self._counts[queue_name]:
+                        self._counts[queue_name] = count
+                        self._events[queue_name].set()
+                        self._events[queue_name] = threading.Event()
+
+
+_watcher = None
+_watcher_lock = threading.Lock()
+
+
+def get_watcher():
+    '''
+    The ArrivalWatcher for this process. A watcher inherited from a parent
+    process has no thread left, so it is replaced.
+    '''
+    global _watcher  # pylint: disable=global-statement
+    with _watcher_lock:
+        if _watcher is None or _watcher.pid != os.getpid():
+            _watcher = ArrivalWatcher()
+        return _watcher
+
+
+def get_notifier():
+    '''
+    Instance of the notifier class named by the ARRIVAL_NOTIFIER setting
+    '''
+    return import_string(settings.ARRIVAL_NOTIFIER)()
+
+
+def notifications_are_shared():
+    '''
+    Whether signals from `submit` in a web process reach waiters in other
+    processes, so that waiters can rely on them rather than on polling
+    '''
+    return getattr(get_notifier(), 'shared', True)
+
+
+def poll_interval():
+    '''
+    How often, in seconds, to read the arrival counters when watching them
+    '''
+    return getattr(get_notifier(), 'poll_interval', settings.ARRIVAL_POLL_INTERVAL)
+
+
+def notify_arrival(queue_name):
+    '''
+    Signal that a new submission is available in the named queue
+    '''
+    try:
+        get_notifier().notify(queue_name)
+    except Exception:  # pylint: disable=broad-except
+        # A notification is an optimization; never fail a submission over it.
+        log.exception(f"Could not signal arrival for queue '{queue_name}'")
+
+
+def get_arrival_count(queue_name):
+    '''
+    Current value of the arrival counter for the named queue
+    '''
+    return get_arrival_counts([queue_name]).get(queue_name, 0)
+
+
+def get_arrival_counts(queue_names):
+    '''
+    Current values of the arrival counters of the named queues, read together
+
+    Returns a dict of queue name to count, which is empty if the counters
+    could not be read
+    '''
+    try:
+        return get_notifier().counts(queue_names)
+    except Exception:  # pylint: disable=broad-except
+        log.exception(f"Could not read arrivals for queues {', '.join(queue_names)}")
+        return {}
+
+
+def watching(queue_name):
+    '''
+    Context manager within which the calling thread can wait on
+    `arrival_event(queue_name)`
+    '''
+    return get_watcher().watching(queue_name)
+
+
+def arrival_event(queue_name):
+    '''
+    The `threading.Event` that is set on the next arrival signalled for the
+    named queue. Only available within `watching(queue_name)`.
+    '''
+    return get_watcher().arrived(queue_name)
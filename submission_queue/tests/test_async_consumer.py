@@ -0,0 +1,105 @@
+"""
+Tests of the single-process asyncio consumer.
+"""
+import asyncio
+import threading
+import time
+from unittest.mock import patch
+
+from django.db import connections
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+
+from submission_queue.async_consumer import AsyncConsumer
+from submission_queue.consumer import push_queue_config
+from submission_queue.models import Submission
+
+
+@override_settings(CONSUMER_DELAY=0.05, ARRIVAL_POLL_INTERVAL=0.01)
+@patch('submission_queue.consumer.post_grade_to_lms', return_value=True)
+@patch('submission_queue.consumer._http_post', return_value=(True, 'graded'))
+class TestAsyncConsumer(TransactionTestCase):
+
+    def setUp(self):
+        self.consumer = AsyncConsumer({
+            'queue-a': push_queue_config({'url': 'http://grader-a', 'concurrency': 2}),
+            'queue-b': push_queue_config('http://grader-b'),
+        }, db_threads=1, http_threads=4)
+
+    def tearDown(self):
+        # Close the connections opened by the database thread
+        self.consumer._db_pool.submit(connections.close_all).result()
+        self.consumer._db_pool.shutdown()
+
+    def serve_for(self, seconds):
+        async def serve():
+            try:
+                await asyncio.wait_for(self.consumer.serve(), seconds)
+            except asyncio.TimeoutError:
+                pass
+        asyncio.run(serve())
+
+    def test_deliver_submission(self, mock_http_post, mock_post_grade):
+        submission = Submission.objects.create(queue_name='queue-a', xqueue_header='{}', xqueue_body='body')
+
+        assert asyncio.run(self.consumer.deliver_submission('queue-a', [('http://grader-a', 1)]))
+        assert not asyncio.run(self.consumer.deliver_submission('queue-a', [('http://grader-a', 1)]))
+
+        submission.refresh_from_db()
+        assert submission.retired
+        assert submission.grader_reply == 'graded'
+        mock_http_post.assert_called_once()
+        assert mock_http_post.call_args[0][0] == 'http://grader-a'
+
+    def test_serve_drains_all_queues(self, mock_http_post, mock_post_grade):
+        for queue_name in ['queue-a'] * 3 + ['queue-b'] * 2 + ['pull-queue']:
+            Submission.objects.create(queue_name=queue_name, xqueue_header='{}', xqueue_body='body')
+
+        self.serve_for(0.5)
+
+        assert Submission.objects.filter(retired=True).count() == 5
+        assert not Submission.objects.get(queue_name='pull-queue').retired
+        graders = sorted(call[0][0] for call in mock_http_post.call_args_list)
+        assert graders == ['http://grader-a'] * 3 + ['http://grader-b'] * 2
+
+    def test_stop(self, mock_http_post, mock_post_grade):
+        """
+        Stopping the consumer ends serve() once the drains have finished
+        """
+        async def serve_then_stop():
+            asyncio.get_running_loop().call_later(0.2, self.consumer.stop)
+            await asyncio.wait_for(self.consumer.serve(), 5)
+
+        asyncio.run(serve_then_stop())
+        assert self.consumer.stopping
+        assert not asyncio.run(self.consumer.deliver_submission('queue-a', [('http://grader-a', 1)]))
+
+    @override_settings(CONSUMER_SHUTDOWN_TIMEOUT=0.2)
+    def test_stop_releases_unfinished_at_deadline(self, mock_http_post, mock_post_grade):
+        """
+        Gradings still in flight at the shutdown deadline are abandoned and
+        their submissions released straight away
+        """
+        submission = Submission.objects.create(queue_name='queue-b', xqueue_header='{}', xqueue_body='body')
+        grader_replies = threading.Event()
+
+        def hang(*args, **kwargs):
+            grader_replies.wait(5)
+            return (True, 'graded')
+        mock_http_post.side_effect = hang
+
+        async def serve_then_stop():
+            asyncio.get_running_loop().call_later(0.2, self.consumer.stop)
+            await asyncio.wait_for(self.consumer.serve(), 5)
+
+        start = time.monotonic()
+        try:
+            asyncio.run(serve_then_stop())
+            assert time.monotonic() - start < 2
+        finally:
+            grader_replies.set()
+
+        assert self.consumer.abandoned
+        submission.refresh_from_db()
+        assert not submission.retired
+        assert submission.lease_expires_at <= timezone.now()
@@ -0,0 +1,105 @@
+"""
+Tests of sharing push queues between consumer nodes.
+"""
+from datetime import timedelta
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from submission_queue.cluster import QueueCoordinator, rendezvous_owner
+from submission_queue.models import ConsumerNode, QueueLease
+
+QUEUES = [f'queue-{n}' for n in range(20)]
+
+
+class TestRendezvous(TestCase):
+
+    def test_removing_a_node_only_moves_its_queues(self):
+        nodes = ['node-a', 'node-b', 'node-c']
+        before = {queue: rendezvous_owner(queue, nodes) for queue in QUEUES}
+        after = {queue: rendezvous_owner(queue, ['node-a', 'node-c']) for queue in QUEUES}
+
+        assert set(before.values()) == set(nodes)
+        for queue in QUEUES:
+            if before[queue] != 'node-b':
+                assert after[queue] == before[queue]
+
+
+class TestQueueLease(TestCase):
+
+    def test_acquire(self):
+        lease = timedelta(seconds=15)
+        assert QueueLease.objects.acquire('queue', 'node-a', lease)
+        assert QueueLease.objects.acquire('queue', 'node-a', lease)
+        assert not QueueLease.objects.acquire('queue', 'node-b', lease)
+
+        QueueLease.objects.release('queue', 'node-b')
+        assert not QueueLease.objects.acquire('queue', 'node-b', lease)
+
+        QueueLease.objects.release('queue', 'node-a')
+        assert QueueLease.objects.acquire('queue', 'node-b', lease)
+
+    def test_expired_lease_is_taken_over(self):
+        QueueLease.objects.create(queue_name='queue', node_id='node-a', expires_at=timezone.now())
+        assert QueueLease.objects.acquire('queue', 'node-b', timedelta(seconds=15))
+        assert QueueLease.objects.get(queue_name='queue').node_id == 'node-b'
+
+
+@override_settings(CONSUMER_NODE_TIMEOUT=15, CONSUMER_QUEUE_LEASE_SECONDS=15)
+class TestQueueCoordinator(TestCase):
+
+    def setUp(self):
+        self.node_a = QueueCoordinator(QUEUES, node_id='node-a')
+        self.node_b = QueueCoordinator(QUEUES, node_id='node-b')
+
+    def test_alone_serves_everything(self):
+        assert self.node_a.sync() == set(QUEUES)
+
+    def test_nodes_split_queues(self):
+        self.node_a.sync()
+        self.node_b.sync()
+        # node-a hands over node-b's share, which node-b picks up on its next heartbeat
+        owned_a = self.node_a.sync()
+        owned_b = self.node_b.sync()
+
+        assert owned_a and owned_b
+        assert not owned_a & owned_b
+        assert owned_a | owned_b == set(QUEUES)
+        assert QueueLease.objects.filter(node_id='node-b').count() == len(owned_b)
+
+    def test_leaving_node_hands_over(self):
+        self.node_a.sync()
+        self.node_b.sync()
+        self.node_a.sync()
+        self.node_b.sync()
+
+        self.node_b.leave()
+        assert self.node_a.sync() == set(QUEUES)
+
+    def test_dead_node_is_taken_over(self):
+        self.node_a.sync()
+        self.node_b.sync()
+        self.node_a.sync()
+        owned_b = self.node_b.sync()
+
+        # node-b stops sending heartbeats and its leases run out
+        stale = timezone.now() - timedelta(seconds=30)
+        ConsumerNode.objects.filter(node_id='node-b').update(heartbeat=stale)
+        assert self.node_a.sync() != set(QUEUES)
+        QueueLease.objects.filter(node_id='node-b').update(expires_at=stale)
+
+        assert self.node_a.sync() == set(QUEUES)
+        assert not QueueLease.objects.filter(queue_name__in=owned_b, node_id='node-b').exists()
+
+    def test_long_dead_node_is_deleted(self):
+        self.node_a.sync()
+        self.node_b.sync()
+
+        # Rows of nodes that have only just missed their heartbeat are kept
+        ConsumerNode.objects.filter(node_id='node-b').update(heartbeat=timezone.now() - timedelta(seconds=30))
+        self.node_a.sync()
+        assert ConsumerNode.objects.filter(node_id='node-b').exists()
+
+        ConsumerNode.objects.filter(node_id='node-b').update(heartbeat=timezone.now() - timedelta(hours=1))
+        self.node_a.sync()
+        assert list(ConsumerNode.objects.values_list('node_id', flat=True)) == ['node-a']
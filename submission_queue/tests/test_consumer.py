@@ -0,0 +1,550 @@
+"""
+Tests of ``submission_queue.consumer``: the LMS delivery engine, circuit
+breakers and push workers.
+"""
+import json
+import signal
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import Mock, patch
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from submission_queue import consumer, lms_interface, notify
+from submission_queue.consumer import CircuitBreaker, DeliveryEngine, Worker, _http_post, push_queue_config
+from submission_queue.models import ArchivedSubmission, Submission
+
+
+class TestDeliveryEngine(SimpleTestCase):
+
+    def setUp(self):
+        self.engine = DeliveryEngine(max_workers=8, max_per_host=2, attempts=4, backoff_base=0.5, backoff_max=3)
+        self.header = json.dumps({'lms_callback_url': 'http://lms.example.com/callback'})
+
+    @patch('submission_queue.consumer.time.sleep')
+    @patch('submission_queue.consumer._http_post', side_effect=[(False, 'down'), (False, 'down'), (True, 'ok')])
+    def test_retries_with_backoff(self, mock_http_post, mock_sleep):
+        assert self.engine.deliver(self.header, 'graded')
+        assert mock_http_post.call_count == 3
+        mock_http_post.assert_called_with('http://lms.example.com/callback',
+                                          {'xqueue_header': self.header, 'xqueue_body': 'graded'},
+                                          5)
+        assert mock_sleep.call_count == 2
+
+    @patch('submission_queue.consumer.time.sleep')
+    @patch('submission_queue.consumer._http_post', return_value=(False, 'down'))
+    def test_gives_up(self, mock_http_post, mock_sleep):
+        assert not self.engine.deliver(self.header, 'graded')
+        assert mock_http_post.call_count == 4
+
+    def test_backoff_delay(self):
+        for attempt, ceiling in ((1, 0.5), (2, 1), (3, 2), (4, 3), (10, 3)):
+            delays = [self.engine.backoff_delay(attempt) for _ in range(50)]
+            assert all(0 <= delay <= ceiling for delay in delays)
+
+    def test_per_host_limit(self):
+        in_flight = {'now': 0, 'max': 0}
+        lock = threading.Lock()
+
+        def slow_post(url, data, timeout):
+            with lock:
+                in_flight['now'] += 1
+                in_flight['max'] = max(in_flight['max'], in_flight['now'])
+            time.sleep(0.02)
+            with lock:
+                in_flight['now'] -= 1
+            return (True, 'ok')
+
+        with patch('submission_queue.consumer._http_post', side_effect=slow_post):
+            results = self.engine.map(lambda body: self.engine.deliver(self.header, body), range(8))
+        assert results == [True] * 8
+        assert in_flight['max'] == 2
+
+    def test_map_preserves_order(self):
+        assert self.engine.map(lambda n: n * n, range(20)) == [n * n for n in range(20)]
+
+
+@override_settings(GRADING_DEADLINE=60)
+class TestPushQueueConfig(SimpleTestCase):
+
+    def test_pull_queue(self):
+        assert push_queue_config(None) is None
+
+    def test_url(self):
+        assert push_queue_config('http://grader') == {
+            'url': 'http://grader', 'endpoints': [('http://grader', 1)], 'concurrency': 1, 'deadline': 60}
+
+    def test_dict(self):
+        config = push_queue_config({'url': 'http://grader', 'concurrency': 8, 'deadline': 5})
+        assert config == {'url': 'http://grader', 'endpoints': [('http://grader', 1)], 'concurrency': 8, 'deadline': 5}
+
+    def test_endpoint_list(self):
+        config = push_queue_config(['http://grader-a', {'url': 'http://grader-b', 'weight': 3}])
+        assert config == {
+            'url': 'http://grader-a',
+            'endpoints': [('http://grader-a', 1), ('http://grader-b', 3)],
+            'concurrency': 1,
+            'deadline': 60,
+        }
+
+        config = push_queue_config({'urls': ['http://grader-a', 'http://grader-b'], 'concurrency': 4})
+        assert config['endpoints'] == [('http://grader-a', 1), ('http://grader-b', 1)]
+        assert config['concurrency'] == 4
+
+    def test_invalid(self):
+        with self.assertRaises(ImproperlyConfigured):
+            push_queue_config({'concurrency': 2})
+        with self.assertRaises(ImproperlyConfigured):
+            push_queue_config({'url': 'http://grader', 'concurrency': 0})
+        with self.assertRaises(ImproperlyConfigured):
+            push_queue_config([{'url': 'http://grader', 'weight': 0}])
+        with self.assertRaises(ImproperlyConfigured):
+            push_queue_config([])
+        with self.assertRaises(ImproperlyConfigured):
+            push_queue_config({'url': 'http://grader', 'deadline': 0})
+
+    @override_settings(SUBMISSION_PROCESSING_DELAY=1, SUBMISSION_LEASE_SECONDS={'slow': 300})
+    def test_deadline_must_fit_in_lease(self):
+        with self.assertRaises(ImproperlyConfigured):
+            push_queue_config('http://grader', 'fast')
+        assert push_queue_config({'url': 'http://grader', 'deadline': 45}, 'fast')['deadline'] == 45
+        assert push_queue_config({'url': 'http://grader', 'deadline': 200}, 'slow')['deadline'] == 200
+
+
+class TrickleHandler(BaseHTTPRequestHandler):
+    """
+    Grader stub that replies slowly, a byte every `server.delay` seconds: only
+    the body, or the status line and headers too if `server.trickle_headers`
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        reply = self.server.reply
+        head = b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n' % len(reply)
+        try:
+            if self.server.trickle_headers:
+                self._trickle(head)
+            else:
+                self.wfile.write(head)
+            self._trickle(reply)
+        except OSError:
+            pass
+
+    def _trickle(self, data):
+        for byte in data:
+            self.wfile.write(bytes([byte]))
+            self.wfile.flush()
+            time.sleep(self.server.delay)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestHttpPostDeadline(SimpleTestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), TrickleHandler)
+        self.server.daemon_threads = True
+        self.server.reply = b'graded'
+        self.server.delay = 0.01
+        self.server.trickle_headers = False
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/'
+
+    def test_reply_within_deadline(self):
+        assert _http_post(self.url, 'data', 5, deadline=5) == (True, 'graded')
+        # The connection is kept for the next grading, and no longer watched
+        time.sleep(0.1)
+        assert _http_post(self.url, 'data', 5, deadline=0.2) == (True, 'graded')
+        time.sleep(0.3)
+        assert _http_post(self.url, 'data', 5) == (True, 'graded')
+
+    def test_trickling_reply_is_aborted(self):
+        """
+        Every byte arrives well within the timeout, but the deadline bounds the
+        whole reply
+        """
+        self.server.reply = b'x' * 50
+        self.server.delay = 0.1
+        start = time.monotonic()
+        assert _http_post(self.url, 'data', 5, deadline=0.5) == (False, 'grading deadline exceeded')
+        assert time.monotonic() - start < 1
+
+    def test_trickling_headers_are_aborted(self):
+        self.server.trickle_headers = True
+        self.server.delay = 0.1
+        start = time.monotonic()
+        assert _http_post(self.url, 'data', 5, deadline=0.5) == (False, 'grading deadline exceeded')
+        assert time.monotonic() - start < 1
+
+    def test_stalled_reply_is_aborted(self):
+        self.server.reply = b'xx'
+        self.server.delay = 3
+        start = time.monotonic()
+        assert _http_post(self.url, 'data', 5, deadline=0.5) == (False, 'grading deadline exceeded')
+        assert time.monotonic() - start < 1
+
+
+class TestCircuitBreaker(SimpleTestCase):
+
+    def setUp(self):
+        self.breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+        self.now = 1000.0
+        patcher = patch('submission_queue.consumer.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        assert self.breaker.state == CircuitBreaker.CLOSED
+        assert self.breaker.allow_request()
+
+        self.breaker.record_failure()
+        assert self.breaker.state == CircuitBreaker.OPEN
+        assert not self.breaker.allow_request()
+
+    def test_half_open_trial(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+
+        self.now += 30
+        assert self.breaker.state == CircuitBreaker.HALF_OPEN
+        assert self.breaker.allow_request()
+        assert not self.breaker.allow_request()
+
+        # A failed trial opens the breaker again
+        self.breaker.record_failure()
+        assert self.breaker.state == CircuitBreaker.OPEN
+
+        self.now += 30
+        assert self.breaker.allow_request()
+        self.breaker.record_success()
+        assert self.breaker.state == CircuitBreaker.CLOSED
+
+    def test_release_unused_trial(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.now += 30
+        assert self.breaker.allow_request()
+        self.breaker.release()
+        assert self.breaker.allow_request()
+
+
+@override_settings(CIRCUIT_BREAKER_FAILURES=1)
+class TestChooseEndpoint(SimpleTestCase):
+
+    def setUp(self):
+        consumer._grader_endpoints.clear()
+        self.addCleanup(consumer._grader_endpoints.clear)
+
+    def test_fewest_in_flight_per_weight(self):
+        endpoints = [('http://a', 1), ('http://b', 2)]
+        chosen = [consumer.choose_endpoint(endpoints) for _ in range(6)]
+        assert chosen.count('http://a') == 2
+        assert chosen.count('http://b') == 4
+
+    def test_finished_gradings_free_capacity(self):
+        endpoints = [('http://a', 1), ('http://b', 1)]
+        assert consumer.choose_endpoint(endpoints) == 'http://a'
+        assert consumer.choose_endpoint(endpoints) == 'http://b'
+        consumer._finish_grading('http://a')
+        assert consumer.choose_endpoint(endpoints) == 'http://a'
+
+    def test_lowest_latency_breaks_ties(self):
+        consumer.get_grader_endpoint('http://a').record_latency(5)
+        consumer.get_grader_endpoint('http://b').record_latency(1)
+        assert consumer.choose_endpoint([('http://a', 1), ('http://b', 1)]) == 'http://b'
+
+    def test_skips_open_breakers(self):
+        consumer.get_grader_endpoint('http://a').breaker.record_failure()
+        endpoints = [('http://a', 1), ('http://b', 1)]
+        assert [consumer.choose_endpoint(endpoints) for _ in range(3)] == ['http://b'] * 3
+
+        consumer.get_grader_endpoint('http://b').breaker.record_failure()
+        assert consumer.choose_endpoint(endpoints) is None
+
+    def test_half_open_trial_first(self):
+        breaker = consumer.get_grader_endpoint('http://a').breaker
+        breaker.record_failure()
+        with patch('submission_queue.consumer.time.monotonic', return_value=time.monotonic() + 60):
+            endpoints = [('http://a', 1), ('http://b', 1)]
+            assert consumer.choose_endpoint(endpoints) == 'http://a'
+            assert consumer.choose_endpoint(endpoints) == 'http://b'
+
+
+class TestWorker(TestCase):
+
+    def setUp(self):
+        self.worker = Worker('test', 'http://grader', concurrency=4)
+        consumer._grader_endpoints.clear()
+
+    def test_empty_queue(self):
+        assert not self.worker._deliver_submission()
+
+    @patch('submission_queue.consumer.post_grade_to_lms', return_value=True)
+    @patch('submission_queue.consumer._http_post', return_value=(True, 'graded'))
+    def test_delivers_submission(self, mock_http_post, mock_post_grade):
+        submission = Submission.objects.create(queue_name='test', xqueue_header='{}', xqueue_body='body')
+
+        assert self.worker._deliver_submission()
+        assert not self.worker._deliver_submission()
+
+        submission.refresh_from_db()
+        assert submission.retired
+        assert submission.grader_reply == 'graded'
+        assert submission.lms_ack
+        assert mock_http_post.call_count == 1
+        assert consumer.get_grader_endpoint('http://grader').in_flight == 0
+
+    @override_settings(SUBMISSION_PROCESSING_DELAY=1, LMS_DELIVERY_ATTEMPTS=5, REQUESTS_TIMEOUT=5,
+                       LMS_DELIVERY_BACKOFF_MAX=10)
+    @patch('submission_queue.consumer.post_grade_to_lms', return_value=True)
+    def test_lease_covers_grading_and_lms_delivery(self, mock_post_grade):
+        """
+        A pushed submission stays leased for the whole grading deadline and the
+        slowest LMS delivery after it
+        """
+        submission = Submission.objects.create(queue_name='test', xqueue_header='{}', xqueue_body='body')
+        worker = Worker('test', 'http://grader', deadline=45)
+
+        def grade(*args, **kwargs):
+            leased_for = Submission.objects.get(id=submission.id).lease_expires_at - timezone.now()
+            assert leased_for > timedelta(seconds=45 + 5 * 5 + 4 * 10 - 5)
+            return (True, 'graded')
+
+        with patch('submission_queue.consumer._http_post', side_effect=grade) as mock_http_post:
+            assert worker._deliver_submission()
+        assert mock_http_post.called
+
+    @patch('submission_queue.consumer.post_grade_to_lms', return_value=True)
+    @patch('submission_queue.consumer._http_post', return_value=(True, 'graded'))
+    def test_spreads_over_endpoints(self, mock_http_post, mock_post_grade):
+        worker = Worker('test', 'http://grader-a', endpoints=[('http://grader-a', 1), ('http://grader-b', 1)])
+        for _ in range(2):
+            Submission.objects.create(queue_name='test', xqueue_header='{}', xqueue_body='body')
+
+        # Hold a grading in flight to grader-a so the next one goes to grader-b
+        consumer.choose_endpoint([('http://grader-a', 1)])
+        assert worker._deliver_submission()
+        consumer._finish_grading('http://grader-a')
+        consumer.get_grader_endpoint('http://grader-a').record_latency(0)
+        consumer.get_grader_endpoint('http://grader-b').record_latency(5)
+        assert worker._deliver_submission()
+
+        assert [call[0][0] for call in mock_http_post.call_args_list] == ['http://grader-b', 'http://grader-a']
+        assert set(Submission.objects.values_list('grader_id', flat=True)) == {'http://grader-a', 'http://grader-b'}
+
+    @override_settings(CIRCUIT_BREAKER_FAILURES=2)
+    @patch('submission_queue.consumer.post_failure_to_lms', return_value=True)
+    @patch('submission_queue.consumer._http_post', return_value=(False, 'cannot connect to server'))
+    def test_open_circuit_leaves_submissions_queued(self, mock_http_post, mock_post_failure):
+        """
+        The failure that opens the breaker requeues its submission without
+        counting it, and no more submissions are claimed while the breaker is open
+        """
+        first = Submission.objects.create(queue_name='test', xqueue_header='{}', xqueue_body='first')
+        second = Submission.objects.create(queue_name='test', xqueue_header='{}', xqueue_body='second')
+        third = Submission.objects.create(queue_name='test', xqueue_header='{}', xqueue_body='third')
+
+        assert self.worker._deliver_submission()
+        assert self.worker._deliver_submission()
+        assert not self.worker._deliver_submission()
+
+        retrying, requeued, queued = (Submission.objects.get(id=sub.id) for sub in (first, second, third))
+        assert not retrying.retired and retrying.num_failures == 1
+        assert not requeued.retired and requeued.num_failures == 0
+        assert not queued.retired and queued.grader_id == ''
+        assert set(Submission.objects.available().filter(queue_name='test')) == {requeued, queued}
+        assert mock_http_post.call_count == 2
+        assert not mock_post_failure.called
+
+    @override_settings(MAX_NUMBER_OF_FAILURES=3, PUSH_RETRY_DELAY=30, PUSH_RETRY_MAX_DELAY=50)
+    @patch('submission_queue.consumer.post_failure_to_lms', return_value=True)
+    @patch('submission_queue.consumer._http_post', return_value=(False, 'unexpected HTTP status code [500]'))
+    def test_failed_push_is_retried(self, mock_http_post, mock_post_failure):
+        """
+        A failed grading is requeued with an increasing delay, and the LMS is
+        told about the failure only after MAX_NUMBER_OF_FAILURES attempts
+        """
+        submission = Submission.objects.create(queue_name='test', xqueue_header='{}', xqueue_body='body')
+
+        for expected_delay in (30, 50):
+            before = timezone.now()
+            assert self.worker._deliver_submission()
+            submission.refresh_from_db()
+            assert not submission.retired
+            assert submission.lease_expires_at >= before + timedelta(seconds=expected_delay)
+            assert not self.worker._deliver_submission()
+
+            # Let the retry come due
+            Submission.objects.filter(id=submission.id).update(lease_expires_at=timezone.now())
+
+        assert self.worker._deliver_submission()
+        submission.refresh_from_db()
+        assert submission.retired
+        assert submission.num_failures == 3
+        assert mock_http_post.call_count == 3
+        mock_post_failure.assert_called_once_with('{}')
+
+    @patch('submission_queue.consumer.post_grade_to_lms', return_value=True)
+    @patch('submission_queue.consumer._http_post')
+    def test_resubmission_during_push_stays_retired(self, mock_http_post, mock_post_grade):
+        """
+        A submission retired by a resubmission while it is out with the grader
+        is not put back in the queue by the outcome of the push, whether the
+        push is retried or succeeds
+        """
+        for reply in ((False, 'unexpected HTTP status code [500]'), (True, 'graded')):
+            submission = Submission.objects.create(queue_name='test', lms_callback_url='/cb',
+                                                   xqueue_header='{}', xqueue_body='body')
+
+            def resubmit(*args, **kwargs):
+                lms_interface._invalidate_prior_submissions('/cb')
+                return reply
+            mock_http_post.side_effect = resubmit
+
+            assert self.worker._deliver_submission()
+            submission.refresh_from_db()
+            assert submission.retired
+            assert Submission.objects.get_queue_length('test') == 0
+            assert not self.worker._deliver_submission()
+
+    @patch('submission_queue.consumer.post_grade_to_lms', return_value=True)
+    @patch('submission_queue.consumer._http_post', return_value=(True, 'graded'))
+    def test_archived_during_push(self, mock_http_post, mock_post_grade):
+        """
+        The outcome of a push whose submission was archived in the meantime is
+        written to the archive, not inserted into the active table again
+        """
+        submission = Submission.objects.create(queue_name='test', lms_callback_url='/cb',
+                                               xqueue_header='{}', xqueue_body='body')
+
+        def resubmit_and_archive(*args, **kwargs):
+            lms_interface._invalidate_prior_submissions('/cb')
+            ArchivedSubmission.objects.archive_retired(10)
+            return (True, 'graded')
+        mock_http_post.side_effect = resubmit_and_archive
+
+        assert self.worker._deliver_submission()
+        assert not Submission.objects.filter(id=submission.id).exists()
+        assert ArchivedSubmission.objects.get(id=submission.id).grader_reply == 'graded'
+        assert Submission.objects.get_queue_length('test') == 0
+
+    @override_settings(CONSUMER_DELAY=7, CONSUMER_MAX_DELAY=20)
+    def test_drain_backs_off_when_idle(self):
+        """
+        The worker keeps delivering while there is work. When the queue is empty
+        it waits for an arrival signal, doubling the fallback interval up to
+        CONSUMER_MAX_DELAY, and resets the interval once work shows up again.
+        """
+        found = [True, True, False, False, False, True, False, SystemExit]
+        with patch.object(self.worker, '_deliver_submission', side_effect=found):
+            with patch.object(self.worker, '_wait_for_arrival', return_value=False) as mock_wait:
+                with patch.object(self.worker, '_report_poll_interval') as mock_report:
+                    with self.assertRaises(SystemExit):
+                        self.worker._drain()
+        assert [call[0][1] for call in mock_wait.call_args_list] == [7, 14, 20, 7]
+        assert [call[0][0] for call in mock_report.call_args_list] == [7, 14, 20, 7, 14]
+
+    @override_settings(CONSUMER_DELAY=60, ARRIVAL_DB_POLL_INTERVAL=0.1)
+    def test_idle_drains_share_arrival_reads(self):
+        """
+        Idle drain threads make no database reads of their own beyond the backed
+        off claim; the arrival counters are read once per poll interval for all
+        """
+        threads = [threading.Thread(target=self.worker._drain) for _ in range(4)]
+        with patch('submission_queue.notify._watcher', None), \
+                patch('submission_queue.notify.get_arrival_counts', wraps=notify.get_arrival_counts) as reads, \
+                patch.object(self.worker, '_deliver_submission', return_value=False) as claims:
+            for thread in threads:
+                thread.start()
+            time.sleep(0.5)
+            idle_reads = reads.call_count
+            self.worker.stop()
+            for thread in threads:
+                thread.join()
+
+        assert claims.call_count == 4
+        # A first read when the queue is first watched, then about five in 0.5 s
+        assert idle_reads <= 8
+
+    @patch('submission_queue.consumer.newrelic')
+    @override_settings(ARRIVAL_DB_POLL_INTERVAL=1)
+    def test_reports_claim_and_arrival_intervals(self, mock_newrelic):
+        self.worker._report_poll_interval(20)
+        metrics = {call[0][0]: call[0][1] for call in mock_newrelic.agent.record_custom_metric.call_args_list}
+        assert metrics == {'Custom/XQueueConsumerPollInterval/test[seconds]': 20,
+                           'Custom/XQueueArrivalPollInterval/test[seconds]': 1}
+
+    @override_settings(CONSUMER_DELAY=7, CONSUMER_MAX_DELAY=20,
+                       ARRIVAL_NOTIFIER='submission_queue.notify.CacheNotifier')
+    def test_drain_does_not_back_off_without_shared_signals(self):
+        """
+        With a process-local cache, arrival signals from the web servers never
+        reach the worker, so it keeps checking every CONSUMER_DELAY seconds
+        """
+        with patch.object(self.worker, '_deliver_submission', side_effect=[False, False, False, SystemExit]):
+            with patch.object(self.worker, '_wait_for_arrival', return_value=False) as mock_wait:
+                with self.assertRaises(SystemExit):
+                    self.worker._drain()
+        assert [call[0][1] for call in mock_wait.call_args_list] == [7, 7, 7]
+
+    @override_settings(CONSUMER_DELAY=7, CONSUMER_MAX_DELAY=20)
+    def test_drain_keeps_interval_on_arrival(self):
+        """
+        Being woken by an arrival signal doesn't count as an empty poll
+        """
+        with patch.object(self.worker, '_deliver_submission', side_effect=[False, False, SystemExit]):
+            with patch.object(self.worker, '_wait_for_arrival', return_value=True) as mock_wait:
+                with self.assertRaises(SystemExit):
+                    self.worker._drain()
+        assert [call[0][1] for call in mock_wait.call_args_list] == [7, 7]
+
+    def test_stop(self):
+        """
+        A stopping worker doesn't claim submissions, and its drain loop and
+        waits end
+        """
+        Submission.objects.create(queue_name='test', xqueue_header='{}', xqueue_body='body')
+        self.worker.stop()
+        assert not self.worker._deliver_submission()
+        arrived = Mock()
+        assert not self.worker._wait_for_arrival(arrived, 60)
+        self.worker._drain()
+        assert Submission.objects.available().count() == 1
+        assert not arrived.wait.called
+
+    @override_settings(CONSUMER_SHUTDOWN_TIMEOUT=0.1)
+    @patch('submission_queue.consumer.signal.signal')
+    def test_run_releases_unfinished_gradings(self, mock_signal):
+        """
+        After SIGTERM, gradings that don't finish by CONSUMER_SHUTDOWN_TIMEOUT
+        are released so another worker can push them right away
+        """
+        submission = Submission.objects.create(queue_name='test', xqueue_header='{}', xqueue_body='body')
+        Submission.objects.claim_unpushed_submission('test', 'http://grader')
+        worker = Worker('test', 'http://grader')
+        finished = threading.Event()
+
+        def slow_grading():
+            worker._in_flight[threading.get_ident()] = submission.id
+            worker.stop()
+            finished.wait(5)
+
+        with patch.object(worker, '_drain', side_effect=slow_grading):
+            worker.run()
+        finished.set()
+
+        mock_signal.assert_called_once_with(signal.SIGTERM, worker.stop)
+        assert Submission.objects.available().filter(id=submission.id).exists()
@@ -0,0 +1,111 @@
+"""
+Tests of LMS delivery through the outbox.
+"""
+import json
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TransactionTestCase, override_settings
+from django.test.client import Client
+
+from submission_queue import delivery
+from submission_queue.models import ArchivedSubmission, LMSDelivery, Submission
+
+
+@override_settings(XQUEUES={'tmp': None}, LMS_DELIVERY_OUTBOX=True, MAX_NUMBER_OF_FAILURES=1)
+class TestOutboxDelivery(TransactionTestCase):
+
+    def setUp(self):
+        self.credentials = {'username': 'LMS', 'password': 'CambridgeMA'}
+        User.objects.create_user(**self.credentials)
+        self.submission = Submission.objects.create(queue_name='tmp',
+                                                    lms_callback_url='/',
+                                                    xqueue_header='{"lms_callback_url": "/"}',
+                                                    xqueue_body='{}',
+                                                    pullkey='testkey')
+
+    def _put_result(self):
+        client = Client()
+        client.login(**self.credentials)
+        response = client.post('/xqueue/put_result/', {
+            'xqueue_header': json.dumps({'submission_id': self.submission.id, 'submission_key': 'testkey'}),
+            'xqueue_body': 'graded',
+        })
+        return json.loads(response.content.decode('utf-8'))
+
+    @patch('submission_queue.consumer.post_grade_to_lms')
+    def test_put_result_records_outbox_entry(self, mock_post_grade_to_lms):
+        self.assertEqual(self._put_result()['return_code'], 0)
+        mock_post_grade_to_lms.assert_not_called()
+
+        self.submission.refresh_from_db()
+        self.assertTrue(self.submission.retired)
+        self.assertFalse(self.submission.lms_ack)
+        self.assertEqual(self.submission.grader_reply, 'graded')
+
+        entry = LMSDelivery.objects.get()
+        self.assertEqual(entry.submission_id, self.submission.id)
+        self.assertEqual(entry.xqueue_header, self.submission.xqueue_header)
+        self.assertEqual(entry.xqueue_body, 'graded')
+
+    @patch('submission_queue.consumer.post_grade_to_lms', return_value=True)
+    def test_deliver_due(self, mock_post_grade_to_lms):
+        self._put_result()
+        self.assertEqual(delivery.deliver_due(), 1)
+        mock_post_grade_to_lms.assert_called_once_with(self.submission.xqueue_header, 'graded')
+
+        self.submission.refresh_from_db()
+        self.assertTrue(self.submission.lms_ack)
+        self.assertFalse(LMSDelivery.objects.exists())
+        self.assertEqual(delivery.deliver_due(), 0)
+
+    @patch('submission_queue.consumer.post_grade_to_lms', return_value=False)
+    @override_settings(LMS_DELIVERY_RETRY_DELAY=0)
+    def test_deliver_due_failures(self, mock_post_grade_to_lms):
+        self._put_result()
+
+        self.assertEqual(delivery.deliver_due(), 1)
+        entry = LMSDelivery.objects.get()
+        self.assertEqual(entry.attempts, 1)
+        self.submission.refresh_from_db()
+        self.assertEqual(self.submission.num_failures, 1)
+        self.assertFalse(self.submission.lms_ack)
+
+        # After MAX_NUMBER_OF_FAILURES retries we give up
+        self.assertEqual(delivery.deliver_due(), 1)
+        self.assertFalse(LMSDelivery.objects.exists())
+        self.submission.refresh_from_db()
+        self.assertEqual(self.submission.num_failures, 2)
+
+    @patch('submission_queue.consumer.post_grade_to_lms', return_value=True)
+    def test_deliver_archived_submission(self, mock_post_grade_to_lms):
+        self._put_result()
+        call_command('archive_retired_submissions')
+        call_command('run_lms_delivery', once=True)
+        self.assertTrue(ArchivedSubmission.objects.get(id=self.submission.id).lms_ack)
+        self.assertFalse(LMSDelivery.objects.exists())
+
+    @patch('submission_queue.consumer.post_grade_to_lms', return_value=False)
+    def test_failure_after_entry_removed(self, mock_post_grade_to_lms):
+        """
+        A failed attempt on an entry that another worker has already removed is a no-op
+        """
+        self._put_result()
+
+        def remove_entry(header, body):
+            LMSDelivery.objects.all().delete()
+            return False
+        mock_post_grade_to_lms.side_effect = remove_entry
+
+        self.assertEqual(delivery.deliver_due(), 1)
+        self.assertFalse(LMSDelivery.objects.exists())
+
+    @override_settings(LMS_DELIVERY_ATTEMPTS=5, REQUESTS_TIMEOUT=5, LMS_DELIVERY_BACKOFF_MAX=10,
+                       LMS_DELIVERY_WORKERS=10, LMS_DELIVERY_MAX_PER_HOST=10, LMS_DELIVERY_RETRY_DELAY=60)
+    def test_batch_lease_covers_worst_case(self):
+        # 5 rounds of 10 deliveries, each making 5 attempts of 5 s with 4 backoffs of up to 10 s
+        self.assertEqual(delivery.batch_lease(50).total_seconds(), 5 * (5 * 5 + 4 * 10))
+        self.assertEqual(delivery.batch_lease(1).total_seconds(), 65)
+        with self.settings(LMS_DELIVERY_ATTEMPTS=1):
+            self.assertEqual(delivery.batch_lease(1).total_seconds(), 60)
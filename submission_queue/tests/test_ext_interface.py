@@ -1,13 +1,17 @@
 import json
+import threading
+import time
 from unittest.mock import patch
 
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import connection
 from django.test import TransactionTestCase, override_settings
 from django.test.client import Client
+from django.utils import timezone
 
 from submission_queue import ext_interface
-from submission_queue.models import Submission
+from submission_queue.models import ArchivedSubmission, Submission, SubmissionManifest
 
 
 def parse_xreply(xreply):
@@ -110,6 +114,206 @@ class TestExtInterface(TransactionTestCase):
         result = json.loads(msg)
         self.assertEqual(result['xqueue_body'], body)
 
+    @patch('submission_queue.ext_interface.http_client.get')
+    def test_get_submission_manifest(self, mock_get):
+        """
+        The files of a submission with a manifest are read from the database
+        """
+        files = {'a.py': 'http://files/a.py', 'b.py': 'http://files/b.py'}
+        submission = Submission.objects.create(queue_name='tmp',
+                                               lms_callback_url='/',
+                                               xqueue_header='{}',
+                                               xqueue_body='body',
+                                               s3_keys=json.dumps({'KEY_FOR_EXTERNAL_DICTS': 'key'}),
+                                               s3_urls=json.dumps({'URL_FOR_EXTERNAL_DICTS': 'http://files/dict'}))
+        SubmissionManifest.objects.record(submission.id, json.dumps({'a.py': 'ka', 'b.py': 'kb'}), json.dumps(files))
+
+        client = Client()
+        client.login(**self.credentials)
+        response = client.get('/xqueue/get_submission/', {'queue_name': 'tmp'})
+        (error, msg) = parse_xreply(response.content)
+        self.assertEqual(error, 0)
+        self.assertEqual(json.loads(json.loads(msg)['xqueue_files']), files)
+        mock_get.assert_not_called()
+
+    @patch('submission_queue.ext_interface.http_client.get')
+    def test_get_submission_migrates_external_dicts(self, mock_get):
+        """
+        The uploaded file lists of an older submission are fetched once and
+        then kept in its manifest
+        """
+        files = {'a.py': 'http://files/a.py'}
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.text = json.dumps({'files': files, 'keys': {'a.py': 'ka'}})
+        submission = Submission.objects.create(queue_name='tmp',
+                                               lms_callback_url='/',
+                                               xqueue_header='{}',
+                                               xqueue_body='body',
+                                               s3_keys=json.dumps({'KEY_FOR_EXTERNAL_DICTS': 'key'}),
+                                               s3_urls=json.dumps({'URL_FOR_EXTERNAL_DICTS': 'http://files/dict'}))
+
+        for _ in range(2):
+            (success, payload) = ext_interface._compose_payload(submission)
+            self.assertTrue(success)
+            self.assertEqual(json.loads(payload['xqueue_files']), files)
+        mock_get.assert_called_once_with('http://files/dict', timeout=2)
+
+        manifest = SubmissionManifest.objects.get(submission_id=submission.id)
+        self.assertEqual(json.loads(manifest.keys), {'a.py': 'ka'})
+        self.assertEqual(json.loads(manifest.urls), files)
+
+    @patch('submission_queue.ext_interface.http_client.get')
+    def test_get_submission_external_dicts_unavailable(self, mock_get):
+        """
+        A failed fetch of the uploaded file lists fails the pull and stores nothing
+        """
+        mock_get.return_value.status_code = 503
+        submission = Submission.objects.create(queue_name='tmp',
+                                               lms_callback_url='/',
+                                               xqueue_header='{}',
+                                               xqueue_body='body',
+                                               s3_urls=json.dumps({'URL_FOR_EXTERNAL_DICTS': 'http://files/dict'}))
+        self.assertEqual(ext_interface._compose_payload(submission), (False, None))
+        self.assertFalse(SubmissionManifest.objects.exists())
+
+    def _submit_later(self, body, signal):
+        def submit():
+            Submission.objects.create(queue_name='tmp', lms_callback_url='/', xqueue_header='{}', xqueue_body=body)
+            if signal:
+                ext_interface.notify.notify_arrival('tmp')
+            connection.close()
+        timer = threading.Timer(0.1, submit)
+        timer.start()
+        self.addCleanup(timer.join)
+
+    def _pull_and_time(self, wait):
+        client = Client()
+        client.login(**self.credentials)
+        start = time.monotonic()
+        # A fresh arrival watcher, whose thread isn't in the middle of a sleep from another test
+        with patch('submission_queue.notify._watcher', None):
+            response = client.get('/xqueue/get_submission/', {'queue_name': 'tmp', 'wait': wait})
+        return response, time.monotonic() - start
+
+    @override_settings(MAX_PULL_WAIT=20, ARRIVAL_DB_POLL_INTERVAL=0.01, PULL_RECHECK_INTERVAL=20)
+    def test_get_submission_wait_for_arrival(self):
+        """
+        With 'wait', an empty queue holds the request until a submission arrives
+        """
+        body = json.dumps({"test": "test"})
+        self._submit_later(body, signal=True)
+        response, elapsed = self._pull_and_time(20)
+        self.assertLess(elapsed, 5)
+        (error, msg) = parse_xreply(response.content)
+        self.assertEqual(error, 0)
+        self.assertEqual(json.loads(msg)['xqueue_body'], body)
+
+    @override_settings(MAX_PULL_WAIT=20, ARRIVAL_DB_POLL_INTERVAL=20, PULL_RECHECK_INTERVAL=0.05)
+    def test_get_submission_wait_rechecks_without_signal(self):
+        """
+        A waiting pull finds a submission whose arrival was never signalled
+        """
+        body = json.dumps({"test": "test"})
+        self._submit_later(body, signal=False)
+        response, elapsed = self._pull_and_time(20)
+        self.assertLess(elapsed, 5)
+        (error, msg) = parse_xreply(response.content)
+        self.assertEqual(error, 0)
+        self.assertEqual(json.loads(msg)['xqueue_body'], body)
+
+    def test_get_submission_wait_is_off_by_default(self):
+        """
+        Long-polling is only enabled with MAX_PULL_WAIT
+        """
+        response, elapsed = self._pull_and_time(20)
+        self.assertLess(elapsed, 5)
+        (error, msg) = parse_xreply(response.content)
+        self.assertEqual(error, 1)
+
+    @override_settings(ARRIVAL_POLL_INTERVAL=0.01, MAX_PULL_WAIT=0.05)
+    def test_get_submission_wait_expires(self):
+        """
+        'wait' is capped by MAX_PULL_WAIT, after which the queue is reported empty
+        """
+        client = Client()
+        client.login(**self.credentials)
+        response = client.get('/xqueue/get_submission/', {'queue_name': 'tmp', 'wait': 600})
+        (error, msg) = parse_xreply(response.content)
+        self.assertEqual(error, 1)
+        self.assertEqual(msg, "Queue 'tmp' is empty")
+
+    def test_get_submission_invalid_wait(self):
+        client = Client()
+        client.login(**self.credentials)
+        for value in ('soon', '-1', 'nan'):
+            response = client.get('/xqueue/get_submission/', {'queue_name': 'tmp', 'wait': value})
+            (error, msg) = parse_xreply(response.content)
+            self.assertEqual(error, 1)
+            self.assertEqual(msg, "'wait' must be a number of seconds")
+
+    # get_submissions
+    def test_get_submissions(self):
+        """
+        Retrieve several submissions for the queue in one request, oldest first
+        """
+        submissions = [
+            Submission.objects.create(queue_name='tmp',
+                                      lms_callback_url=f'/{i}',
+                                      xqueue_header='{}',
+                                      xqueue_body=json.dumps({"test": i}))
+            for i in range(3)
+        ]
+
+        client = Client()
+        client.login(**self.credentials)
+        response = client.get('/xqueue/get_submissions/', {'queue_name': 'tmp', 'max': 2})
+        self.assertEqual(response.status_code, 200)
+        (error, msg) = parse_xreply(response.content)
+        self.assertEqual(error, 0)
+        payloads = json.loads(msg)
+        self.assertEqual([p['xqueue_body'] for p in payloads], [s.xqueue_body for s in submissions[:2]])
+        for payload, submission in zip(payloads, submissions):
+            submission.refresh_from_db()
+            header = json.loads(payload['xqueue_header'])
+            self.assertEqual(header, {'submission_id': submission.id, 'submission_key': submission.pullkey})
+
+        # Only the unclaimed submission is left
+        response = client.get('/xqueue/get_submissions/', {'queue_name': 'tmp', 'max': 2})
+        (error, msg) = parse_xreply(response.content)
+        self.assertEqual(error, 0)
+        self.assertEqual(len(json.loads(msg)), 1)
+
+        response = client.get('/xqueue/get_submissions/', {'queue_name': 'tmp', 'max': 2})
+        (error, msg) = parse_xreply(response.content)
+        self.assertEqual(error, 1)
+        self.assertEqual(msg, "Queue 'tmp' is empty")
+
+    @override_settings(MAX_SUBMISSIONS_PER_PULL=1)
+    def test_get_submissions_capped(self):
+        """
+        'max' is capped by MAX_SUBMISSIONS_PER_PULL
+        """
+        for i in range(2):
+            Submission.objects.create(queue_name='tmp',
+                                      lms_callback_url=f'/{i}',
+                                      xqueue_header='{}',
+                                      xqueue_body='{}')
+        client = Client()
+        client.login(**self.credentials)
+        response = client.get('/xqueue/get_submissions/', {'queue_name': 'tmp', 'max': 10})
+        (error, msg) = parse_xreply(response.content)
+        self.assertEqual(error, 0)
+        self.assertEqual(len(json.loads(msg)), 1)
+
+    def test_get_submissions_invalid_max(self):
+        client = Client()
+        client.login(**self.credentials)
+        for value, message in (('lots', "'max' must be an integer"), ('0', "'max' must be positive")):
+            response = client.get('/xqueue/get_submissions/', {'queue_name': 'tmp', 'max': value})
+            (error, msg) = parse_xreply(response.content)
+            self.assertEqual(error, 1)
+            self.assertEqual(msg, message)
+
     # combinations of get_queuelen and get_submission
     # these test mostly non-error conditions
     def test_get_submission_multiple_submissions(self):
@@ -249,5 +453,100 @@ class TestExtInterface(TransactionTestCase):
         self.assertFalse(submission.lms_ack)
         self.assertEqual(submission.num_failures, settings.MAX_NUMBER_OF_FAILURES + 1)
 
+    @patch('submission_queue.consumer.post_grade_to_lms', return_value=False)
+    def test_put_result_archived_submission(self, mock_post_grade_to_lms):
+        """
+        A late reply for an archived submission is still recorded, and it stays retired
+        """
+        ArchivedSubmission.objects.create(id=42,
+                                          arrival_time=timezone.now(),
+                                          queue_name='tmp',
+                                          lms_callback_url='/',
+                                          xqueue_header='{}',
+                                          pullkey='testkey',
+                                          retired=True)
+        reply = {'xqueue_header': json.dumps({'submission_id': 42, 'submission_key': 'testkey'}),
+                 'xqueue_body': 'late'}
+
+        client = Client()
+        client.login(**self.credentials)
+        response = client.post('/xqueue/put_result/', reply)
+        (error, _) = parse_xreply(response.content)
+        self.assertEqual(error, 0)
+        response = client.post('/xqueue/put_results/', {'xqueue_replies': json.dumps([reply])})
+        (error, statuses) = parse_xreply(response.content)
+        self.assertEqual(statuses, [{'return_code': 0, 'content': ''}])
+
+        archived = ArchivedSubmission.objects.get(id=42)
+        self.assertEqual(archived.grader_reply, 'late')
+        self.assertEqual(archived.num_failures, 2)
+        self.assertTrue(archived.retired)
+
+    @patch('submission_queue.consumer.post_grade_to_lms', return_value=True)
+    def test_put_results(self, mock_post_grade_to_lms):
+        """
+        A batch of replies is recorded in one request with a status per reply
+        """
+        submissions = [
+            Submission.objects.create(queue_name='tmp',
+                                      lms_callback_url=f'/{i}',
+                                      xqueue_header='{}',
+                                      xqueue_body='{}',
+                                      pullkey=f'key{i}')
+            for i in range(2)
+        ]
+        replies = [
+            {'xqueue_header': json.dumps({'submission_id': submissions[0].id, 'submission_key': 'key0'}),
+             'xqueue_body': 'graded 0'},
+            {'xqueue_header': json.dumps({'submission_id': submissions[1].id, 'submission_key': 'wrong'}),
+             'xqueue_body': 'graded 1'},
+            {'xqueue_header': json.dumps({'submission_id': 0, 'submission_key': 'key0'}),
+             'xqueue_body': 'graded nothing'},
+            {'xqueue_body': 'no header'},
+            {'xqueue_header': json.dumps({'submission_id': 'abc', 'submission_key': 'key0'}),
+             'xqueue_body': 'bad id'},
+            {'xqueue_header': json.dumps({'submission_id': None, 'submission_key': 'key0'}),
+             'xqueue_body': 'no id'},
+        ]
+
+        client = Client()
+        client.login(**self.credentials)
+        response = client.post('/xqueue/put_results/', {'xqueue_replies': json.dumps(replies)})
+        self.assertEqual(response.status_code, 200)
+        (error, statuses) = parse_xreply(response.content)
+        self.assertEqual(error, 0)
+        self.assertEqual(statuses, [
+            {'return_code': 0, 'content': ''},
+            {'return_code': 1, 'content': 'Incorrect key for submission'},
+            {'return_code': 1, 'content': 'Submission does not exist'},
+            {'return_code': 1, 'content': 'Incorrect reply format'},
+            {'return_code': 1, 'content': 'Incorrect reply format'},
+            {'return_code': 1, 'content': 'Incorrect reply format'},
+        ])
+        mock_post_grade_to_lms.assert_called_once_with('{}', 'graded 0')
+
+        for submission in submissions:
+            submission.refresh_from_db()
+        self.assertTrue(submissions[0].retired)
+        self.assertTrue(submissions[0].lms_ack)
+        self.assertEqual(submissions[0].grader_reply, 'graded 0')
+        self.assertFalse(submissions[1].retired)
+        self.assertEqual(submissions[1].grader_reply, '')
+
+    def test_put_results_invalid(self):
+        client = Client()
+        client.login(**self.credentials)
+        for data in ({}, {'xqueue_replies': 'not json'}, {'xqueue_replies': json.dumps(self.valid_reply)}):
+            response = client.post('/xqueue/put_results/', data)
+            (error, msg) = parse_xreply(response.content)
+            self.assertEqual(error, 1)
+            self.assertEqual(msg, 'Incorrect reply format')
+
+        with override_settings(MAX_RESULTS_PER_PUT=1):
+            response = client.post('/xqueue/put_results/', {'xqueue_replies': json.dumps([self.valid_reply] * 2)})
+            (error, msg) = parse_xreply(response.content)
+            self.assertEqual(error, 1)
+            self.assertEqual(msg, 'At most 1 replies per request')
+
 # We don't test put_result with valid replies further because that's handled by
 # the passive/active graders with fake LMSes already.
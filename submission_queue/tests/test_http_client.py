@@ -0,0 +1,73 @@
+"""
+Tests of the pooled HTTP client.
+"""
+import socket
+import time
+from unittest.mock import Mock, patch
+
+from django.test import SimpleTestCase, override_settings
+
+from submission_queue import http_client
+from submission_queue.consumer import _http_post
+
+
+class TestHttpClient(SimpleTestCase):
+
+    def test_session_is_shared(self):
+        assert http_client.get_session() is http_client.get_session()
+
+    def test_session_rebuilt_after_fork(self):
+        session = http_client.get_session()
+        with patch('submission_queue.http_client.os.getpid', return_value=-1):
+            assert http_client.get_session() is not session
+
+    @override_settings(HTTP_POOL_MAXSIZE=7, HTTP_CONNECT_RETRIES=3)
+    def test_adapter_settings(self):
+        adapter = http_client._build_session().get_adapter('https://lms.example.com/')
+        assert adapter._pool_maxsize == 7
+        assert adapter.max_retries.connect == 3
+        assert adapter.max_retries.read == 0
+
+    @override_settings(REQUESTS_BASIC_AUTH=('user', 'secret'))
+    def test_basic_auth_reused(self):
+        auth = http_client.basic_auth()
+        assert (auth.username, auth.password) == ('user', 'secret')
+        assert http_client.basic_auth() is auth
+
+    @override_settings(REQUESTS_BASIC_AUTH=None)
+    def test_no_basic_auth(self):
+        assert http_client.basic_auth() is None
+
+    @patch('submission_queue.http_client.get_session')
+    def test_http_post_uses_session(self, mock_session):
+        mock_session.return_value.post.return_value.status_code = 200
+        mock_session.return_value.post.return_value.text = 'graded'
+        assert _http_post('http://grader', 'data', 5) == (True, 'graded')
+        mock_session.return_value.post.assert_called_once_with(
+            'http://grader', data='data', auth=None, timeout=5, verify=False)
+
+    def test_adapter_connections_can_be_cut_off(self):
+        adapter = http_client._build_session().get_adapter('https://grader.example.com/')
+        for scheme in ('http', 'https'):
+            pool_class = adapter.poolmanager.pool_classes_by_scheme[scheme]
+            assert issubclass(pool_class.ConnectionCls, http_client._DeadlineConnectionMixin)
+
+    def test_deadline_cancelled_on_exit(self):
+        connection = Mock()
+        with http_client.deadline(0.05) as watchdog:
+            watchdog.watch(connection)
+        time.sleep(0.1)
+        assert not watchdog.expired
+        connection.sock.shutdown.assert_not_called()
+
+    def test_deadline_shuts_down_watched_connections(self):
+        connection = Mock()
+        with http_client.deadline(0.05) as watchdog:
+            watchdog.watch(connection)
+            time.sleep(0.1)
+            assert watchdog.expired
+            connection.sock.shutdown.assert_called_once_with(socket.SHUT_RDWR)
+            # A connection made after the deadline is cut off straight away
+            late = Mock()
+            watchdog.watch(late)
+            late.sock.shutdown.assert_called_once_with(socket.SHUT_RDWR)
@@ -2,14 +2,18 @@
 Run me with:
     pytest submission_queue/tests/test_lms_interface.py
 """
+import hashlib
 import json
 import shutil
+import threading
+import time
 from unittest.mock import patch
 from submission_queue import lms_interface
-from submission_queue.models import Submission
+from submission_queue.models import Submission, SubmissionManifest
 from submission_queue.util import make_hashkey
 
 from django.contrib.auth.models import User
+from django.core import signing
 from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
 from django.test import TransactionTestCase, override_settings
@@ -133,6 +137,179 @@ class TestLMSInterface(TransactionTestCase):
         key = make_hashkey(payload['xqueue_header'] + 'upload')
         self.assertIn(key, files)
 
+        # The full file lists are kept in the manifest table
+        submission = Submission.objects.get()
+        self.assertIn('URL_FOR_EXTERNAL_DICTS', json.loads(submission.s3_urls))
+        manifest = SubmissionManifest.objects.get(submission_id=submission.id)
+        self.assertEqual(json.loads(manifest.keys), {'upload': key})
+        self.assertEqual(list(json.loads(manifest.urls)), ['upload'])
+
+    def test_submit_files_concurrently(self):
+        '''
+        Several submitted files should be uploaded at the same time, and the
+        submission should record the key and URL of every one.
+        '''
+        payload = self.valid_payload.copy()
+        for name in ('a.py', 'b.py', 'c.py'):
+            upload = ContentFile(name, name=name)
+            payload[name] = upload
+
+        # Each upload waits until all three are running, so serial uploads would break the barrier
+        barrier = threading.Barrier(3, timeout=5)
+        upload = lms_interface._upload
+
+        def concurrent_upload(*args):
+            barrier.wait()
+            return upload(*args)
+
+        with patch('submission_queue.lms_interface._upload', concurrent_upload):
+            response = self._submit(payload)
+        self.assertEqual(response['return_code'], 0)  # success
+
+        submission = Submission.objects.get()
+        keys = json.loads(submission.s3_keys)
+        urls = json.loads(submission.s3_urls)
+        self.assertEqual(set(keys), {'a.py', 'b.py', 'c.py'})
+        self.assertEqual(set(urls), {'a.py', 'b.py', 'c.py'})
+        _, files = default_storage.listdir('tmp/')
+        for name, key in keys.items():
+            self.assertIn(key, files)
+            self.assertEqual(key, make_hashkey(payload['xqueue_header'] + name))
+
+    def test_upload_files_waits_for_all_before_failing(self):
+        '''
+        A failed upload should fail the submission, but only once the other
+        uploads have finished.
+        '''
+        finished = []
+
+        def upload(file_to_upload, path, name):
+            if file_to_upload == 'bad':
+                raise OSError('storage unavailable')
+            time.sleep(0.1)
+            finished.append(name)
+            return name
+
+        with patch('submission_queue.lms_interface._upload', upload):
+            with self.assertRaises(OSError):
+                lms_interface._upload_files({'bad': 'bad', 'good': 'good'}, 'tmp', 'header')
+        self.assertEqual(finished, [make_hashkey('header' + 'good')])
+
+    @override_settings(UPLOAD_CONTENT_ADDRESSED=True)
+    def test_submit_files_content_addressed(self):
+        '''
+        With content-addressed uploads, files are keyed by the hash of their
+        contents and a file already in storage is not uploaded again.
+        '''
+        for attempt in range(2):
+            payload = self.valid_payload.copy()
+            payload['xqueue_body'] = f'attempt {attempt}'
+            payload['notebook.ipynb'] = ContentFile(b'{"cells": []}', name='notebook.ipynb')
+            payload['extra.py'] = ContentFile(f'# attempt {attempt}', name='extra.py')
+            with patch.object(default_storage, 'save', wraps=default_storage.save) as save:
+                response = self._submit(payload)
+            self.assertEqual(response['return_code'], 0)  # success
+            # The notebook is only written by the first submission
+            self.assertEqual(save.call_count, 2 - attempt)
+
+        first, second = Submission.objects.order_by('id')
+        first_keys, second_keys = json.loads(first.s3_keys), json.loads(second.s3_keys)
+        self.assertEqual(first_keys['notebook.ipynb'], hashlib.sha256(b'{"cells": []}').hexdigest())
+        self.assertEqual(first_keys['notebook.ipynb'], second_keys['notebook.ipynb'])
+        self.assertNotEqual(first_keys['extra.py'], second_keys['extra.py'])
+        self.assertEqual(json.loads(first.s3_urls)['notebook.ipynb'], json.loads(second.s3_urls)['notebook.ipynb'])
+        with default_storage.open('tmp/' + first_keys['notebook.ipynb']) as stored:
+            self.assertEqual(stored.read(), b'{"cells": []}')
+
+    def test_submit_presigned_uploads(self):
+        '''
+        Files put into storage through the upload URLs from get_upload_urls are
+        attached to a submission by their keys.
+        '''
+        client = Client()
+        client.login(**self.credentials)
+        response = client.post('/xqueue/get_upload_urls/', {
+            'xqueue_header': self.valid_payload['xqueue_header'],
+            'filenames': json.dumps(['a.py', 'data.bin']),
+        })
+        (error, targets) = parse_xreply(response.content)
+        self.assertEqual(error, 0)
+        self.assertEqual(set(targets), {'a.py', 'data.bin'})
+
+        # The local stand-in needs no login, only the signed URL
+        contents = {'a.py': b'print(1)', 'data.bin': bytes(range(256))}
+        for filename, target in targets.items():
+            self.assertEqual(target['method'], 'PUT')
+            response = Client().put(target['url'], contents[filename], content_type='application/octet-stream')
+            self.assertEqual(response.status_code, 201)
+
+        payload = self.valid_payload.copy()
+        payload['xqueue_files'] = json.dumps({filename: target['key'] for filename, target in targets.items()})
+        response = self._submit(payload)
+        self.assertEqual(response['return_code'], 0)  # success
+
+        submission = Submission.objects.get()
+        keys = json.loads(submission.s3_keys)
+        self.assertEqual(keys, {filename: target['key'] for filename, target in targets.items()})
+        self.assertEqual(set(json.loads(submission.s3_urls)), {'a.py', 'data.bin'})
+        for filename, key in keys.items():
+            with default_storage.open('tmp/' + key) as stored:
+                self.assertEqual(stored.read(), contents[filename])
+
+    def test_submit_presigned_uploads_invalid_keys(self):
+        '''
+        Only the keys issued for a submission's header can be attached to it.
+        '''
+        for xqueue_files in ('not json', json.dumps(['a.py']), json.dumps({'a.py': 'someone-elses-key'})):
+            payload = self.valid_payload.copy()
+            payload['xqueue_files'] = xqueue_files
+            response = self._submit(payload)
+            self.assertEqual(response['return_code'], 1)
+            self.assertEqual(response['content'], 'Queue request has invalid format')
+        self.assertEqual(Submission.objects.count(), 0)
+
+    def test_get_upload_urls_invalid(self):
+        client = Client()
+        client.login(**self.credentials)
+        response = client.get('/xqueue/get_upload_urls/')
+        self.assertEqual(parse_xreply(response.content), (1, "'get_upload_urls' must use HTTP POST"))
+
+        for data in ({'filenames': '["a.py"]'},
+                     {'xqueue_header': self.valid_payload['xqueue_header']},
+                     {'xqueue_header': self.valid_payload['xqueue_header'], 'filenames': '{"a.py": 1}'}):
+            response = client.post('/xqueue/get_upload_urls/', data)
+            self.assertEqual(parse_xreply(response.content), (1, 'Upload request has invalid format'))
+
+        header = json.dumps({'lms_callback_url': '/', 'lms_key': 'qwerty', 'queue_name': 'nope'})
+        response = client.post('/xqueue/get_upload_urls/', {'xqueue_header': header, 'filenames': '["a.py"]'})
+        self.assertEqual(parse_xreply(response.content), (1, "Queue 'nope' not found"))
+
+    def test_upload_file_rejects_bad_tokens(self):
+        client = Client()
+        response = client.put('/xqueue/upload/forged/', b'data', content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 403)
+
+        token = signing.dumps('tmp/key', salt=lms_interface.UPLOAD_TOKEN_SALT)
+        with override_settings(UPLOAD_PRESIGN_EXPIRE=-1):
+            response = client.put(f'/xqueue/upload/{token}/', b'data', content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(default_storage.exists('tmp/key'))
+
+        response = client.post(f'/xqueue/upload/{token}/', {})
+        self.assertEqual(response.status_code, 405)
+
+    def test_presigned_upload_url_from_storage(self):
+        '''
+        Storage backends that can presign uploads (S3) are asked for the URL.
+        '''
+        class PresigningStorage:
+            def url(self, name, parameters=None, expire=None, http_method=None):
+                return f'https://bucket.example.com/{name}?method={http_method}&expire={expire}'
+
+        with patch('submission_queue.lms_interface.default_storage', PresigningStorage()):
+            url = lms_interface._presigned_upload_url(None, 'tmp/key')
+        self.assertEqual(url, 'https://bucket.example.com/tmp/key?method=PUT&expire=900')
+
     def test_is_valid_request(self):
         '''
         Test Xqueue's ability to evaluate valid request format from LMS
@@ -171,6 +348,86 @@ class TestLMSInterface(TransactionTestCase):
         self.assertEqual(response['return_code'], 1)  # failure
         self.assertEqual(response['content'], 'Queue request has invalid format')
 
+    def test_submit_batch(self):
+        '''
+        A batch submission creates a submission per valid item, retires prior
+        submissions for the same callback URLs and reports a status per item.
+        '''
+        def header(callback, queue_name='tmp'):
+            return json.dumps({'lms_callback_url': callback, 'lms_key': 'qwerty', 'queue_name': queue_name})
+
+        self._submit({'xqueue_header': header('/user/1/'), 'xqueue_body': 'old 1'})
+        self._submit({'xqueue_header': header('/user/3/'), 'xqueue_body': 'old 3'})
+
+        items = [
+            {'xqueue_header': header('/user/1/'), 'xqueue_body': 'new 1'},
+            {'xqueue_header': header('/user/2/'), 'xqueue_body': 'first 2'},
+            {'xqueue_header': header('/user/2/'), 'xqueue_body': 'second 2'},
+            {'xqueue_header': header('/user/4/', 'nope'), 'xqueue_body': 'unknown queue'},
+            {'xqueue_body': 'no header'},
+            'not a submission',
+            {'xqueue_header': header('/user/5/'), 'xqueue_body': 'bad files', 'xqueue_files': '{"a.py": "key"}'},
+            {'xqueue_header': header(5), 'xqueue_body': 'callback not a string'},
+            {'xqueue_header': header('/user/6/'), 'xqueue_body': {'a': 1}},
+            {'xqueue_header': json.loads(header('/user/7/')), 'xqueue_body': 'header not a string'},
+        ]
+        with patch('submission_queue.lms_interface.notify_arrival') as mock_notify:
+            response = self._submit_batch({'xqueue_submissions': json.dumps(items)})
+        self.assertEqual(response['return_code'], 0)
+        invalid = {'return_code': 1, 'content': 'Queue request has invalid format'}
+        self.assertEqual(response['content'], [
+            {'return_code': 0, 'content': '3'},
+            {'return_code': 0, 'content': '3'},
+            {'return_code': 0, 'content': '3'},
+            {'return_code': 1, 'content': "Queue 'nope' not found"},
+            invalid,
+            invalid,
+            invalid,
+            invalid,
+            invalid,
+            invalid,
+        ])
+        mock_notify.assert_called_once_with('tmp')
+
+        queued = Submission.objects.filter(retired=False).order_by('id').values_list('xqueue_body', flat=True)
+        self.assertEqual(list(queued), ['old 3', 'new 1', 'second 2'])
+        self.assertEqual(
+            set(Submission.objects.filter(retired=True).values_list('xqueue_body', flat=True)),
+            {'old 1', 'first 2'},
+        )
+        self.assertEqual(Submission.objects.get_queue_length('tmp'), 3)
+
+    def test_submit_batch_uploaded_files(self):
+        '''
+        Items of a batch can attach files uploaded through get_upload_urls.
+        '''
+        key = make_hashkey(self.valid_payload['xqueue_header'] + 'a.py')
+        item = dict(self.valid_payload, xqueue_files=json.dumps({'a.py': key}))
+        response = self._submit_batch({'xqueue_submissions': json.dumps([item])})
+        self.assertEqual(response['content'], [{'return_code': 0, 'content': '1'}])
+
+        submission = Submission.objects.get()
+        self.assertEqual(json.loads(submission.s3_keys), {'a.py': key})
+        self.assertEqual(json.loads(submission.s3_urls), {'a.py': default_storage.url('tmp/' + key)})
+
+    def test_submit_batch_invalid(self):
+        for data in ({}, {'xqueue_submissions': 'not json'},
+                     {'xqueue_submissions': json.dumps(self.valid_payload)}):
+            response = self._submit_batch(data)
+            self.assertEqual(response, {'return_code': 1, 'content': 'Queue request has invalid format'})
+
+        with override_settings(MAX_SUBMISSIONS_PER_SUBMIT=1):
+            response = self._submit_batch({'xqueue_submissions': json.dumps([self.valid_payload] * 2)})
+            self.assertEqual(response, {'return_code': 1, 'content': 'At most 1 submissions per request'})
+        self.assertEqual(Submission.objects.count(), 0)
+
+    def _submit_batch(self, data):
+        client = Client()
+        client.login(**self.credentials)
+        response = client.post('/xqueue/submit_batch/', data)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content.decode('utf-8'))
+
     def _submit(self, *args, **kwargs):
         client = Client()
         client.login(**self.credentials)
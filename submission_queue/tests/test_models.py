@@ -2,9 +2,14 @@
 Tests of the database models in the ``queue`` application.
 """
 
-from submission_queue.models import Submission
+from datetime import timedelta
+from unittest.mock import patch
 
-from django.test import TestCase
+from submission_queue.models import QueueDepth, Submission
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
 import six
 
 
@@ -20,3 +25,137 @@ class TestSubmission(TestCase):
     def test_text_representation(self):
         submission = Submission(requester_id='Alice', queue_name='Wonderland', xqueue_header='{}')
         assert "Submission from Alice for queue 'Wonderland'" in str(submission)
+
+
+class TestClaimSubmissions(TestCase):
+    """
+    Tests of ``SubmissionManager.claim_unretired_submissions``.
+    """
+    def setUp(self):
+        self.submissions = [
+            Submission.objects.create(queue_name='tmp', lms_callback_url=f'/{i}', xqueue_header='{}')
+            for i in range(3)
+        ]
+
+    def test_claim_oldest_first(self):
+        claimed = Submission.objects.claim_unretired_submissions('tmp', 'grader', limit=2)
+        assert [s.id for s in claimed] == [s.id for s in self.submissions[:2]]
+        for submission in claimed:
+            submission.refresh_from_db()
+            assert submission.grader_id == 'grader'
+            assert submission.pull_time is not None
+            assert submission.pullkey
+
+    def test_claimed_submissions_are_not_claimed_again(self):
+        first = Submission.objects.claim_unretired_submissions('tmp', 'grader', limit=2)
+        second = Submission.objects.claim_unretired_submissions('tmp', 'grader', limit=2)
+        assert [s.id for s in second] == [self.submissions[2].id]
+        assert not set(s.id for s in first) & set(s.id for s in second)
+        assert Submission.objects.claim_unretired_submission('tmp', 'grader') == (False, '')
+
+    def test_lost_race_is_skipped(self):
+        """
+        A row stamped by someone else between our select and our update is not returned
+        """
+        rival = Submission.objects.get(id=self.submissions[0].id)
+
+        def racing_hashkey(seed):
+            if rival.pull_time is None:
+                rival.pull_time = timezone.now()
+                rival.lease_expires_at = rival.pull_time + timedelta(minutes=1)
+                rival.save()
+            return seed
+
+        with patch('submission_queue.models.make_hashkey', side_effect=racing_hashkey), \
+                patch.object(connection.features, 'has_select_for_update_skip_locked', False):
+            claimed = Submission.objects.claim_unretired_submissions('tmp', 'grader', limit=2)
+        assert [s.id for s in claimed] == [self.submissions[1].id]
+
+
+class TestQueueDepth(TestCase):
+    """
+    Tests of the maintained ``QueueDepth`` counters.
+    """
+    def test_arrival_and_retirement(self):
+        submission = Submission.objects.create(queue_name='tmp', lms_callback_url='/', xqueue_header='{}')
+        Submission.objects.create(queue_name='tmp', lms_callback_url='/1', xqueue_header='{}', retired=True)
+        assert Submission.objects.get_queue_length('tmp') == 1
+
+        submission = Submission.objects.get(id=submission.id)
+        submission.grader_reply = 'graded'
+        submission.save()
+        assert Submission.objects.get_queue_length('tmp') == 1
+
+        submission.retired = True
+        submission.save()
+        submission.save()
+        assert Submission.objects.get_queue_length('tmp') == 0
+        assert Submission.objects.get_queue_length('other') == 0
+
+    def test_leased_submissions_are_not_available(self):
+        for i in range(2):
+            Submission.objects.create(queue_name='tmp', lms_callback_url=f'/{i}', xqueue_header='{}')
+        Submission.objects.claim_unretired_submission('tmp', 'grader')
+        assert Submission.objects.get_queue_length('tmp') == 1
+        assert QueueDepth.objects.get_depth('tmp') == 2
+
+        Submission.objects.update(lease_expires_at=timezone.now())
+        assert Submission.objects.get_queue_length('tmp') == 2
+
+    def test_bulk_operations(self):
+        submissions = Submission.objects.bulk_create([
+            Submission(queue_name=queue_name, lms_callback_url='/', xqueue_header='{}')
+            for queue_name in ('tmp', 'tmp', 'other')
+        ])
+        assert Submission.objects.get_queue_length('tmp') == 2
+        assert Submission.objects.get_queue_length('other') == 1
+
+        submissions = list(Submission.objects.all())
+        for submission in submissions:
+            submission.retired = submission.queue_name == 'tmp'
+        Submission.objects.bulk_update(submissions, ['retired'])
+        assert Submission.objects.get_queue_length('tmp') == 0
+        assert Submission.objects.get_queue_length('other') == 1
+
+    def test_reconcile(self):
+        Submission.objects.create(queue_name='tmp', lms_callback_url='/', xqueue_header='{}')
+        Submission.objects.create(queue_name='tmp', lms_callback_url='/1', xqueue_header='{}')
+        QueueDepth.objects.filter(queue_name='tmp').update(depth=7)
+        QueueDepth.objects.create(queue_name='gone', depth=3)
+
+        assert QueueDepth.objects.reconcile() == {'tmp': (7, 2), 'gone': (3, 0)}
+        assert Submission.objects.get_queue_length('tmp') == 2
+        assert Submission.objects.get_queue_length('gone') == 0
+        assert QueueDepth.objects.reconcile() == {}
+
+
+class TestLeases(TestCase):
+    """
+    Tests of submission leases.
+    """
+    def setUp(self):
+        self.submission = Submission.objects.create(queue_name='tmp', lms_callback_url='/', xqueue_header='{}')
+
+    def test_new_submissions_are_available(self):
+        assert list(Submission.objects.available()) == [self.submission]
+
+    @override_settings(SUBMISSION_LEASE_SECONDS={'tmp': 30}, SUBMISSION_PROCESSING_DELAY=5)
+    def test_claim_leases_per_queue(self):
+        before = timezone.now()
+        (_, claimed) = Submission.objects.claim_unretired_submission('tmp', 'grader')
+        assert timedelta(seconds=30) <= claimed.lease_expires_at - before < timedelta(seconds=31)
+        assert not Submission.objects.available().exists()
+        assert Submission.objects.available(claimed.lease_expires_at).get() == self.submission
+
+        other = Submission.objects.create(queue_name='other', lms_callback_url='/1', xqueue_header='{}')
+        claimed = Submission.objects.claim_unpushed_submission('other', 'http://grader')
+        assert claimed == other
+        assert claimed.push_time is not None
+        assert claimed.lease_expires_at - claimed.push_time == timedelta(minutes=5)
+
+    @override_settings(SUBMISSION_LEASE_SECONDS={'tmp': 0})
+    def test_expired_lease_is_claimed_again(self):
+        (_, first) = Submission.objects.claim_unretired_submission('tmp', 'grader')
+        (_, second) = Submission.objects.claim_unretired_submission('tmp', 'grader')
+        assert first == second
+        assert first.pullkey != second.pullkey
@@ -0,0 +1,113 @@
+"""
+Tests of the submission arrival notifications.
+"""
+import threading
+import time
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+
+from submission_queue import notify
+
+
+class NotifierTests:
+    """
+    Behaviour shared by every notifier backend
+    """
+
+    def test_arrival_count(self):
+        assert notify.get_arrival_count('tmp') == 0
+        notify.notify_arrival('tmp')
+        notify.notify_arrival('tmp')
+        assert notify.get_arrival_count('tmp') == 2
+        assert notify.get_arrival_count('other') == 0
+
+    def test_wait_for_arrival_timeout(self):
+        with notify.watching('tmp'):
+            arrived = notify.arrival_event('tmp')
+            notify.notify_arrival('other')
+            assert not arrived.wait(0.2)
+
+    def test_arrival_counts(self):
+        notify.notify_arrival('tmp')
+        assert notify.get_arrival_counts(['tmp', 'other']) == {'tmp': 1, 'other': 0}
+
+    def test_watcher_sets_arrival_event(self):
+        with notify.watching('tmp'), notify.watching('other'):
+            arrived = notify.arrival_event('tmp')
+            other = notify.arrival_event('other')
+            timer = threading.Timer(0.05, notify.notify_arrival, args=('tmp',))
+            timer.start()
+            try:
+                assert arrived.wait(5)
+            finally:
+                timer.cancel()
+            assert not other.is_set()
+            # The next arrival needs a new event
+            assert not notify.arrival_event('tmp').is_set()
+
+    def test_watcher_reads_all_queues_at_once(self):
+        """
+        However many threads wait, the counters are read once per poll interval
+        """
+        def wait(queue_name):
+            with notify.watching(queue_name):
+                notify.arrival_event(queue_name).wait(0.3)
+
+        # A fresh watcher, whose thread isn't in the middle of a sleep from another test
+        with patch('submission_queue.notify._watcher', None), \
+                patch('submission_queue.notify.get_arrival_counts', wraps=notify.get_arrival_counts) as reads:
+            threads = [threading.Thread(target=wait, args=(queue_name,)) for queue_name in ['tmp', 'other'] * 4]
+            for thread in threads:
+                thread.start()
+            time.sleep(0.1)
+            reads.reset_mock()
+            for thread in threads:
+                thread.join()
+
+        # About 0.2 s at a 0.05 s interval, with every watched queue in each read
+        assert 2 <= reads.call_count <= 6
+        assert sorted(reads.call_args_list[0][0][0]) == ['other', 'tmp']
+
+
+@override_settings(ARRIVAL_NOTIFIER='submission_queue.notify.DatabaseNotifier', ARRIVAL_DB_POLL_INTERVAL=0.05)
+class TestDatabaseNotifier(NotifierTests, TransactionTestCase):
+
+    def test_shared(self):
+        assert notify.notifications_are_shared()
+        assert notify.poll_interval() == 0.05
+
+
+@override_settings(ARRIVAL_NOTIFIER='submission_queue.notify.CacheNotifier', ARRIVAL_POLL_INTERVAL=0.05)
+class TestCacheNotifier(NotifierTests, SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_process_local_cache_is_not_shared(self):
+        assert not notify.notifications_are_shared()
+        assert notify.poll_interval() == 0.05
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                                   'LOCATION': '/tmp/xqueue-cache'}}):
+            assert notify.notifications_are_shared()
+
+
+class RecordingNotifier:
+    signals = []
+
+    def notify(self, queue_name):
+        self.signals.append(queue_name)
+
+    def counts(self, queue_names):
+        return {queue_name: self.signals.count(queue_name) for queue_name in queue_names}
+
+
+@override_settings(ARRIVAL_NOTIFIER='submission_queue.tests.test_notify.RecordingNotifier')
+class TestPluggableNotifier(SimpleTestCase):
+
+    def test_custom_notifier(self):
+        since = notify.get_arrival_count('tmp')
+        notify.notify_arrival('tmp')
+        assert RecordingNotifier.signals[-1] == 'tmp'
+        assert notify.get_arrival_count('tmp') == since + 1
@@ -1,8 +1,9 @@
 from django.urls import path
 
 from submission_queue.ext_interface import (get_queuelen, get_submission,
-                                            put_result)
-from submission_queue.lms_interface import submit
+                                            get_submissions, put_result,
+                                            put_results)
+from submission_queue.lms_interface import get_upload_urls, submit, submit_batch, upload_file
 from submission_queue.views import log_in, log_out, status
 
 # General
@@ -17,6 +18,9 @@ urlpatterns = [
 # ------------------------------------------------------------
 urlpatterns += [
     path('submit/', submit),
+    path('submit_batch/', submit_batch),
+    path('get_upload_urls/', get_upload_urls),
+    path('upload/<str:token>/', upload_file, name='upload_file'),
 ]
 
 # External pulling interface
@@ -24,5 +28,7 @@ urlpatterns += [
 urlpatterns += [
     path('get_queuelen/', get_queuelen),
     path('get_submission/', get_submission),
+    path('get_submissions/', get_submissions),
     path('put_result/', put_result),
+    path('put_results/', put_results),
 ]
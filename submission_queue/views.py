@@ -16,6 +16,13 @@ def compose_reply(success, content):
                        'content':     content})
 
 
+def reply_status(success, content):
+    '''
+    Per-item status in the Xqueue reply format, for batch endpoints
+    '''
+    return {'return_code': 0 if success else 1, 'content': content}
+
+
 # Log in
 # --------------------------------------------------
 @csrf_exempt
@@ -422,10 +422,6 @@ class LoggingRequestHandler(BaseHTTPRequestHandler):
     def do_POST(self):
         """Store the request and respond with success"""
 
-        # Send header information
-        self.send_header('Content-type', 'text/plain')
-        self.end_headers()
-
         # Get the length of the request
         length = int(self.headers.getheader('content-length') if six.PY2 else self.headers.get('content-length'))
 
@@ -460,6 +456,10 @@ class LoggingRequestHandler(BaseHTTPRequestHandler):
             # Respond with success
             self.send_response(200)
 
+        # Send header information
+        self.send_header('Content-type', 'text/plain')
+        self.end_headers()
+
     def _parse_post_dict(self, post_dict):
         """`post_dict`: a dict of the form
             `{ POST_PARAM: [ POST_VAL_1, POST_VAL_2, ...], ... }`
@@ -27,12 +27,47 @@ REQUESTS_TIMEOUT = 5    # seconds
 # How long xqueue_consumer should wait for a response from a remote
 # grader before timing out the request.
 GRADING_TIMEOUT = 30    # seconds
-
+# GRADING_TIMEOUT bounds each wait for data, so a grader that trickles its reply
+# can take much longer; this bounds the whole grading request. Override it for
+# a push queue with {'url': URL, 'deadline': seconds} in XQUEUES. It must be
+# shorter than the queue's lease (see SUBMISSION_LEASE_SECONDS); the lease of a
+# pushed submission is stretched to also cover posting its grade to the LMS.
+GRADING_DEADLINE = 45    # seconds
+
+# Queues by name. None marks a pull queue; a push queue is the URL of its grader,
+# or a dict like {'url': URL, 'concurrency': 10} to keep several gradings in
+# flight at once (the default concurrency is 1). To spread a queue over several
+# graders, give a list of URLs instead, or {'urls': [...], 'concurrency': 10};
+# an entry can be weighted as {'url': URL, 'weight': 2}. Each grading goes to
+# the healthy grader with the fewest gradings in flight for its weight.
 XQUEUES = {'test-pull': None}
 
+# Posting grades to the LMS: how many attempts each delivery gets, the base and
+# cap (in seconds) of the jittered exponential backoff between attempts, how many
+# posts may be in flight to a single LMS host, and how many threads deliver
+# batches (outbox, put_results, retire commands) in parallel.
+LMS_DELIVERY_ATTEMPTS = 5
+LMS_DELIVERY_BACKOFF_BASE = 0.5
+LMS_DELIVERY_BACKOFF_MAX = 10
+LMS_DELIVERY_MAX_PER_HOST = 10
+LMS_DELIVERY_WORKERS = 10
+
+# Deliver pull-grader results to the LMS asynchronously. When enabled, put_result
+# stores the grade with an outbox entry and returns immediately, and the
+# run_lms_delivery command must be running to deliver the outbox to the LMS.
+LMS_DELIVERY_OUTBOX = False
+# How many outbox entries a delivery worker claims at once, how long (in
+# seconds) it sleeps when nothing is due, and how long it waits before
+# retrying a failed delivery. Claimed entries are held for long enough that
+# the whole batch can run out of attempts (see delivery.batch_lease).
+LMS_DELIVERY_BATCH_SIZE = 50
+LMS_DELIVERY_POLL_INTERVAL = 1
+LMS_DELIVERY_RETRY_DELAY = 60
+
 # How many times XQueue posting a result back to the LMS can fail
 # This happens during put_submission in the external interface as well
-# as in the retire_submissions command
+# as in the retire_submissions command. Push gradings are also attempted
+# up to this many times.
 MAX_NUMBER_OF_FAILURES = 3
 
 DATABASES = {
@@ -47,9 +82,34 @@ UPLOAD_BUCKET = "s3_bucket"
 UPLOAD_PATH_PREFIX = "xqueue"
 UPLOAD_URL_EXPIRE = 60 * 60 * 24 * 365  # 1 year
 
+# How many files of one submission are uploaded to storage at the same time
+# (per web process). Uploaded files larger than FILE_UPLOAD_MAX_MEMORY_SIZE are
+# spooled to a temporary file by Django rather than held in memory, and storage
+# reads them back in chunks.
+UPLOAD_THREADS = 8
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2621440  # 2.5 MB
+
+# Store uploaded files under the SHA-256 hash of their contents. Identical files
+# (e.g. the same notebook resubmitted) are then written once per queue, and an
+# upload of a file that is already stored is skipped. Stored objects are shared
+# between submissions, so they must not be deleted per submission.
+UPLOAD_CONTENT_ADDRESSED = False
+
+# How long the upload URLs handed out by get_upload_urls stay valid, in seconds
+UPLOAD_PRESIGN_EXPIRE = 60 * 15
+
 # Basic auth tuple to pass to reqests library to authenticate with other services
 REQUESTS_BASIC_AUTH = None
 
+# Pooled HTTP client used for graders, the LMS and file storage: how many hosts
+# keep a connection pool, how many idle keep-alive connections each pool holds
+# (size it to the most requests in flight to one host), and how many times a
+# connection that could not be established is retried, with a backoff factor.
+HTTP_POOL_CONNECTIONS = 20
+HTTP_POOL_MAXSIZE = 50
+HTTP_CONNECT_RETRIES = 2
+HTTP_RETRY_BACKOFF = 0.2
+
 # Local time zone for this installation. Choices can be found here:
 # http://en.wikipedia.org/wiki/List_of_tz_zones_by_name
 # although not all choices may be available on all operating systems.
@@ -134,9 +194,82 @@ LOGGING = get_logger_config(
 # and be processing it.
 SUBMISSION_PROCESSING_DELAY = 1
 
-# Number of seconds to wait between checks for new submissions that need to be
-# sent to an external grader
+# Per-queue lease, in seconds, for which a pulled or pushed submission is hidden
+# from other graders, e.g. {'slow-queue': 900, 'fast-queue': 15}. Queues not
+# listed here use SUBMISSION_PROCESSING_DELAY.
+SUBMISSION_LEASE_SECONDS = {}
+
+# Upper bound on how many submissions a pull grader may claim with a single
+# get_submissions request.
+MAX_SUBMISSIONS_PER_PULL = 50
+
+# Longest a pull grader may ask get_submission(s) to wait for work with the
+# `wait` parameter. Each waiting request holds a web worker, so long-polling is
+# off (0) unless enabled here, and the gunicorn worker pool must be sized for
+# the graders that wait on top of the regular traffic.
+MAX_PULL_WAIT = 0
+# How often (in seconds) arrival notifications are read from the cache when
+# ARRIVAL_NOTIFIER is CacheNotifier.
+ARRIVAL_POLL_INTERVAL = 0.1
+# Waiting pulls are woken by arrival notifications, and also look in the
+# database this often (in seconds) in case a notification was lost.
+PULL_RECHECK_INTERVAL = 10
+
+# Upper bound on how many grader replies may be posted with a single
+# put_results request.
+MAX_RESULTS_PER_PUT = 50
+
+# Upper bound on how many submissions the LMS may post with a single
+# submit_batch request (e.g. when rescoring a course).
+MAX_SUBMISSIONS_PER_SUBMIT = 1000
+
+# Push workers wake up as soon as `submit` signals a new submission through
+# ARRIVAL_NOTIFIER. CONSUMER_DELAY is the number of seconds an idle worker waits
+# before checking the database anyway, in case a signal was lost. When signals
+# reach the consumer (always with DatabaseNotifier, and with CacheNotifier when
+# the cache is shared) the wait doubles while the queue stays empty, up to
+# CONSUMER_MAX_DELAY seconds; otherwise it stays at CONSUMER_DELAY.
 CONSUMER_DELAY = 10
+CONSUMER_MAX_DELAY = 60
+
+# A push grading that fails is retried after PUSH_RETRY_DELAY seconds, doubling
+# for each further failure up to PUSH_RETRY_MAX_DELAY, until the submission has
+# failed MAX_NUMBER_OF_FAILURES times.
+PUSH_RETRY_DELAY = 30
+PUSH_RETRY_MAX_DELAY = 300
+
+# On SIGTERM, push workers stop claiming submissions and wait up to this many
+# seconds for the gradings in flight to finish before exiting.
+CONSUMER_SHUTDOWN_TIMEOUT = 30
+
+# Circuit breaker per push grader URL: after this many consecutive failed
+# gradings the consumer stops sending submissions to the grader and leaves them
+# queued, then lets a single trial grading through every
+# CIRCUIT_BREAKER_RESET_TIMEOUT seconds until one succeeds.
+CIRCUIT_BREAKER_FAILURES = 5
+CIRCUIT_BREAKER_RESET_TIMEOUT = 30
+
+# `run_consumer --cluster` shares the push queues between nodes. Each node sends
+# a heartbeat every CONSUMER_HEARTBEAT_INTERVAL seconds and is considered dead
+# after CONSUMER_NODE_TIMEOUT seconds without one; a queue's owner holds its
+# lease for CONSUMER_QUEUE_LEASE_SECONDS, after which another node takes over.
+CONSUMER_HEARTBEAT_INTERVAL = 5
+CONSUMER_NODE_TIMEOUT = 15
+CONSUMER_QUEUE_LEASE_SECONDS = 15
+
+# `run_consumer --asyncio` serves all push queues from one process. These bound
+# its database connections and the grader/LMS requests it has in flight.
+ASYNC_CONSUMER_DB_THREADS = 10
+ASYNC_CONSUMER_HTTP_THREADS = 50
+
+# Class that carries new-submission signals to waiting graders and consumers.
+# DatabaseNotifier works across processes and hosts with no other setup; each
+# process reads the counters of all the queues it waits on in one query every
+# ARRIVAL_DB_POLL_INTERVAL seconds. To poll a shared cache (CACHES, e.g.
+# memcached) instead, every ARRIVAL_POLL_INTERVAL seconds, use
+# 'submission_queue.notify.CacheNotifier'.
+ARRIVAL_NOTIFIER = 'submission_queue.notify.DatabaseNotifier'
+ARRIVAL_DB_POLL_INTERVAL = 1
 
 # This is normally used in the supervisor configuration but if you have a
 # standalone script, you need to report to the correct app (and aren't